@@ -0,0 +1,212 @@
+import ctypes
+import glob
+import os
+import re
+
+# Spawn-free ALSA capture enumeration.
+#
+# Cards and capture PCMs come from /proc/asound. Hardware parameters (formats,
+# rates, channels) are queried through libasound when it can be loaded, and
+# otherwise read from the USB audio stream descriptors in /proc/asound/cardN/streamM.
+# Both the proc root and the hw params query are injectable for testing.
+
+SND_PCM_STREAM_CAPTURE = 1
+SND_PCM_NONBLOCK = 1
+
+# SND_PCM_FORMAT_* values worth testing for capture
+SND_PCM_FORMATS = list(range(0, 18)) + [32, 33, 34, 35]
+
+# Upper bound on the channel counts offered from a [min, max] range
+MAX_CHANNELS = 32
+
+class LibAsound():
+    __lib = None
+    __loaded = False    # a failed load is kept as None and not retried
+
+    @classmethod
+    def load(cls):
+        if not cls.__loaded:
+            cls.__loaded = True
+            # By soname, find_library spawns ldconfig to look it up
+            try:
+                lib = ctypes.CDLL("libasound.so.2")
+                lib.snd_pcm_format_name.restype = ctypes.c_char_p
+                cls.__lib = lib
+            except OSError as e:
+                print("Unable to load libasound:", e)
+
+        if cls.__lib is None:
+            raise OSError("libasound not found")
+        return cls.__lib
+
+    # Returns {"formats", "rates", "channels"} for an ALSA device name such as hw:1,0
+    @classmethod
+    def hw_params(cls, device):
+        lib = cls.load()
+
+        pcm = ctypes.c_void_p()
+        err = lib.snd_pcm_open(ctypes.byref(pcm), device.encode(), SND_PCM_STREAM_CAPTURE, SND_PCM_NONBLOCK)
+        if err < 0:
+            raise OSError(-err, f"snd_pcm_open({device}) failed")
+
+        params = ctypes.c_void_p()
+        try:
+            err = lib.snd_pcm_hw_params_malloc(ctypes.byref(params))
+            if err < 0:
+                raise OSError(-err, "snd_pcm_hw_params_malloc failed")
+
+            err = lib.snd_pcm_hw_params_any(pcm, params)
+            if err < 0:
+                raise OSError(-err, "snd_pcm_hw_params_any failed")
+
+            value = ctypes.c_uint()
+            direction = ctypes.c_int()
+
+            lib.snd_pcm_hw_params_get_channels_min(params, ctypes.byref(value))
+            channels_min = value.value
+            lib.snd_pcm_hw_params_get_channels_max(params, ctypes.byref(value))
+            channels_max = value.value
+
+            lib.snd_pcm_hw_params_get_rate_min(params, ctypes.byref(value), ctypes.byref(direction))
+            rate_min = value.value
+            lib.snd_pcm_hw_params_get_rate_max(params, ctypes.byref(value), ctypes.byref(direction))
+            rate_max = value.value
+
+            formats = []
+            for format in SND_PCM_FORMATS:
+                if lib.snd_pcm_hw_params_test_format(pcm, params, format) == 0:
+                    name = lib.snd_pcm_format_name(format)
+                    if name:
+                        formats.append(name.decode())
+        finally:
+            if params:
+                lib.snd_pcm_hw_params_free(params)
+            lib.snd_pcm_close(pcm)
+
+        return {
+            "formats": formats,
+            "rates": sorted({rate_min, rate_max}),
+            "channels": channel_range(channels_min, channels_max),
+        }
+
+def channel_range(minimum, maximum):
+    return list(range(max(1, minimum), min(maximum, MAX_CHANNELS) + 1))
+
+def read_text(path):
+    try:
+        with open(path, "r", errors="replace") as f:
+            return f.read()
+    except OSError:
+        return ""
+
+class AlsaProbe():
+    def __init__(self, proc_root="/proc/asound", hw_params=None):
+        self.__root = proc_root
+        self.__hw_params = hw_params if hw_params else LibAsound.hw_params
+
+    def available(self):
+        return os.path.exists(os.path.join(self.__root, "cards"))
+
+    # [{"index", "id", "driver", "name"}]
+    def cards(self):
+        cards = []
+        card_re = re.compile(r"^\s*(\d+)\s+\[(\S+)\s*\]:\s*(\S+)\s+-\s+(.*)$")
+
+        for line in read_text(os.path.join(self.__root, "cards")).splitlines():
+            match = card_re.match(line)
+            if match:
+                index, id, driver, name = match.groups()
+                cards.append({
+                    "index": int(index),
+                    "id": id,
+                    "driver": driver,
+                    "name": name.strip(),
+                })
+
+        return cards
+
+    # Every capture PCM with its hardware parameters, in one pass
+    def capture_devices(self):
+        devices = []
+
+        for card in self.cards():
+            card_dir = os.path.join(self.__root, f"card{card['index']}")
+            for pcm_dir in sorted(glob.glob(os.path.join(card_dir, "pcm*c"))):
+                info = self.__parse_info(read_text(os.path.join(pcm_dir, "info")))
+                device_index = int(info.get("device", re.sub(r"\D", "", os.path.basename(pcm_dir)) or 0))
+
+                device = {
+                    "hw": f"hw:{card['index']},{device_index}",
+                    "card_index": card["index"],
+                    "device_index": device_index,
+                    "card_name": card["name"],
+                    "device_name": info.get("name", ""),
+                }
+                device.update(self.capabilities(card["index"], device_index))
+                devices.append(device)
+
+        return devices
+
+    def capabilities(self, card, device):
+        try:
+            return self.__hw_params(f"hw:{card},{device}")
+        except OSError as e:
+            # Busy, or no libasound. USB devices still describe themselves in /proc.
+            caps = self.__stream_capabilities(card, device)
+            if caps is None:
+                print("Unable to query hw params for", f"hw:{card},{device}", "-", e)
+                caps = {"formats": [], "rates": [], "channels": []}
+            return caps
+
+    def __parse_info(self, text):
+        info = {}
+        for line in text.splitlines():
+            key, sep, value = line.partition(":")
+            if sep:
+                info[key.strip()] = value.strip()
+        return info
+
+    # Parse the Capture section of /proc/asound/cardN/streamM (snd-usb-audio)
+    def __stream_capabilities(self, card, device):
+        text = read_text(os.path.join(self.__root, f"card{card}", f"stream{device}"))
+        if "Capture:" not in text:
+            return None
+
+        capture = text.split("Capture:", 1)[1].split("Playback:", 1)[0]
+
+        formats = []
+        rates = set()
+        channels = set()
+
+        for line in capture.splitlines():
+            key, sep, value = line.strip().partition(":")
+            if not sep:
+                continue
+            value = value.strip()
+
+            if key == "Format":
+                for format in value.split(","):
+                    format = format.strip()
+                    if format and format not in formats:
+                        formats.append(format)
+            elif key == "Channels":
+                channels.add(int(value))
+            elif key == "Rates":
+                match = re.match(r"(\d+)\s*-\s*(\d+)", value)
+                if match:
+                    rates.update(int(x) for x in match.groups())
+                else:
+                    rates.update(int(x) for x in re.findall(r"\d+", value))
+
+        if not channels:
+            return None
+
+        return {
+            "formats": formats,
+            "rates": sorted(rates),
+            "channels": sorted(channels),
+        }
+
+def format_value(name):
+    # ffmpeg style sample format names, matching the stored S16LE default
+    return name.replace("_", "")
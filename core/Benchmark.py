@@ -0,0 +1,245 @@
+import argparse
+import contextlib
+import json
+import os
+import socket
+import sys
+import tempfile
+import time
+
+from PyQt6.QtCore import QCoreApplication, QSettings, QSocketNotifier, QTimer
+
+from core.SettingsManager import SettingsManager
+from core.PlaybackController import PlaybackController
+from core.ProcessMonitor import CLOCK_TICKS, read_cpu_ticks
+from core import OutputProfiles
+
+# Headless end-to-end streaming benchmark.
+#
+# Starts N streams of synthetic sources through PlaybackController into local
+# UDP sinks and reports sustained fps, speed, CPU per ffmpeg process, startup
+# time and bitrate stability as JSON. Runs against a throwaway settings file so
+# the user's configs are never touched.
+
+class UdpSink():
+    def __init__(self, port):
+        self.bytes = 0
+        self.first_packet = None
+
+        self.__socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        self.__socket.bind(("127.0.0.1", port))
+        self.__socket.setblocking(False)
+
+        self.__notifier = QSocketNotifier(self.__socket.fileno(), QSocketNotifier.Type.Read)
+        self.__notifier.activated.connect(self.__read)
+
+    def close(self):
+        self.__notifier.setEnabled(False)
+        self.__socket.close()
+
+    def __read(self):
+        while True:
+            try:
+                data = self.__socket.recv(65536)
+            except BlockingIOError:
+                return
+
+            if self.first_packet is None:
+                self.first_packet = time.monotonic()
+            self.bytes += len(data)
+
+class Benchmark():
+    def __init__(self, args, settings_path):
+        self.__args = args
+
+        self.__settings = SettingsManager(QSettings(settings_path, QSettings.Format.IniFormat))
+        self.__playback = PlaybackController(self.__settings)
+
+        self.__sinks = []
+        self.__streams = []
+
+        # One change notification for the whole set up
+        with self.__settings.transaction():
+            for i in range(args.streams):
+                port = args.port + i
+                self.__sinks.append(UdpSink(port))
+
+                stream_id = self.__settings.add_stream_config({
+                    "enabled": True,
+                    "name": f"Benchmark {i}",
+                    "address": f"udp://127.0.0.1:{port}?pkt_size=1316",
+                    "output_profile": args.profile,
+                })
+                stream_config = self.__settings.get_stream_config(stream_id)
+
+                self.__settings.add_video_config({
+                    "enabled": True,
+                    "name": "Test Pattern",
+                    "device": "lavfi:testsrc2",
+                    "format": "yuv420p",
+                    "width": args.width,
+                    "height": args.height,
+                    "framerate": args.framerate,
+                    "encoder": "libx264",
+                    "crf": args.crf,
+                    "preset": args.preset,
+                    "threads": 0,
+                    "stream": stream_config,
+                })
+
+                if args.audio:
+                    self.__settings.add_audio_config({
+                        "enabled": True,
+                        "name": "Sine Tone",
+                        "device": "lavfi:sine",
+                        "format": "S16LE",
+                        "channels": "2",
+                        "encoder": "opus",
+                        "stream": stream_config,
+                    })
+
+    def run(self):
+        for id in self.__playback.stream_ids():
+            stream = self.__playback.get_stream(id)
+            entry = {
+                "stream": stream,
+                "first_frame": None,
+                "cpu_start": None,
+                "rss_max": 0,
+                "switch_rates": [],
+            }
+            stream.progress.connect(lambda record, e=entry: self.__progress(e, record))
+            stream.resources.connect(lambda sample, e=entry: self.__resources(e, sample))
+            self.__streams.append(entry)
+
+        self.__start = time.monotonic()
+        self.__playback.start_playback()
+
+        QTimer.singleShot(int(self.__args.duration * 1000), self.__finish)
+
+    def __progress(self, entry, record):
+        if entry["first_frame"] is None and record.frame > 0:
+            entry["first_frame"] = time.monotonic()
+            entry["cpu_start"] = (time.monotonic(), read_cpu_ticks(entry["stream"].pid()))
+
+    def __resources(self, entry, sample):
+        if entry["first_frame"] is None or not sample.pid:
+            return
+        entry["rss_max"] = max(entry["rss_max"], sample.rss)
+        entry["switch_rates"].append(sample.context_switch_rate)
+
+    def __finish(self):
+        end = time.monotonic()
+        results = []
+
+        for entry, sink in zip(self.__streams, self.__sinks):
+            stream = entry["stream"]
+            metrics = stream.metrics()
+
+            # Only look at the part after the stream started producing frames
+            window = end - entry["first_frame"] if entry["first_frame"] else self.__args.duration
+            fps = metrics.stats("fps", window)
+            speed = metrics.stats("speed", window)
+            bitrate = metrics.stats("bitrate", window)
+
+            cpu = None
+            if entry["cpu_start"] and entry["cpu_start"][1] is not None:
+                ticks = read_cpu_ticks(stream.pid())
+                if ticks is not None:
+                    cpu = 100.0 * (ticks - entry["cpu_start"][1]) / CLOCK_TICKS / (end - entry["cpu_start"][0])
+
+            received = None
+            if sink.first_packet is not None:
+                received = sink.bytes * 8 / 1000 / max(end - sink.first_packet, 1e-6)
+
+            results.append({
+                "name": stream.config()["name"],
+                "startup_time": entry["first_frame"] - self.__start if entry["first_frame"] else None,
+                "startup_phases": stream.startup_times(),
+                "fps": fps,
+                "speed": speed,
+                "bitrate": bitrate,
+                "bitrate_cv": self.__coefficient_of_variation(metrics, window),
+                "dropped_frames": metrics.delta("drop", window),
+                "cpu_percent": cpu,
+                "rss_max_mb": entry["rss_max"] / 1048576 if entry["rss_max"] else None,
+                "context_switches_per_second": (sum(entry["switch_rates"]) / len(entry["switch_rates"])
+                                                if entry["switch_rates"] else None),
+                "received_kbps": received,
+                "errors": stream.errors() if not fps["count"] else [],
+            })
+
+        self.report = {
+            "streams": self.__args.streams,
+            "duration": self.__args.duration,
+            "width": self.__args.width,
+            "height": self.__args.height,
+            "framerate": self.__args.framerate,
+            "preset": self.__args.preset,
+            "crf": self.__args.crf,
+            "profile": self.__args.profile,
+            "results": results,
+        }
+
+        self.__playback.state_change.connect(self.__stopped)
+        self.__playback.stop_playback()
+        QTimer.singleShot(5000, self.__stopped)
+
+    def __stopped(self, state=False):
+        if state or self.__sinks is None:
+            return
+
+        for sink in self.__sinks:
+            sink.close()
+        self.__sinks = None
+        QCoreApplication.instance().quit()
+
+    # Standard deviation of the bitrate relative to its mean, lower is steadier
+    def __coefficient_of_variation(self, metrics, window):
+        values = metrics.values("bitrate", window)
+        if len(values) < 2:
+            return None
+
+        mean = sum(values) / len(values)
+        if mean <= 0:
+            return None
+
+        variance = sum((v - mean) ** 2 for v in values) / (len(values) - 1)
+        return variance ** 0.5 / mean
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark streaming synthetic sources through PlaybackController.")
+    parser.add_argument("--streams", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=30, help="seconds to stream")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--framerate", type=int, default=30)
+    parser.add_argument("--preset", default="superfast")
+    parser.add_argument("--crf", type=int, default=23)
+    parser.add_argument("--profile", default=OutputProfiles.DEFAULT, choices=list(OutputProfiles.PROFILES),
+                        help="output profile of the streams")
+    parser.add_argument("--audio", action="store_true", help="add a sine tone to every stream")
+    parser.add_argument("--port", type=int, default=5600, help="first local UDP port")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    app = QCoreApplication(sys.argv)
+
+    # Keep stdout for the report, stream logs go to stderr
+    with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(sys.stderr):
+        benchmark = Benchmark(args, os.path.join(directory, "benchmark.ini"))
+        QTimer.singleShot(0, benchmark.run)
+        app.exec()
+
+    report = json.dumps(benchmark.report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
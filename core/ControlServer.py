@@ -0,0 +1,304 @@
+from PyQt6.QtCore import QObject, QProcess, QTimer, pyqtSlot
+from PyQt6.QtNetwork import QTcpServer, QHostAddress
+
+import json
+import math
+from urllib.parse import parse_qs
+
+# Small HTTP API to control and monitor the streams, served from the Qt event loop.
+#
+#   GET  /streams               stream configs with their state
+#   GET  /stats                 live stats of every stream
+#   GET  /metrics               the same in the Prometheus text format
+#   POST /streams/<id>/start    start or stop a single stream
+#   POST /streams/<id>/stop
+#   POST /start, POST /stop     all streams, like the Start button
+#   POST /streams/<id>/save?minutes=N
+#                               join the last N minutes of the stream's local
+#                               recording into a file, answered once it is written
+#
+# Responses are built from snapshots refreshed once per `interval`, so a
+# scrape only copies bytes and never walks the streams. POST requests are only
+# accepted from this machine, other hosts can read but not control.
+
+MAX_REQUEST = 8192
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+}
+
+# Prometheus metric name -> (type, help)
+METRICS = {
+    "pistreamer_playing": ("gauge", "1 while playback is started"),
+    "pistreamer_ready": ("gauge", "1 once every started stream is producing output"),
+    "pistreamer_stream_up": ("gauge", "1 while the stream's ffmpeg process is running"),
+    "pistreamer_stream_ready": ("gauge", "1 while the stream is producing output"),
+    "pistreamer_stream_fps": ("gauge", "Encoded frames per second"),
+    "pistreamer_stream_bitrate_bits_per_second": ("gauge", "Output bitrate"),
+    "pistreamer_stream_speed_ratio": ("gauge", "Encoding speed relative to real time"),
+    "pistreamer_stream_dropped_frames_total": ("counter", "Frames dropped since the process started"),
+    "pistreamer_stream_quality_level": ("gauge", "Step on the adaptive quality ladder, 0 is the configured quality"),
+    "pistreamer_stream_restarts_total": ("counter", "Automatic restarts"),
+    "pistreamer_stream_exits_total": ("counter", "Unexpected ffmpeg exits"),
+    "pistreamer_stream_stalls_total": ("counter", "Restarts because no frames arrived"),
+    "pistreamer_stream_downtime_seconds_total": ("counter", "Time spent waiting for a restart"),
+    "pistreamer_stream_cpu_percent": ("gauge", "CPU usage of the ffmpeg process, 100 is one core"),
+    "pistreamer_stream_resident_memory_bytes": ("gauge", "Resident memory of the ffmpeg process"),
+    "pistreamer_stream_threads": ("gauge", "Threads of the ffmpeg process"),
+    "pistreamer_stream_context_switches_per_second": ("gauge", "Context switches of the ffmpeg process"),
+    "pistreamer_stream_read_bytes_per_second": ("gauge", "Bytes read by the ffmpeg process"),
+    "pistreamer_stream_write_bytes_per_second": ("gauge", "Bytes written by the ffmpeg process"),
+}
+
+# "8080" or "0.0.0.0:8080" -> (address, port), localhost unless given
+def parse_listen(text):
+    address, _, port = str(text).rpartition(":")
+    return address or "127.0.0.1", int(port)
+
+# Config without the back references to the stream and the GUI's items
+def _describe(config):
+    data = {key: value for key, value in config.items() if key not in ("stream", "display_item")}
+    for kind in ("video_configs", "audio_configs"):
+        if kind in data:
+            data[kind] = [_describe(source) for source in data[kind]]
+    return data
+
+# Sample value at full precision, counters and byte sizes can't be rounded
+def _format_value(value):
+    if isinstance(value, int):
+        return str(int(value))
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+class ControlServer(QObject):
+    def __init__(self, playback, interval=1000):
+        super().__init__()
+
+        self.__playback = playback
+        self.__buffers = {}     # socket -> request received so far
+        self.__saving = set()   # sockets waiting for a replay to be saved
+
+        self.__snapshot = {}    # path -> (content type, body)
+
+        self.__server = QTcpServer(self)
+        self.__server.newConnection.connect(self.__new_connection)
+
+        self.__timer = QTimer(self)
+        self.__timer.setInterval(interval)
+        self.__timer.timeout.connect(self.__refresh)
+
+    def listen(self, address="127.0.0.1", port=8080):
+        if not self.__server.listen(QHostAddress(address), port):
+            print("Unable to start control server on", f"{address}:{port}", "-", self.__server.errorString())
+            return False
+
+        print("Control server listening on", f"http://{address}:{port}/")
+        self.__refresh()
+        self.__timer.start()
+        return True
+
+    def close(self):
+        self.__timer.stop()
+        self.__server.close()
+
+    @pyqtSlot()
+    def __new_connection(self):
+        while self.__server.hasPendingConnections():
+            socket = self.__server.nextPendingConnection()
+            self.__buffers[socket] = b""
+            socket.readyRead.connect(lambda socket=socket: self.__read(socket))
+            socket.disconnected.connect(lambda socket=socket: self.__closed(socket))
+
+    def __closed(self, socket):
+        self.__buffers.pop(socket, None)
+        self.__saving.discard(socket)
+        socket.deleteLater()
+
+    def __read(self, socket):
+        if socket not in self.__buffers:
+            return
+
+        data = self.__buffers[socket] + bytes(socket.readAll())
+        self.__buffers[socket] = data
+        if len(data) > MAX_REQUEST:
+            self.__respond(socket, 413, {"error": "request too large"})
+            return
+
+        # Only the request line matters, bodies aren't used
+        if b"\r\n\r\n" not in data and b"\n\n" not in data:
+            return
+
+        try:
+            method, target = data.split(b"\n", 1)[0].decode("ascii").split()[:2]
+        except (UnicodeDecodeError, ValueError):
+            self.__respond(socket, 400, {"error": "malformed request"})
+            return
+
+        path, _, query = target.partition("?")
+        self.__handle(socket, method, path.rstrip("/") or "/", parse_qs(query))
+
+    def __handle(self, socket, method, path, query):
+        if method == "GET":
+            if path not in self.__snapshot:
+                self.__respond(socket, 404, {"error": "not found"})
+                return
+            content_type, body = self.__snapshot[path]
+            self.__send(socket, 200, content_type, body)
+            return
+
+        if method != "POST":
+            self.__respond(socket, 405, {"error": "use GET or POST"})
+            return
+
+        if not socket.peerAddress().isLoopback():
+            self.__respond(socket, 403, {"error": "control is only allowed from localhost"})
+            return
+
+        parts = path.strip("/").split("/")
+        if parts in (["start"], ["stop"]):
+            if parts[0] == "start":
+                self.__playback.start_playback()
+            else:
+                self.__playback.stop_playback()
+        elif len(parts) == 3 and parts[0] == "streams" and parts[2] in ("start", "stop") and parts[1].isdigit():
+            id = int(parts[1])
+            if id not in self.__playback.stream_ids():
+                self.__respond(socket, 404, {"error": f"no stream {id}"})
+                return
+            if parts[2] == "start":
+                self.__playback.start_stream(id)
+            else:
+                self.__playback.stop_stream(id)
+        elif len(parts) == 3 and parts[0] == "streams" and parts[2] == "save" and parts[1].isdigit():
+            id = int(parts[1])
+            minutes = query.get("minutes", ["5"])[-1]
+            if id not in self.__playback.stream_ids():
+                self.__respond(socket, 404, {"error": f"no stream {id}"})
+                return
+            if not minutes.isdigit() or int(minutes) < 1:
+                self.__respond(socket, 400, {"error": "minutes must be a positive number"})
+                return
+
+            # Later data on the connection is ignored while the file is written
+            self.__buffers.pop(socket, None)
+            self.__saving.add(socket)
+            self.__playback.save_replay(id, int(minutes), lambda path, socket=socket: self.__replay_saved(socket, path))
+            return
+        else:
+            self.__respond(socket, 404, {"error": "not found"})
+            return
+
+        self.__refresh()
+        self.__respond(socket, 200, {"playing": self.__playback.state()})
+
+    def __replay_saved(self, socket, path):
+        # The client may have given up in the meantime
+        if socket not in self.__saving:
+            return
+        self.__saving.discard(socket)
+        if path:
+            self.__respond(socket, 200, {"path": path})
+        else:
+            self.__respond(socket, 404, {"error": "nothing recorded"})
+
+    def __respond(self, socket, status, data):
+        self.__send(socket, status, "application/json", json.dumps(data).encode() + b"\n")
+
+    def __send(self, socket, status, content_type, body):
+        self.__buffers.pop(socket, None)
+        header = (f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                  f"Content-Type: {content_type}\r\n"
+                  f"Content-Length: {len(body)}\r\n"
+                  "Connection: close\r\n\r\n")
+        socket.write(header.encode() + body)
+        socket.disconnectFromHost()
+
+    def __refresh(self):
+        streams = []
+        stats = []
+        for id in self.__playback.stream_ids():
+            stream = self.__playback.get_stream(id)
+            supervisor = self.__playback.get_supervisor(id)
+            config = stream.config()
+            metrics = stream.metrics()
+            usage = stream.resource_usage()
+
+            state = {
+                "id": id,
+                "name": config.get("name", "Unknown"),
+                "enabled": bool(config["enabled"]),
+                "running": stream.state() != QProcess.ProcessState.NotRunning,
+                "phase": stream.phase(),
+                "ready": stream.ready(),
+                "error": stream.plan_error(),
+            }
+            streams.append(dict(state, config=_describe(config)))
+            stats.append(dict(state,
+                fps=metrics.latest("fps"),
+                bitrate=metrics.latest("bitrate"),
+                speed=metrics.latest("speed"),
+                drop=metrics.latest("drop"),
+                quality_level=stream.quality_level(),
+                cpu_percent=usage.cpu_percent,
+                rss=usage.rss,
+                threads=usage.threads,
+                context_switch_rate=usage.context_switch_rate,
+                read_rate=usage.read_rate,
+                write_rate=usage.write_rate,
+                **supervisor.stats()))
+
+        status = {"playing": self.__playback.state(), "ready": self.__playback.is_ready()}
+        self.__snapshot = {
+            "/": ("application/json", json.dumps(dict(status, endpoints=["/streams", "/stats", "/metrics"])).encode() + b"\n"),
+            "/streams": ("application/json", json.dumps(dict(status, streams=streams), default=str).encode() + b"\n"),
+            "/stats": ("application/json", json.dumps(dict(status, streams=stats), default=str).encode() + b"\n"),
+            "/metrics": ("text/plain; version=0.0.4", self.__prometheus(status, stats).encode()),
+        }
+
+    def __prometheus(self, status, stats):
+        samples = {name: [] for name in METRICS}
+        samples["pistreamer_playing"].append(("", int(status["playing"])))
+        samples["pistreamer_ready"].append(("", int(status["ready"])))
+
+        for entry in stats:
+            labels = f'{{stream="{_escape_label(entry["name"])}",id="{entry["id"]}"}}'
+            values = {
+                "pistreamer_stream_up": int(entry["running"]),
+                "pistreamer_stream_ready": int(entry["ready"]),
+                "pistreamer_stream_fps": entry["fps"],
+                "pistreamer_stream_bitrate_bits_per_second": entry["bitrate"] * 1000,
+                "pistreamer_stream_speed_ratio": entry["speed"],
+                "pistreamer_stream_dropped_frames_total": entry["drop"],
+                "pistreamer_stream_quality_level": entry["quality_level"],
+                "pistreamer_stream_restarts_total": entry["restarts"],
+                "pistreamer_stream_exits_total": entry["exits"],
+                "pistreamer_stream_stalls_total": entry["stalls"],
+                "pistreamer_stream_downtime_seconds_total": entry["downtime"],
+                "pistreamer_stream_cpu_percent": entry["cpu_percent"],
+                "pistreamer_stream_resident_memory_bytes": entry["rss"],
+                "pistreamer_stream_threads": entry["threads"],
+                "pistreamer_stream_context_switches_per_second": entry["context_switch_rate"],
+                "pistreamer_stream_read_bytes_per_second": entry["read_rate"],
+                "pistreamer_stream_write_bytes_per_second": entry["write_rate"],
+            }
+            for name, value in values.items():
+                samples[name].append((labels, value))
+
+        lines = []
+        for name, (kind, help) in METRICS.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines += [f"{name}{labels} {_format_value(value)}" for labels, value in samples[name]]
+        return "\n".join(lines) + "\n"
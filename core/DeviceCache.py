@@ -0,0 +1,190 @@
+import glob
+import json
+import os
+import re
+import threading
+
+# On-disk cache of probed device capabilities.
+#
+# Entries are keyed by a stable device identity (sysfs bus path plus USB
+# vendor/product/serial). Each entry also remembers the node it was probed
+# through and that node's fingerprint (path, device number and ctime). Replugging
+# a device recreates its node, which changes the fingerprint and invalidates the
+# entry.
+
+CACHE_VERSION = 4
+
+def default_cache_path():
+    base = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(base, "PiStreamer", "devices.json")
+
+def node_fingerprint(node):
+    try:
+        st = os.stat(node)
+    except OSError:
+        return None
+    return [node, st.st_rdev, st.st_ctime_ns]
+
+def read_sysfs(path):
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+def sysfs_identity(device_dir, extra=""):
+    try:
+        bus_path = os.path.realpath(os.path.join(device_dir, "device"), strict=True)
+    except OSError:
+        return None
+
+    # Walk up to the USB device that owns this interface, if any
+    vendor = product = serial = ""
+    path = bus_path
+    while path.startswith("/sys/devices") and path != "/sys/devices":
+        if os.path.exists(os.path.join(path, "idVendor")):
+            vendor = read_sysfs(os.path.join(path, "idVendor"))
+            product = read_sysfs(os.path.join(path, "idProduct"))
+            serial = read_sysfs(os.path.join(path, "serial"))
+            break
+        path = os.path.dirname(path)
+
+    return f"{bus_path}|{vendor}:{product}|{serial}|{extra}"
+
+def video_identity(node):
+    name = os.path.basename(node)
+    device_dir = os.path.join("/sys/class/video4linux", name)
+    # A single camera usually exposes several nodes, index tells them apart
+    return sysfs_identity(device_dir, "v4l:" + read_sysfs(os.path.join(device_dir, "index")))
+
+def alsa_pcm_node(device):
+    match = re.fullmatch(r"(?:plug)?hw:(\d+),(\d+)", device or "")
+    if not match:
+        return None, None
+    card, pcm = match.groups()
+    return f"/dev/snd/pcmC{card}D{pcm}c", (card, pcm)
+
+def alsa_identity(device):
+    node, ids = alsa_pcm_node(device)
+    if node is None:
+        return None, None
+    card, pcm = ids
+    return node, sysfs_identity(f"/sys/class/sound/card{card}", "pcm:" + pcm)
+
+class DeviceCache():
+    def __init__(self, path=None):
+        self.__path = path if path else default_cache_path()
+        self.__entries = {}
+        self.__load()
+
+    def get_video(self, node, kind):
+        return self.__get(node, video_identity(node), kind)
+
+    def put_video(self, node, kind, value):
+        self.__put(node, video_identity(node), kind, value)
+
+    def get_audio(self, device, kind):
+        node, identity = alsa_identity(device)
+        return self.__get(node, identity, kind)
+
+    def put_audio(self, device, kind, value):
+        node, identity = alsa_identity(device)
+        self.__put(node, identity, kind, value)
+
+    # The card list isn't tied to one device, it is keyed on every capture PCM node instead
+    def get_audio_devices(self):
+        return self.__get_global("alsa:devices", self.__alsa_fingerprint())
+
+    def put_audio_devices(self, value):
+        self.__put_global("alsa:devices", self.__alsa_fingerprint(), value)
+
+    # Drop entries whose nodes have disappeared or been recreated
+    def prune(self):
+        stale = []
+        for identity, entry in self.__entries.items():
+            if entry.get("node") and node_fingerprint(entry["node"]) != entry["fingerprint"]:
+                stale.append(identity)
+
+        for identity in stale:
+            del self.__entries[identity]
+
+        if stale:
+            self.save()
+
+    def save(self):
+        data = {
+            "version": CACHE_VERSION,
+            "entries": self.__entries
+        }
+
+        try:
+            os.makedirs(os.path.dirname(self.__path), exist_ok=True)
+            # Unique temp name, planners on worker threads can save at the same time
+            temp = f"{self.__path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp, "w") as f:
+                json.dump(data, f)
+            os.replace(temp, self.__path)
+        except OSError as e:
+            print("Unable to write device cache:", e)
+
+    # Returns (hit, value)
+    def __get(self, node, identity, kind):
+        if node is None or identity is None:
+            return False, None
+
+        entry = self.__entries.get(identity)
+        if entry is None:
+            return False, None
+
+        fingerprint = node_fingerprint(node)
+        if fingerprint is None or fingerprint != entry["fingerprint"]:
+            # Node disappeared or was recreated
+            del self.__entries[identity]
+            self.save()
+            return False, None
+
+        if kind not in entry["data"]:
+            return False, None
+
+        return True, entry["data"][kind]
+
+    def __put(self, node, identity, kind, value):
+        if node is None or identity is None:
+            return
+
+        fingerprint = node_fingerprint(node)
+        if fingerprint is None:
+            return
+
+        entry = self.__entries.get(identity)
+        if entry is None or entry["fingerprint"] != fingerprint:
+            entry = {"node": node, "fingerprint": fingerprint, "data": {}}
+            self.__entries[identity] = entry
+
+        entry["data"][kind] = value
+        self.save()
+
+    def __get_global(self, key, fingerprint):
+        entry = self.__entries.get(key)
+        if entry is None or entry["fingerprint"] != fingerprint:
+            return False, None
+        return True, entry["data"]
+
+    def __put_global(self, key, fingerprint, value):
+        self.__entries[key] = {"node": None, "fingerprint": fingerprint, "data": value}
+        self.save()
+
+    def __alsa_fingerprint(self):
+        return [node_fingerprint(node) for node in sorted(glob.glob("/dev/snd/pcmC*D*c"))]
+
+    def __load(self):
+        try:
+            with open(self.__path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if data.get("version") != CACHE_VERSION:
+            return
+
+        self.__entries = data.get("entries", {})
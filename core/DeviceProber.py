@@ -0,0 +1,92 @@
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal, pyqtSlot
+
+import itertools
+import traceback
+
+class ProbeJob(QRunnable):
+    def __init__(self, prober, job_id, func, args, timeout):
+        super().__init__()
+        self.setAutoDelete(False)
+
+        self.job_id = job_id
+        self.cancelled = False
+
+        self.__prober = prober
+        self.__func = func
+        self.__args = args
+        self.__timeout = timeout
+
+    def run(self):
+        # Still reported when cancelled, the prober keeps the job until then
+        result = None
+        if not self.cancelled:
+            try:
+                result = self.__func(*self.__args, timeout=self.__timeout)
+            except Exception:
+                print("Probe failed:")
+                traceback.print_exc()
+
+        # Results are delivered on the prober's (GUI) thread via a queued signal
+        self.__prober.job_finished.emit(self.job_id, result)
+
+class DeviceProber(QObject):
+    # Signals
+    job_finished = pyqtSignal(int, object)  # job id, result
+
+    __instance = None
+
+    def __init__(self, max_threads=4):
+        super().__init__()
+
+        self.__pool = QThreadPool(self)
+        self.__pool.setMaxThreadCount(max_threads)
+
+        self.__ids = itertools.count(1)
+        self.__jobs = {}        # job id -> (job, callback)
+        self.__cancelled = {}   # job id -> job, cancelled while running and kept alive until it returns
+
+        self.job_finished.connect(self.__job_finished)
+
+    @classmethod
+    def instance(cls):
+        if cls.__instance is None:
+            cls.__instance = DeviceProber()
+        return cls.__instance
+
+    # Run func(*args, timeout=timeout) on the worker pool. callback(result) is
+    # called on the GUI thread unless the job is cancelled first.
+    def submit(self, func, *args, callback=None, timeout=1):
+        job_id = next(self.__ids)
+        job = ProbeJob(self, job_id, func, args, timeout)
+        self.__jobs[job_id] = (job, callback)
+        self.__pool.start(job)
+        return job_id
+
+    def cancel(self, job_id):
+        entry = self.__jobs.pop(job_id, None)
+        if entry is None:
+            return
+
+        job, callback = entry
+        job.cancelled = True
+        if not self.__pool.tryTake(job):
+            # Already running, the pool doesn't own it
+            self.__cancelled[job_id] = job
+
+    def pending(self):
+        return len(self.__jobs)
+
+    def wait(self, msecs=-1):
+        return self.__pool.waitForDone(msecs)
+
+    @pyqtSlot(int, object)
+    def __job_finished(self, job_id, result):
+        entry = self.__jobs.pop(job_id, None)
+        if entry is None:
+            # Cancelled while running
+            self.__cancelled.pop(job_id, None)
+            return
+
+        job, callback = entry
+        if callback:
+            callback(result)
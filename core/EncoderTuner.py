@@ -0,0 +1,148 @@
+import json
+import os
+import subprocess
+import sys
+
+from core.FFmpegProgress import ProgressParser
+
+# Finds x264 settings this machine can encode in realtime.
+#
+# Short encodes of a synthetic lavfi source are run at the configured size and
+# frame rate. For every thread count and CRF, presets are tried from fastest to
+# slowest until one can't keep up. The chosen settings are the best quality
+# ones (lowest CRF, then slowest preset) that still run at 1.0x plus headroom.
+
+PRESETS = ["ultrafast", "superfast", "veryfast", "faster", "fast"]
+CRFS = [18, 23, 28]
+
+def thread_options():
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    options = [0]   # 0 lets x264 decide
+    if cores > 1:
+        options.append(max(1, cores - 1))
+    return options
+
+def benchmark(width, height, framerate, preset, crf, threads, duration=4, timeout=30):
+    command = [
+        "ffmpeg", "-hide_banner", "-nostats", "-progress", "pipe:1",
+        "-f", "lavfi",
+        "-i", f"testsrc2=size={width}x{height}:rate={framerate}",
+        "-t", str(duration),
+        "-c:v", "libx264",
+        "-preset", preset,
+        "-tune", "zerolatency",
+        "-crf", str(crf),
+        "-threads", str(threads),
+        "-pix_fmt", "yuv420p",
+        "-f", "null", "-"
+    ]
+
+    try:
+        result = subprocess.run(command, capture_output=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        print("The subprocess timed out!", file=sys.stderr)
+        return 0.0
+
+    records = ProgressParser().feed(result.stdout)
+    if result.returncode != 0 or not records:
+        print("Benchmark failed:", result.stderr.decode("utf-8", errors="replace").strip().splitlines()[-1:], file=sys.stderr)
+        return 0.0
+
+    return records[-1].speed
+
+# Returns None if `cancel` (a threading.Event) is set before it finishes
+def tune(width, height, framerate, headroom=0.15, presets=PRESETS, crfs=CRFS,
+         threads=None, duration=4, timeout=30, report=None, cancel=None):
+    target = 1.0 + headroom
+    results = []
+    best = None
+
+    for thread_count in (threads if threads else thread_options()):
+        for crf in sorted(crfs):
+            for preset in presets:
+                if cancel is not None and cancel.is_set():
+                    return None
+
+                speed = benchmark(width, height, framerate, preset, crf, thread_count, duration, timeout)
+                result = {"preset": preset, "crf": crf, "threads": thread_count, "speed": speed}
+                results.append(result)
+                if report:
+                    report(result)
+
+                if speed < target:
+                    # Slower presets won't keep up either
+                    break
+
+                if best is None or _better(result, best):
+                    best = result
+
+    return {
+        "width": width,
+        "height": height,
+        "framerate": framerate,
+        "target_speed": target,
+        "best": best,
+        "results": results,
+    }
+
+def _better(a, b):
+    if a["crf"] != b["crf"]:
+        return a["crf"] < b["crf"]
+    if a["preset"] != b["preset"]:
+        return PRESETS.index(a["preset"]) > PRESETS.index(b["preset"])
+    return a["speed"] > b["speed"]
+
+# Apply a tuning result to a video config
+def apply(config, best):
+    config["encoder"] = "libx264"
+    config["preset"] = best["preset"]
+    config["crf"] = best["crf"]
+    config["threads"] = best["threads"]
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark x264 presets on this machine.")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--framerate", type=int, default=30)
+    parser.add_argument("--headroom", type=float, default=0.15, help="required speed above 1.0x")
+    parser.add_argument("--duration", type=int, default=4, help="seconds encoded per run")
+    parser.add_argument("--save", type=int, metavar="VIDEO_ID",
+                        help="store the result in this video config, using its size and frame rate")
+    args = parser.parse_args()
+
+    width, height, framerate = args.width, args.height, args.framerate
+
+    settings = None
+    if args.save is not None:
+        from core.SettingsManager import SettingsManager
+        settings = SettingsManager()
+        settings.load_settings()
+        videos = settings.video_configs()
+        if args.save not in [video["id"] for video in videos]:
+            print(f"No video source with id {args.save}, the video sources are:", file=sys.stderr)
+            for video in videos:
+                print(f"    {video['id']}: {video['name']} ({video['stream']['name']})", file=sys.stderr)
+            return 1
+        config = settings.get_video_config(args.save)
+        width, height, framerate = int(config["width"]), int(config["height"]), int(config["framerate"])
+
+    report = lambda r: print(f"{r['preset']:>10} crf {r['crf']:>2} threads {r['threads']}: {r['speed']:.2f}x", file=sys.stderr)
+    result = tune(width, height, framerate, args.headroom, duration=args.duration, report=report)
+    print(json.dumps(result, indent=2))
+
+    if settings is not None:
+        if result["best"] is None:
+            print("No settings keep up, video config not changed", file=sys.stderr)
+            return 1
+
+        config = settings.get_video_config(args.save)
+        apply(config, result["best"])
+        settings.update_video_config(args.save, config)
+        settings.flush()
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
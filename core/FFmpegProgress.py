@@ -0,0 +1,77 @@
+from dataclasses import dataclass
+
+# Incremental parser for ffmpeg's "-progress pipe:1" output.
+#
+# ffmpeg writes one key=value pair per line and terminates every update block
+# with a "progress=continue" (or "progress=end") line. Reads from the pipe can
+# split anywhere, so partial lines are kept until the rest arrives.
+
+@dataclass
+class ProgressRecord:
+    frame: int = 0
+    fps: float = 0.0
+    bitrate: float = 0.0        # kbit/s
+    total_size: int = 0         # bytes
+    out_time_us: int = 0
+    dup_frames: int = 0
+    drop_frames: int = 0
+    speed: float = 0.0
+    progress: str = "continue"
+
+def _int(value):
+    try:
+        return int(value)
+    except ValueError:
+        return 0
+
+def _float(value, suffix=""):
+    value = value.strip()
+    if suffix and value.endswith(suffix):
+        value = value[:-len(suffix)]
+    try:
+        return float(value)
+    except ValueError:
+        # "N/A" until ffmpeg has enough data
+        return 0.0
+
+class ProgressParser():
+    def __init__(self):
+        self.__buffer = b""
+        self.__values = {}
+
+    def reset(self):
+        self.__buffer = b""
+        self.__values = {}
+
+    # Feed raw bytes from the pipe, returns the records completed by them
+    def feed(self, data):
+        records = []
+
+        lines = (self.__buffer + data).split(b"\n")
+        self.__buffer = lines.pop()
+
+        for line in lines:
+            key, sep, value = line.decode("utf-8", errors="replace").strip().partition("=")
+            if not sep:
+                continue
+
+            self.__values[key] = value
+            if key == "progress":
+                records.append(self.__build_record())
+                self.__values = {}
+
+        return records
+
+    def __build_record(self):
+        values = self.__values
+        return ProgressRecord(
+            frame=_int(values.get("frame", "0")),
+            fps=_float(values.get("fps", "0")),
+            bitrate=_float(values.get("bitrate", "0"), "kbits/s"),
+            total_size=_int(values.get("total_size", "0")),
+            out_time_us=_int(values.get("out_time_us", values.get("out_time_ms", "0"))),
+            dup_frames=_int(values.get("dup_frames", "0")),
+            drop_frames=_int(values.get("drop_frames", "0")),
+            speed=_float(values.get("speed", "0"), "x"),
+            progress=values.get("progress", "continue"),
+        )
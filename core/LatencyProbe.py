@@ -0,0 +1,165 @@
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+from PyQt6.QtCore import QCoreApplication, QProcess, QSettings, QTimer
+
+from core.SettingsManager import SettingsManager
+from core.PlaybackController import PlaybackController
+from core import OutputProfiles
+from core import TimestampCode
+
+# End-to-end latency measurement.
+#
+# Streams a source with the wallclock timestamp code burned in (see
+# TimestampCode) through PlaybackController to a local UDP port. A receiving
+# ffmpeg decodes the stream and pipes the code strip of every frame back as raw
+# gray pixels, which are decoded and compared against the local clock. The
+# receiver's own decode time is part of the result, like a real viewer's.
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class LatencyProbe():
+    def __init__(self, args, settings_path):
+        self.__args = args
+        self.__samples = []
+        self.__unreadable = 0
+        self.__buffer = b""
+
+        self.__settings = SettingsManager(QSettings(settings_path, QSettings.Format.IniFormat))
+        self.__playback = PlaybackController(self.__settings)
+
+        stream_id = self.__settings.add_stream_config({
+            "enabled": True,
+            "name": "Latency",
+            "address": f"udp://127.0.0.1:{args.port}?pkt_size=1316",
+            "output_profile": args.profile,
+        })
+        stream_config = self.__settings.get_stream_config(stream_id)
+
+        self.__settings.add_video_config({
+            "enabled": True,
+            "name": "Latency Source",
+            "device": args.device,
+            "format": args.format,
+            "width": args.width,
+            "height": args.height,
+            "framerate": args.framerate,
+            "encoder": "libx264",
+            "crf": args.crf,
+            "preset": args.preset,
+            "threads": 0,
+            "timestamp_overlay": True,
+            "stream": stream_config,
+        })
+
+        self.__receiver = QProcess()
+        self.__receiver.readyReadStandardOutput.connect(self.__handle_frames)
+
+    def run(self):
+        # Start listening before the sender so the first frames aren't missed
+        command = [
+            "-hide_banner", "-loglevel", "error",
+            "-fflags", "nobuffer",
+            "-flags", "low_delay",
+            "-probesize", "32768",
+            "-analyzeduration", "0",
+            "-i", f"udp://127.0.0.1:{self.__args.port}?fifo_size=1000000&overrun_nonfatal=1",
+            "-vf", TimestampCode.receiver_filter(),
+            "-f", "rawvideo",
+            "-flush_packets", "1",
+            "-"
+        ]
+        self.__receiver.start("ffmpeg", command)
+
+        self.__playback.start_playback()
+        QTimer.singleShot(int(self.__args.duration * 1000), self.__finish)
+
+    def __handle_frames(self):
+        now = time.time()
+        self.__buffer += self.__receiver.readAllStandardOutput().data()
+
+        size = TimestampCode.WIDTH * TimestampCode.HEIGHT
+        while len(self.__buffer) >= size:
+            frame, self.__buffer = self.__buffer[:size], self.__buffer[size:]
+
+            code = TimestampCode.decode(frame)
+            latency = TimestampCode.latency_ms(code, now) if code is not None else None
+            if latency is None:
+                self.__unreadable += 1
+            else:
+                self.__samples.append(latency)
+
+    def __finish(self):
+        # Skip the start up, it includes the receiver probing the stream
+        samples = self.__samples[int(self.__args.framerate * self.__args.warmup):]
+        ordered = sorted(samples)
+
+        self.report = {
+            "device": self.__args.device,
+            "width": self.__args.width,
+            "height": self.__args.height,
+            "framerate": self.__args.framerate,
+            "preset": self.__args.preset,
+            "crf": self.__args.crf,
+            "profile": self.__args.profile,
+            "frames": len(ordered),
+            "unreadable_frames": self.__unreadable,
+            "latency_ms": {
+                "min": ordered[0] if ordered else None,
+                "p50": percentile(ordered, 0.50),
+                "p95": percentile(ordered, 0.95),
+                "p99": percentile(ordered, 0.99),
+                "max": ordered[-1] if ordered else None,
+                "mean": sum(ordered) / len(ordered) if ordered else None,
+            },
+        }
+
+        self.__playback.stop_playback()
+        self.__receiver.terminate()
+        self.__receiver.waitForFinished(3000)
+        QTimer.singleShot(1000, QCoreApplication.instance().quit)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure end-to-end streaming latency with a burned-in timestamp code.")
+    parser.add_argument("--device", default="lavfi:testsrc2", help="video device, a camera node or a lavfi: source")
+    parser.add_argument("--format", default="mjpeg", help="input format for camera devices")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to measure")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds of frames to discard at the start")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--framerate", type=int, default=30)
+    parser.add_argument("--preset", default="superfast")
+    parser.add_argument("--crf", type=int, default=23)
+    parser.add_argument("--profile", default=OutputProfiles.DEFAULT, choices=list(OutputProfiles.PROFILES),
+                        help="output profile of the streams")
+    parser.add_argument("--port", type=int, default=5700, help="local UDP port")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    app = QCoreApplication(sys.argv)
+
+    # Keep stdout for the report, stream logs go to stderr
+    with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(sys.stderr):
+        probe = LatencyProbe(args, os.path.join(directory, "latency.ini"))
+        QTimer.singleShot(0, probe.run)
+        app.exec()
+
+    report = json.dumps(probe.report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
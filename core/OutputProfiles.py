@@ -0,0 +1,107 @@
+from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
+
+# Output profiles trade bandwidth and join time against latency.
+#
+# "default" keeps ffmpeg's own muxer buffering and key frame interval. The
+# other profiles flush packets as soon as they are muxed, use a fixed GOP so a
+# receiver joining mid-stream waits at most `gop_seconds` for a picture, and
+# size UDP packets to fit an MTU. "ultra-low-latency" uses x264 intra refresh,
+# which spreads the key frame over the GOP instead of sending large periodic
+# IDR frames, at the cost of some compression efficiency.
+
+DEFAULT = "default"
+
+PROFILES = {
+    "default": {
+        "name": "Default",
+        "input_options": [],
+        "muxer": {},
+        "udp": {},
+        "gop_seconds": None,
+        "intra_refresh": False,
+    },
+    "balanced": {
+        "name": "Balanced",
+        "input_options": [],
+        "muxer": {"flush_packets": "1", "muxdelay": "0.1", "muxpreload": "0.1"},
+        "udp": {"pkt_size": "1316", "buffer_size": "1048576"},
+        "gop_seconds": 2,
+        "intra_refresh": False,
+    },
+    "ultra-low-latency": {
+        "name": "Ultra Low Latency",
+        "input_options": ["-fflags", "nobuffer"],
+        "muxer": {"flush_packets": "1", "muxdelay": "0", "muxpreload": "0"},
+        "udp": {"pkt_size": "1316", "buffer_size": "65536"},
+        "gop_seconds": 1,
+        "intra_refresh": True,
+    },
+}
+
+# AVOption names of the command line muxer options, for tee outputs. Preload
+# has no AVOption, tee outputs start without it.
+TEE_OPTIONS = {"flush_packets": "flush_packets", "muxdelay": "max_delay"}
+
+def get(name):
+    if name in PROFILES:
+        return PROFILES[name]
+    print("Unknown output profile, using default:", name)
+    return PROFILES[DEFAULT]
+
+# Problems with using a profile for a video source, the affected options are left out
+def validate(profile, config):
+    problems = []
+    if profile["gop_seconds"] and config["encoder"] == "copy":
+        problems.append("Key frame interval needs an encoder, not set for copy")
+    if profile["intra_refresh"] and config["encoder"] not in ("copy", "libx264"):
+        problems.append("Intra refresh needs libx264, using periodic key frames")
+    return problems
+
+# Options for every input
+def input_options(profile):
+    return list(profile["input_options"])
+
+# GOP options for a video encoder
+def encoder_options(profile, config):
+    encoder = config["encoder"]
+    if not profile["gop_seconds"] or encoder == "copy":
+        return []
+
+    gop = str(max(1, int(float(config["framerate"]) * profile["gop_seconds"])))
+    if profile["intra_refresh"] and encoder == "libx264":
+        return ["-g", gop, "-intra-refresh", "1"]
+
+    # Key frames at a fixed interval only, not on scene changes
+    options = ["-g", gop, "-keyint_min", gop]
+    if encoder == "libx264":
+        options += ["-sc_threshold", "0"]
+    return options
+
+def muxer_options(profile):
+    options = []
+    for key, value in profile["muxer"].items():
+        options += ["-" + key, value]
+    return options
+
+# Output options of one tee output, e.g. "f=mpegts:flush_packets=1"
+def tee_options(profile, muxer):
+    options = [f"f={muxer}"]
+    for key, value in profile["muxer"].items():
+        if key not in TEE_OPTIONS:
+            continue
+        if key == "muxdelay":
+            # The AVOption takes microseconds
+            value = str(int(float(value) * 1000000))
+        options.append(f"{TEE_OPTIONS[key]}={value}")
+    return ":".join(options)
+
+# Adds the profile's UDP options to an address, options already in it are kept
+def address(profile, url):
+    parsed = urlparse(url)
+    if parsed.scheme != "udp" or not profile["udp"]:
+        return url
+
+    query = parse_qsl(parsed.query, keep_blank_values=True)
+    present = {key for key, value in query}
+    query += [(key, value) for key, value in profile["udp"].items() if key not in present]
+    return urlunparse(parsed._replace(query=urlencode(query)))
@@ -0,0 +1,280 @@
+from dataclasses import dataclass, field
+import os
+import re
+
+from core.DeviceCache import DeviceCache, alsa_pcm_node
+from core.Alsa import AlsaProbe
+from core import V4L2
+from core import SyntheticSources
+
+# Checks a stream's sources against what the devices can do before ffmpeg is
+# spawned for them.
+#
+# A mode the camera doesn't offer otherwise only shows up as ffmpeg exiting
+# after a slow device open. Sizes and frame rates are snapped to the nearest
+# supported mode, anything that can't be fixed (missing device, unsupported
+# format) rejects the stream with a reason. Capabilities come from the
+# DeviceCache when possible. A device that can't be probed is trusted as
+# configured, so a probe problem never stops a stream that would have worked.
+
+@dataclass
+class VideoSource:
+    config: dict
+    device: str
+    format: str
+    width: int
+    height: int
+    framerate: int
+    synthetic: bool
+
+    # The source config with the planned values
+    def planned_config(self):
+        return dict(self.config, format=self.format, width=self.width,
+                    height=self.height, framerate=self.framerate)
+
+@dataclass
+class AudioSource:
+    config: dict
+    device: str
+    channels: int
+    synthetic: bool
+
+    def planned_config(self):
+        return dict(self.config, channels=str(self.channels))
+
+@dataclass
+class StreamPlan:
+    config: dict
+    video: list = field(default_factory=list)           # VideoSource
+    audio: list = field(default_factory=list)           # AudioSource
+    adjustments: list = field(default_factory=list)     # values that were snapped
+    error: str = None                                   # reason the stream can't start
+
+    # The stream config with the planned sources, for building the command
+    def planned_config(self):
+        config = dict(self.config)
+        config["video_configs"] = [source.planned_config() for source in self.video]
+        config["audio_configs"] = [source.planned_config() for source in self.audio]
+        return config
+
+# Plans a group of stream configs, for running on the DeviceProber pool
+def plan_all(configs, timeout=1):
+    planner = PipelinePlanner()
+    plans = [planner.plan(config) for config in configs]
+    reject_conflicts(plans)
+    return plans
+
+# A device shared by several streams is opened once, with the capture settings
+# of the first stream using it. A later stream asking for different settings
+# would silently get the first one's, so it is rejected instead.
+def reject_conflicts(plans):
+    captured = {}   # (kind, device) -> (settings, stream name)
+    for plan in plans:
+        if plan.error:
+            continue
+
+        sources = [("video", source.device, (source.format, source.width, source.height, source.framerate))
+                   for source in plan.video if not source.synthetic]
+        sources += [("audio", source.device, (source.channels,))
+                    for source in plan.audio if not source.synthetic]
+
+        for kind, device, settings in sources:
+            other = captured.get((kind, device))
+            if other and other[0] != settings:
+                plan.error = f"{device} is already captured by {other[1]} with different settings ({_describe_settings(kind, other[0])})"
+                break
+
+        if plan.error:
+            continue
+        for kind, device, settings in sources:
+            captured.setdefault((kind, device), (settings, plan.config.get("name", "Unknown")))
+
+def _describe_settings(kind, settings):
+    if kind == "video":
+        format, width, height, framerate = settings
+        return f"{format} {width}x{height} at {framerate} fps"
+    return f"{settings[0]} channels"
+
+class PipelinePlanner():
+    def __init__(self, cache=None, probe_video=None, probe_audio=None):
+        self.__cache = cache if cache else DeviceCache()
+        self.__probe_video = probe_video if probe_video else self.__video_formats
+        self.__probe_audio = probe_audio if probe_audio else self.__audio_capabilities
+
+    def plan(self, config):
+        plan = StreamPlan(config)
+
+        for video in config["video_configs"]:
+            if video["enabled"]:
+                source = self.__plan_video(plan, video)
+                if source is None:
+                    return plan
+                plan.video.append(source)
+
+        for audio in config["audio_configs"]:
+            if audio["enabled"]:
+                source = self.__plan_audio(plan, audio)
+                if source is None:
+                    return plan
+                plan.audio.append(source)
+
+        return plan
+
+    def __plan_video(self, plan, config):
+        device = config["device"]
+        source = VideoSource(config, device, config["format"], int(config["width"]),
+                             int(config["height"]), int(config["framerate"]),
+                             SyntheticSources.is_synthetic(device))
+        if source.synthetic:
+            return source
+
+        if not os.path.exists(device):
+            plan.error = f"Video device {device} not found"
+            return None
+
+        formats = self.__probe_video(device)
+        if not formats:
+            return source
+
+        names = [format["name"] for format in formats]
+        if source.format not in names:
+            plan.error = f"{device} doesn't support format '{source.format}' (supports {', '.join(names)})"
+            return None
+
+        format = formats[names.index(source.format)]
+        size = self.__snap_size(plan, source, format)
+        if size is not None:
+            self.__snap_framerate(plan, source, size.get("intervals", []))
+
+        return source
+
+    # Returns the size entry the source ended up with, or None if sizes are unknown
+    def __snap_size(self, plan, source, format):
+        sizes = format.get("sizes")
+        if sizes is None:
+            # ffmpeg fallback, only resolution strings
+            sizes = []
+            for text in format.get("resolutions", []):
+                match = re.fullmatch(r"(\d+)x(\d+)", text)
+                if match:
+                    sizes.append({"width": int(match.group(1)), "height": int(match.group(2))})
+        if not sizes:
+            return None
+
+        requested = (source.width, source.height)
+        for size in sizes:
+            if "min_width" in size:
+                # Stepwise range, round into it
+                width = self.__step(source.width, size["min_width"], size["width"], size["step_width"])
+                height = self.__step(source.height, size["min_height"], size["height"], size["step_height"])
+            elif (size["width"], size["height"]) == requested:
+                return size
+            else:
+                continue
+
+            if (width, height) != requested:
+                plan.adjustments.append(f"{source.device}: {requested[0]}x{requested[1]} not supported, using {width}x{height}")
+            source.width, source.height = width, height
+            return size
+
+        # Closest area, then closest aspect ratio
+        def distance(size):
+            return (abs(size["width"] * size["height"] - source.width * source.height),
+                    abs(size["width"] / size["height"] - source.width / source.height))
+
+        size = min(sizes, key=distance)
+        plan.adjustments.append(f"{source.device}: {requested[0]}x{requested[1]} not supported, "
+                                f"using {size['width']}x{size['height']}")
+        source.width, source.height = size["width"], size["height"]
+        return size
+
+    def __snap_framerate(self, plan, source, intervals):
+        requested = source.framerate
+        rates = []
+        for interval in intervals:
+            if interval["type"] == "discrete":
+                seconds = self.__seconds(interval["interval"])
+                if seconds > 0:
+                    rates.append(1 / seconds)
+                continue
+
+            # A range of intervals, the closest one to the requested rate
+            low, high, step = (self.__seconds(interval[key]) for key in ("min", "max", "step"))
+            if low <= 0 or high < low:
+                continue
+            seconds = min(max(1 / requested, low), high) if requested > 0 else high
+            if interval["type"] == "stepwise" and step > 0:
+                seconds = min(low + round((seconds - low) / step) * step, high)
+            rates.append(1 / seconds)
+
+        if not rates:
+            return
+
+        if any(abs(rate - requested) < 0.5 for rate in rates):
+            return
+
+        source.framerate = max(1, int(round(min(rates, key=lambda rate: abs(rate - requested)))))
+        plan.adjustments.append(f"{source.device}: {requested} fps not supported at "
+                                f"{source.width}x{source.height}, using {source.framerate} fps")
+
+    # Seconds per frame of a [numerator, denominator] interval, 0 if invalid
+    def __seconds(self, interval):
+        numerator, denominator = interval
+        return numerator / denominator if numerator > 0 and denominator > 0 else 0
+
+    def __step(self, value, low, high, step):
+        value = min(max(value, low), high)
+        if step > 1:
+            value = low + round((value - low) / step) * step
+        return min(value, high)
+
+    def __plan_audio(self, plan, config):
+        device = config["device"]
+        source = AudioSource(config, device, int(config["channels"]),
+                             SyntheticSources.is_synthetic(device))
+        if source.synthetic:
+            return source
+
+        node, ids = alsa_pcm_node(device)
+        if node is not None and os.path.isdir("/dev/snd") and not os.path.exists(node):
+            plan.error = f"Audio device {device} not found"
+            return None
+
+        caps = self.__probe_audio(device)
+        channels = caps.get("channels") if caps else None
+        if channels and source.channels not in channels:
+            # plughw would convert, but that costs CPU for every sample
+            requested = source.channels
+            source.channels = min(channels, key=lambda count: (abs(count - requested), -count))
+            plan.adjustments.append(f"{device}: {requested} channels not supported, using {source.channels}")
+
+        return source
+
+    def __video_formats(self, device):
+        hit, formats = self.__cache.get_video(device, "formats")
+        if hit:
+            return formats
+
+        try:
+            formats = V4L2.probe_formats(device)
+        except OSError as e:
+            print("V4L2 probe failed for", device, "-", e)
+            return None
+
+        self.__cache.put_video(device, "formats", formats)
+        return formats
+
+    def __audio_capabilities(self, device):
+        hit, caps = self.__cache.get_audio(device, "capabilities")
+        if hit:
+            return caps
+
+        node, ids = alsa_pcm_node(device)
+        alsa = AlsaProbe()
+        if ids is None or not alsa.available():
+            return None
+
+        caps = alsa.capabilities(int(ids[0]), int(ids[1]))
+        if caps is not None:
+            self.__cache.put_audio(device, "capabilities", caps)
+        return caps
@@ -1,7 +1,27 @@
 
 from PyQt6.QtCore import QObject, pyqtSignal, pyqtSlot, QProcess, QSettings, QTimer
-import re
 from urllib.parse import urlparse
+from collections import deque
+import re
+import time
+
+from core.FFmpegProgress import ProgressParser
+from core.StreamMetrics import StreamMetrics
+from core.ProcessMonitor import ProcessMonitor
+from core import OutputProfiles
+from core import ProcessScheduler
+from core import SyntheticSources
+from core.StreamSupervisor import StreamSupervisor
+from core.QualityController import QualityController, apply_level
+from core.DeviceProber import DeviceProber
+from core import TimestampCode
+from core.ReplayBuffer import ReplayBuffer, SEGMENT_SECONDS
+
+# Start up phases of a stream, in order
+PHASES = ("planned", "spawned", "opened", "streaming")
+
+# ffmpeg logs this once an input is open, e.g. "Input #0, video4linux2,v4l2, from '/dev/video0':"
+INPUT_OPENED = re.compile(r"^Input #\d+, .* from '(.*)':")
 
 class PlaybackStream(QObject):
     # Signals
@@ -9,24 +29,187 @@ class PlaybackStream(QObject):
     frame = pyqtSignal(int)
     fps = pyqtSignal(float)
     bitrate = pyqtSignal(float)
+    progress = pyqtSignal(object)   # ProgressRecord
+    phase_changed = pyqtSignal(str) # one of PHASES
+    resources = pyqtSignal(object)  # ProcessSample
 
     def __init__(self, config):
         super().__init__()
 
+        # Stats come from "-progress pipe:1" on stdout, stderr only carries log messages
+        self.__progress = ProgressParser()
+        self.__error_buffer = b""
+        self.__errors = deque(maxlen=20)
+        self.__metrics = StreamMetrics()
+        self.__monitor = ProcessMonitor()
+        self.__monitor.sample.connect(self.resources)
+
         self.__process = QProcess(self)
         self.__process.readyReadStandardOutput.connect(self.__handle_output)
         self.__process.readyReadStandardError.connect(self.__handle_error)
         self.__process.stateChanged.connect(self.__state_changed)
+        self.__process.started.connect(self.__started)
         self.__process.finished.connect(self.__clean_up)
 
         self.__config = config
 
+        # Capture sharing, see PlaybackController.__plan_shared_captures
+        self.__shared = []      # other stream configs served by this process
+        self.__host = None      # stream whose process serves this one
+
+        # Step on the quality ladder, see QualityController
+        self.__quality_level = 0
+
+        # Capability checked version of the config, see PipelinePlanner
+        self.__plan = None
+
+        # Seconds from the start request to each phase and to each input being opened
+        self.__start_time = time.monotonic()
+        self.__phases = {}
+        self.__input_times = {}
+        self.__input_count = 0
+
+        # Cores picked by the controller for cpu_affinity "auto", see ProcessScheduler
+        self.__auto_cpus = None
+        self.__cgroup = None
+
+        # ffmpeg argv of the running process
+        self.__command = None
+
+    def config(self):
+        return self.__config
+
+    def set_config(self, config):
+        self.__config = config
+
+    # ffmpeg argv for the current configs and plan
+    def command(self):
+        return self.__build_command()[0]
+
+    # ffmpeg argv the running process was started with, None if not running
+    def running_command(self):
+        if self.__host:
+            return self.__host.running_command()
+        return self.__command
+
+    def pid(self):
+        if self.__host:
+            return self.__host.pid()
+        return self.__process.processId()
+
     def state(self):
+        if self.__host:
+            return self.__host.state()
         return self.__process.state()
 
+    # Stream whose process serves this one, None if it runs its own
+    def host(self):
+        return self.__host
+
+    def plan(self):
+        return self.__plan
+
+    def set_plan(self, plan):
+        self.__plan = plan
+        if plan is not None:
+            self.__mark_phase("planned")
+
+    def set_auto_cpus(self, cpus):
+        self.__auto_cpus = cpus
+
+    # Start timing a new start up
+    def reset_startup(self):
+        self.__start_time = time.monotonic()
+        self.__phases = {}
+        self.__input_times = {}
+
+    def startup_times(self):
+        if self.__host:
+            return self.__host.startup_times()
+        return dict(self.__phases)
+
+    def input_open_times(self):
+        if self.__host:
+            return self.__host.input_open_times()
+        return dict(self.__input_times)
+
+    # Latest phase reached, "" before planning
+    def phase(self):
+        times = self.startup_times()
+        reached = [phase for phase in PHASES if phase in times]
+        return reached[-1] if reached else ""
+
+    # Producing output right now
+    def ready(self):
+        return self.state() == QProcess.ProcessState.Running and "streaming" in self.startup_times()
+
+    # Reason the stream can't be started, None if it can
+    def plan_error(self):
+        return self.__plan.error if self.__plan else None
+
+    # The config the command is built from
+    def planned_config(self):
+        return self.__plan.planned_config() if self.__plan else self.__config
+
+    # Capture devices used by the enabled sources, e.g. ("video", "/dev/video0")
+    def devices(self):
+        devices = set()
+        if self.__config["enabled"] and not self.plan_error():
+            for kind in ("audio", "video"):
+                for source in self.__config[kind + "_configs"]:
+                    # Generated sources aren't exclusive, every stream can have its own
+                    if source["enabled"] and not SyntheticSources.is_synthetic(source["device"]):
+                        devices.add((kind, source["device"]))
+        return devices
+
+    # Enabled video sources this stream's process encodes, including shared streams
+    def encoded_video_configs(self):
+        configs = [self.__config] + self.__shared
+        return [video for config in configs for video in config["video_configs"] if video["enabled"]]
+
+    def quality_level(self):
+        if self.__host:
+            return self.__host.quality_level()
+        return self.__quality_level
+
+    # Takes effect the next time the process is started
+    def set_quality_level(self, level):
+        self.__quality_level = level
+
+    # Also send the captured devices to these stream's outputs
+    def share_with(self, configs):
+        self.__shared = list(configs)
+
+    # Don't capture, mirror the host stream which captures for us
+    def follow(self, host):
+        if self.__host is host:
+            return
+
+        self.unfollow()
+        self.__host = host
+        host.state_change.connect(self.state_change)
+        host.progress.connect(self.__handle_host_progress)
+        host.phase_changed.connect(self.phase_changed)
+        host.resources.connect(self.resources)
+
+    def unfollow(self):
+        if self.__host is None:
+            return
+
+        self.__host.state_change.disconnect(self.state_change)
+        self.__host.progress.disconnect(self.__handle_host_progress)
+        self.__host.phase_changed.disconnect(self.phase_changed)
+        self.__host.resources.disconnect(self.resources)
+        self.__host = None
+
     def start_playback(self):
         print("Starting Stream:", self.__config.get("name", "Unknown"))
 
+        if self.__host:
+            print("Sharing capture with:", self.__host.config().get("name", "Unknown"))
+            self.__metrics.clear()
+            return
+
         # Don't start if not enabled
         if not self.__config["enabled"]:
             print("Stream disabled")
@@ -39,12 +222,41 @@ class PlaybackStream(QObject):
             self.state_change.emit(False)
             return
 
-        command = ["ffmpeg"] + self.__build_command_string()
+        # Don't spawn ffmpeg for a pipeline the devices can't do
+        if self.plan_error():
+            print("Stream not started:", self.plan_error())
+            self.state_change.emit(False)
+            return
+
+        if self.__plan:
+            for adjustment in self.__plan.adjustments:
+                print("Adjusted:", adjustment)
+
+        # A restart is timed from here, the first start from the controller's request
+        if "spawned" in self.__phases:
+            self.reset_startup()
+            if self.__plan:
+                self.__phases["planned"] = 0.0
+
+        command, self.__input_count = self.__build_command()
+        self.__command = command
+
+        for config in [self.planned_config()] + self.__shared:
+            if config.get("record"):
+                ReplayBuffer.for_config(config).prepare()
+
+        self.__progress.reset()
+        self.__error_buffer = b""
+        self.__errors.clear()
+        self.__metrics.clear()
 
         print("Running: " + " ".join(command))
         self.__process.start(command[0], command[1:])
 
     def stop_playback(self):
+        if self.__host:
+            return
+
         # Check process state
         if self.__process.state() == QProcess.ProcessState.NotRunning:
             return
@@ -52,74 +264,253 @@ class PlaybackStream(QObject):
         # Works for streaming since files don't need to be finalized
         self.__process.terminate()
 
+    # For a process that ignores terminate, e.g. stuck in a device read
+    def kill_playback(self):
+        if self.__host or self.__process.state() == QProcess.ProcessState.NotRunning:
+            return
+
+        print("Killing Stream:", self.__config.get("name", "Unknown"))
+        self.__process.kill()
+
     def __state_changed(self, new_state):
         if new_state == QProcess.ProcessState.NotRunning:
             self.state_change.emit(False)
         else:
             self.state_change.emit(True)
 
+    def metrics(self):
+        return self.__metrics
+
+    # Latest ProcessSample of the process serving this stream
+    def resource_usage(self):
+        if self.__host:
+            return self.__host.resource_usage()
+        return self.__monitor.latest()
+
+    # Last few lines ffmpeg logged, useful when it exits unexpectedly
+    def errors(self):
+        return list(self.__errors)
+
     @pyqtSlot()
     def __handle_output(self):
-        data = self.__process.readAllStandardOutput().data().decode("utf-8")
+        data = self.__process.readAllStandardOutput().data()
+
+        for record in self.__progress.feed(data):
+            self.__publish_progress(record)
+
+    @pyqtSlot(object)
+    def __handle_host_progress(self, record):
+        self.__publish_progress(record)
+
+    def __publish_progress(self, record):
+        # First packets written by the muxer
+        if record.total_size > 0 and not self.__host and "streaming" not in self.__phases:
+            self.__mark_phase("streaming")
+            # Encoder threads only exist once encoding started
+            self.__apply_scheduling()
+
+        self.__metrics.append(time.monotonic(), record.fps, record.bitrate,
+                              record.speed, record.drop_frames)
+        self.progress.emit(record)
+        self.frame.emit(record.frame)
+        self.fps.emit(record.fps)
+        self.bitrate.emit(record.bitrate)
 
     @pyqtSlot()
     def __handle_error(self):
-        data = self.__process.readAllStandardError().data().decode("utf-8")
-
-        # Use regex to extract FPS, frame count, bitrate
-        fps_match = re.search(r'fps=\s*([\d\.]+)', data)
-        frame_match = re.search(r'frame=\s*(\d+)', data)
-        bitrate_match = re.search(r'bitrate=\s*([\d\.]+\w+)', data)
-
-        if fps_match:
-            self.fps.emit(float(fps_match.group(1)))
-        if frame_match:
-            self.frame.emit(int(frame_match.group(1)))
-        if bitrate_match:
-            clean = re.sub(r"[^0-9.]+$", "", bitrate_match.group(1))
-            self.bitrate.emit(float(clean))
-
-    def __clean_up(self):
+        lines = (self.__error_buffer + self.__process.readAllStandardError().data()).split(b"\n")
+        self.__error_buffer = lines.pop()
+
+        for line in lines:
+            line = line.decode("utf-8", errors="replace").rstrip()
+            if line:
+                self.__errors.append(line)
+
+            match = INPUT_OPENED.match(line)
+            if match:
+                self.__input_times[match.group(1)] = time.monotonic() - self.__start_time
+                if len(self.__input_times) >= self.__input_count:
+                    self.__mark_phase("opened")
+
+    # Apply changed CPU, priority and budget settings to the running process.
+    # Realtime priority is only set when the process starts.
+    def reschedule(self):
+        if self.__host or self.__process.state() != QProcess.ProcessState.Running:
+            return
+        self.__apply_scheduling(reset=True)
+        self.__apply_budget()
+
+    @pyqtSlot()
+    def __started(self):
+        self.__mark_phase("spawned")
+        self.__apply_scheduling()
+        self.__apply_budget()
+        self.__monitor.start(self.__process.processId())
+
+    # `reset` also applies the defaults, undoing earlier settings
+    def __apply_scheduling(self, reset=False):
+        pid = self.__process.processId()
+        setting = self.__config.get("cpu_affinity", "auto")
+        try:
+            cpus = ProcessScheduler.parse_cpus(setting)
+        except ValueError:
+            print("Invalid CPU cores, expected e.g. 2,3 or 1-3:", setting)
+            cpus = None
+        if setting == "auto":
+            cpus = self.__auto_cpus
+        if cpus or reset:
+            ProcessScheduler.set_affinity(pid, cpus or ProcessScheduler.available_cpus())
+
+        nice = int(self.__config.get("nice", 0))
+        if nice or reset:
+            ProcessScheduler.set_nice(pid, nice)
+
+        # A realtime encoder could starve everything else, only capture-only audio gets it
+        if self.__config.get("realtime"):
+            if self.encoded_video_configs():
+                print("Realtime priority is only used for audio only streams:", self.__config.get("name", "Unknown"))
+            else:
+                ProcessScheduler.set_realtime(pid)
+
+    def __apply_budget(self):
+        cpu_max = int(self.__config.get("cpu_max", 0))
+        memory_max = int(self.__config.get("memory_max", 0))
+        if not cpu_max and not memory_max and not self.__cgroup:
+            return
+
+        # A renamed stream keeps its cgroup until it restarts
+        cgroup = ProcessScheduler.Cgroup()
+        name = "pistreamer-" + re.sub(r"[^A-Za-z0-9]+", "-", self.__config.get("name", "stream")).strip("-").lower()
+        if self.__cgroup:
+            name = self.__cgroup.rstrip("/").rsplit("/", 1)[-1]
+        path = cgroup.create(name, cpu_max, memory_max)
+        if path and cgroup.add(path, self.__process.processId()):
+            self.__cgroup = path
+
+    def __mark_phase(self, phase):
+        if phase in self.__phases:
+            return
+        self.__phases[phase] = time.monotonic() - self.__start_time
+        self.phase_changed.emit(phase)
+
+    def __clean_up(self, exit_code, exit_status):
+        if exit_code != 0 and exit_status == QProcess.ExitStatus.NormalExit:
+            print("Stream exited with code", exit_code, "-", self.__config.get("name", "Unknown"))
+            for line in self.__errors:
+                print("   ", line)
+
+        self.__monitor.stop()
+        self.__command = None
+
+        if self.__cgroup:
+            ProcessScheduler.Cgroup().remove(self.__cgroup)
+            self.__cgroup = None
+
         self.frame.emit(0)
         self.fps.emit(0)
         self.bitrate.emit(0)
 
-    def __build_command_string(self):
-        cmd = []
-        for audio in self.__config["audio_configs"]:
-            if audio["enabled"]:
-                cmd += self.__build_audio_source_string(audio)
+    # Returns the ffmpeg argv and its number of inputs
+    def __build_command(self):
+        configs = [self.planned_config()] + self.__shared
+        fan_out = len(configs) > 1
 
-        for video in self.__config["video_configs"]:
-            if video["enabled"]:
-                cmd += self.__build_video_source_string(video)
+        profiles = [self.__profile(config) for config in configs]
 
-        for audio in self.__config["audio_configs"]:
-            if audio["enabled"]:
-                cmd += self.__build_audio_encoder_string(audio)
+        # Inputs, a device shared by several streams is only opened once. The
+        # capturing stream's profile decides how they are opened.
+        input_options = OutputProfiles.input_options(profiles[0])
+        cmd = []
+        inputs = {}
+        for config in configs:
+            for audio in config["audio_configs"]:
+                if audio["enabled"] and ("audio", audio["device"]) not in inputs:
+                    inputs[("audio", audio["device"])] = len(inputs)
+                    cmd += input_options + self.__build_audio_source_string(audio)
 
-        for video in self.__config["video_configs"]:
-            if video["enabled"]:
-                cmd += self.__build_video_encoder_string(video)
+        for config in configs:
+            for video in config["video_configs"]:
+                if video["enabled"] and ("video", video["device"]) not in inputs:
+                    inputs[("video", video["device"])] = len(inputs)
+                    cmd += input_options + self.__build_video_source_string(video)
 
-        # Output Options
-        output_address = self.__config["address"]
+        # Overlaid capture times must stay wallclock times, see TimestampCode
+        if any(video["enabled"] and video.get("timestamp_overlay")
+               for config in configs for video in config["video_configs"]):
+            cmd = TimestampCode.global_options() + cmd
+
+        encoders = [self.__build_encoder_string(config, profile, inputs if fan_out else None)
+                    for config, profile in zip(configs, profiles)]
 
         # TODO - add controls for settings the muxer
         muxer = "mpegts"
         #if format == "mjpeg" and encoder == "copy":
         #    muxer = "mjpeg"
 
-        output_options = [
-            "-f",
-            muxer,
-            output_address
-        ]
-        cmd += output_options
+        # Local recordings are another tee output of the encoded packets
+        recordings = [ReplayBuffer.for_config(config).tee_output() if config.get("record") else None
+                      for config in configs]
+
+        # Output Options
+        if fan_out and all(e == encoders[0] for e in encoders):
+            # Same encoding for every stream, encode once and let tee duplicate the packets
+            cmd += encoders[0]
+            cmd += [
+                "-f",
+                "tee",
+                "|".join([f"[{OutputProfiles.tee_options(profile, muxer)}]{OutputProfiles.address(profile, config['address'])}"
+                          for config, profile in zip(configs, profiles)] +
+                         [recording for recording in recordings if recording])
+            ]
+        else:
+            for config, profile, encoder, recording in zip(configs, profiles, encoders, recordings):
+                cmd += encoder
+                if recording:
+                    cmd += [
+                        "-f",
+                        "tee",
+                        f"[{OutputProfiles.tee_options(profile, muxer)}]{OutputProfiles.address(profile, config['address'])}|{recording}"
+                    ]
+                    continue
+                cmd += OutputProfiles.muxer_options(profile)
+                cmd += [
+                    "-f",
+                    muxer,
+                    OutputProfiles.address(profile, config["address"])
+                ]
+
+        return ["ffmpeg", "-hide_banner", "-nostats", "-progress", "pipe:1"] + cmd, len(inputs)
+
+    def __profile(self, config):
+        return OutputProfiles.get(config.get("output_profile", OutputProfiles.DEFAULT))
+
+    # Encoder options for one stream's output. With shared inputs each output
+    # maps its own sources explicitly.
+    def __build_encoder_string(self, config, profile, inputs=None):
+        cmd = []
+        if inputs is not None:
+            for kind, spec in (("audio", "a"), ("video", "v")):
+                for source in config[kind + "_configs"]:
+                    if source["enabled"]:
+                        cmd += ["-map", f"{inputs[(kind, source['device'])]}:{spec}"]
+
+        for audio in config["audio_configs"]:
+            if audio["enabled"]:
+                cmd += self.__build_audio_encoder_string(audio)
+
+        for video in config["video_configs"]:
+            if video["enabled"]:
+                cmd += self.__build_video_encoder_string(video, profile)
 
         return cmd
 
     def __build_video_source_string(self, config):
+        # The latency overlay encodes each frame's wallclock capture time
+        timestamps = TimestampCode.input_options() if config.get("timestamp_overlay") else []
+
+        if SyntheticSources.is_synthetic(config["device"]):
+            return ["-thread_queue_size", "512"] + timestamps + SyntheticSources.video_source_string(config)
+
         # Input options
         device = config["device"]
         format = config["format"]
@@ -132,25 +523,53 @@ class PlaybackStream(QObject):
             "-input_format", format,
             "-video_size", resolution,
             "-framerate", framerate,
+        ] + timestamps + [
             "-i", device,
-            "-r", framerate,
         ]
         return input_options
 
-    def __build_video_encoder_string(self, config):
+    def __build_video_encoder_string(self, config, profile):
         # Encoder Options
+        # Output frame rate. It is an output option, placed here so it can't
+        # end up applying to the next input when several devices are opened.
+        configured = config
+        config = apply_level(config, self.__quality_level)
         encoder = config["encoder"]
-        encoder_options = ["-c:v", encoder]
+        encoder_options = ["-r", str(config["framerate"]), "-c:v", encoder]
+
+        filters = []
+        if config.get("timestamp_overlay"):
+            if encoder == "copy":
+                print("Timestamp overlay needs an encoder, ignored for copy")
+            else:
+                filters.append(TimestampCode.filter_string())
+
+        # Frames -r leaves out count as dropped, which looks like the encoder
+        # falling behind (see QualityController). A frame rate lowered by the
+        # quality ladder is converted by the fps filter instead, as is filtered
+        # video, whose frames -r otherwise counts as dropped at the same rate.
+        if filters or str(config["framerate"]) != str(configured["framerate"]):
+            filters.insert(0, f"fps={config['framerate']}")
+        if filters:
+            encoder_options += ["-vf", ",".join(filters)]
         if encoder == "libx264":
             encoder_options += [
-                "-preset", "superfast",
+                "-preset", config.get("preset", "superfast"),
                 "-tune", "zerolatency",
                 "-crf", str(config["crf"]),
                 "-pix_fmt", "yuv420p"
             ]
+            if int(config.get("threads", 0)) > 0:
+                encoder_options += ["-threads", str(config["threads"])]
+        for problem in OutputProfiles.validate(profile, config):
+            print(problem)
+        encoder_options += OutputProfiles.encoder_options(profile, config)
         return encoder_options
 
     def __build_audio_source_string(self, config):
+        if SyntheticSources.is_synthetic(config["device"]):
+            return ["-thread_queue_size", "512"] + SyntheticSources.audio_source_string(config)
+
         audio_options = [
             "-thread_queue_size", "512",
             "-f", "alsa",
@@ -176,6 +595,7 @@ class PlaybackController(QObject):
     # Signals
     state_change = pyqtSignal(bool)
     bitrate = pyqtSignal(float)
+    ready = pyqtSignal(bool)        # every enabled stream is producing output
     
     def __init__(self, settings):
         super().__init__()
@@ -184,16 +604,38 @@ class PlaybackController(QObject):
         self.__settings.stream_config_added.connect(self.__stream_config_added)
         self.__settings.stream_config_changed.connect(self.__stream_config_changed)
         self.__settings.stream_config_removed.connect(self.__stream_config_removed)
+        self.__settings.configs_changed.connect(self.__configs_changed)
         
-        self.__streams = []
+        # Keyed by the stream config's id, in the order the configs were added
+        self.__streams = {}
+        self.__supervisors = {}
+        self.__quality = {}
 
         self.__state = False
+        self.__ready = False
+        self.__planning = {}    # DeviceProber job id -> streams being planned
+        self.__wanted = []      # streams asked to run, by start_playback or start_stream
+        self.__restarting = None    # (streams to stop, streams to start once they have)
+        self.__replanning = {}  # DeviceProber job id -> running streams checked for changes
+        self.__enabled = {}     # stream id -> enabled, to notice streams being switched on or off
+
+        # Old recording segments are deleted on the worker pool while playing, see ReplayBuffer
+        self.__evicting = set() # stream ids with an eviction job running
+        self.__eviction_timer = QTimer(self)
+        self.__eviction_timer.setInterval(SEGMENT_SECONDS * 1000)
+        self.__eviction_timer.timeout.connect(self.__evict_recordings)
 
     def num_streams(self):
         return len(self.__streams)
 
-    def get_stream(self, index):
-        return self.__streams[index]
+    def stream_ids(self):
+        return list(self.__streams)
+
+    def get_stream(self, id):
+        return self.__streams[id]
+
+    def get_supervisor(self, id):
+        return self.__supervisors[id]
         
     @pyqtSlot()
     def start_playback(self):
@@ -201,62 +643,416 @@ class PlaybackController(QObject):
         print("Start Playback...")
         self.__state = True
         self.state_change.emit(True)
-        for stream in self.__streams:
-            print()
-            stream.start_playback()
+        self.__cancel_planning()
+        self.__restarting = None
+        for quality in self.__quality.values():
+            quality.reset()
+
+        streams = list(self.__streams.values())
+        self.__wanted = [stream for stream in streams if stream.config()["enabled"]]
+        groups = self.__start_streams(streams)
+        self.__assign_cores([group[0] for group in groups])
+
+        self.__update_ready()
     
     @pyqtSlot()
     def stop_playback(self):
         print("Stop Playback...")
-        for stream in self.__streams:
-            stream.stop_playback()
+        self.__cancel_planning()
+        for job in self.__replanning:
+            DeviceProber.instance().cancel(job)
+        self.__replanning = {}
+        self.__restarting = None
+        self.__wanted = []
+        for supervisor in self.__supervisors.values():
+            supervisor.stop()
+        self.__state_changed()
+
+    # Start a single stream, leaving the others running. Streams capturing
+    # from the same devices are restarted with it, one process captures for all.
+    def start_stream(self, id):
+        stream = self.__streams[id]
+        if self.__running(stream) or not stream.config()["enabled"]:
+            return
+
+        print()
+        print("Start Stream:", stream.config().get("name", "Unknown"))
+        self.__wanted.append(stream)
+        self.__quality[id].reset()
+        stream.set_plan(None)
+
+        running = [other for other in self.__streams.values() if other is stream or self.__running(other)]
+        group = next(group for group in self.__device_groups(running) if stream in group)
+        self.__restart_streams(group, group)
+
+    # Stop a single stream, the others sharing its capture are restarted without it
+    def stop_stream(self, id):
+        stream = self.__streams[id]
+        if not self.__running(stream):
+            return
+
+        print("Stop Stream:", stream.config().get("name", "Unknown"))
+        if stream in self.__wanted:
+            self.__wanted.remove(stream)
+
+        group = next((group for group in self.__device_groups([other for other in self.__streams.values() if self.__running(other)])
+                      if stream in group), [stream])
+        for job, planned in list(self.__planning.items()):
+            if stream in planned:
+                DeviceProber.instance().cancel(job)
+                del self.__planning[job]
+        if self.__restarting and stream in self.__restarting[1]:
+            self.__restarting[1].remove(stream)
+
+        self.__supervisors[id].stop()
+        stream.unfollow()
+        stream.share_with([])
+        self.__restart_streams(group, [other for other in group if other is not stream])
+        self.__state_changed()
         
+    # Joins the last `minutes` of a stream's recording into one file on the
+    # worker pool, callback(path) gets None if there was nothing to save
+    def save_replay(self, id, minutes, callback=None):
+        config = self.__streams[id].config()
+        replay = ReplayBuffer.for_config(config)
+        name = config.get("name", "Unknown")
+
+        def saved(path):
+            if path:
+                print("Saved replay:", path)
+            else:
+                print("No recording to save:", name)
+            if callback:
+                callback(path)
+
+        DeviceProber.instance().submit(lambda timeout: replay.save(minutes, name), callback=saved)
+
+    def __evict_recordings(self):
+        for id, stream in self.__streams.items():
+            if not stream.config().get("record") or id in self.__evicting:
+                continue
+            self.__evicting.add(id)
+            replay = ReplayBuffer.for_config(stream.config())
+            DeviceProber.instance().submit(lambda timeout, replay=replay: replay.evict(),
+                                           callback=lambda removed, id=id: self.__evicting.discard(id))
+
     # Return True if running else False
     def state(self):
         return self.__state
-        
-    def __state_changed(self, new_state):
-        # Get State
-        final_state = False
-        for stream in self.__streams:
+
+    def is_ready(self):
+        return self.__ready
+
+    # Start up timing of every stream, see PlaybackStream.startup_times
+    def startup_report(self):
+        report = []
+        for stream in self.__streams.values():
+            if stream.config()["enabled"]:
+                report.append({
+                    "name": stream.config().get("name", "Unknown"),
+                    "phase": stream.phase(),
+                    "phases": stream.startup_times(),
+                    "inputs": stream.input_open_times(),
+                    "error": stream.plan_error(),
+                })
+        return report
+
+    # Spread the capturing processes with cpu_affinity "auto" over the cores
+    def __assign_cores(self, hosts):
+        hosts = [host for host in hosts
+                 if host.config()["enabled"] and host.config().get("cpu_affinity", "auto") == "auto"]
+        for host, cpus in zip(hosts, ProcessScheduler.assign_cores(len(hosts))):
+            host.set_auto_cpus(cpus)
+
+    def __supervisor(self, stream):
+        return self.__supervisors[stream.config()["id"]]
+
+    # Supervised, or waiting to be planned or restarted
+    def __running(self, stream):
+        if self.__supervisor(stream).active():
+            return True
+        if self.__restarting and stream in self.__restarting[1]:
+            return True
+        return any(stream in group for group in self.__planning.values())
+
+    # Stops `stopping` and starts `starting` once their processes have exited,
+    # a new host can only open the devices after the old one released them.
+    def __restart_streams(self, stopping, starting):
+        for stream in stopping:
+            if stream not in starting:
+                continue
+            self.__supervisor(stream).stop()
+            if stream.host() is not None:
+                stream.unfollow()
+
+        # Join a restart that is still waiting
+        if self.__restarting:
+            stopping = self.__restarting[0] + [stream for stream in stopping if stream not in self.__restarting[0]]
+            starting = self.__restarting[1] + [stream for stream in starting if stream not in self.__restarting[1]]
+
+        self.__restarting = (stopping, list(starting))
+        self.__state_changed()
+
+    # Plans and starts every group of streams sharing devices on its own, a
+    # slow device only holds up the streams using it. Returns the groups.
+    def __start_streams(self, streams):
+        for stream in streams:
+            stream.reset_startup()
+            stream.set_plan(None)
+
+        # Device probing (ctypes, V4L2, ALSA) is only loaded once playback starts
+        from core.PipelinePlanner import plan_all
+
+        groups = self.__plan_shared_captures(streams)
+        for group in groups:
+            enabled = [stream for stream in group if stream.config()["enabled"]]
+            for stream in group:
+                if stream not in enabled:
+                    self.__supervisor(stream).start()
+
+            if enabled:
+                job = DeviceProber.instance().submit(plan_all, [stream.config() for stream in enabled],
+                                                     callback=lambda plans, g=enabled: self.__group_planned(g, plans))
+                self.__planning[job] = enabled
+
+        return groups
+
+    def __cancel_planning(self):
+        for job in self.__planning:
+            DeviceProber.instance().cancel(job)
+        self.__planning = {}
+
+    def __group_planned(self, streams, plans):
+        self.__planning = {job: group for job, group in self.__planning.items() if group is not streams}
+        if not self.__state:
+            return
+
+        for stream, plan in zip(streams, plans if plans else [None] * len(streams)):
+            if self.__streams.get(stream.config()["id"]) is stream:
+                stream.set_plan(plan)
+
+        # Rejected or removed streams drop out, the rest may share differently now
+        streams = [stream for stream in streams if self.__streams.get(stream.config()["id"]) is stream]
+        self.__plan_shared_captures(streams)
+        for stream in streams:
+            print()
+            self.__supervisor(stream).start()
+
+        self.__state_changed()
+
+    def __state_changed(self, *args):
+        # Start the streams waiting for the old processes to release their devices
+        if self.__restarting and all(stream.state() == QProcess.ProcessState.NotRunning
+                                     for stream in self.__restarting[0]):
+            starting = self.__restarting[1]
+            self.__restarting = None
+            if starting:
+                self.__start_streams(starting)
+
+        # Get State, a stream waiting to be planned or restarted still counts as running
+        final_state = bool(self.__planning) or bool(self.__restarting)
+        for id, stream in self.__streams.items():
+            supervisor = self.__supervisors[id]
             state = stream.state()
             if state != QProcess.ProcessState.NotRunning:
                 final_state = True
+            elif stream.host() is None and supervisor.active():
+                final_state = True
 
         # Update State
         if final_state != self.__state:
             self.__state = final_state
             self.state_change.emit(self.__state)
+
+        if self.__state and not self.__eviction_timer.isActive():
+            self.__eviction_timer.start()
+        elif not self.__state:
+            self.__eviction_timer.stop()
+
+        self.__update_ready()
+
+    def __phase_changed(self, phase):
+        self.__update_ready()
+
+    def __update_ready(self):
+        expected = [stream for stream in self.__wanted
+                    if stream.config()["enabled"] and not stream.plan_error()]
+        ready = self.__state and not self.__planning and bool(expected) and all(stream.ready() for stream in expected)
+        if ready == self.__ready:
+            return
+
+        self.__ready = ready
+        if ready:
+            print()
+            print("All streams ready:")
+            for entry in self.startup_report():
+                if entry["error"]:
+                    print("   ", entry["name"], "- not started:", entry["error"])
+                    continue
+                inputs = ", ".join(f"{device} {seconds:.2f}s" for device, seconds in entry["inputs"].items())
+                print("   ", entry["name"], "-", f"first output {entry['phases'].get('streaming', 0):.2f}s",
+                      f"(inputs opened: {inputs})" if inputs else "")
+        self.ready.emit(ready)
         
-    @pyqtSlot()
-    def __handle_output(self):
-        data = self.__process.readAllStandardOutput().data().decode("utf-8")
-        
-    @pyqtSlot()
-    def __handle_error(self):
-        data = self.__process.readAllStandardError().data().decode("utf-8")
-
-        # Use regex to extract FPS, frame count, bitrate
-        fps_match = re.search(r'fps=\s*([\d\.]+)', data)
-        frame_match = re.search(r'frame=\s*(\d+)', data)
-        bitrate_match = re.search(r'bitrate=\s*([\d\.]+\w+)', data)
-
-        if fps_match:
-            self.fps.emit(float(fps_match.group(1)))
-        if frame_match:
-            self.frame.emit(int(frame_match.group(1)))
-        if bitrate_match:
-            clean = re.sub(r"[^0-9.]+$", "", bitrate_match.group(1))
-            self.bitrate.emit(float(clean))
-
-    def __stream_config_added(self, index, config):
+    # Capture devices are exclusive, so streams using the same device (directly
+    # or through another stream) are served by a single ffmpeg process. The
+    # first stream of each group hosts the capture and fans out to the others.
+    # Returns the groups, streams without capture devices on their own.
+    def __plan_shared_captures(self, streams):
+        groups = self.__device_groups(streams)
+
+        for stream in streams:
+            stream.unfollow()
+            stream.share_with([])
+
+        for members in groups:
+            host, followers = members[0], members[1:]
+            if followers:
+                print("Sharing capture:", ", ".join(s.config().get("name", "Unknown") for s in members))
+            host.share_with([follower.planned_config() for follower in followers])
+            for follower in followers:
+                follower.follow(host)
+
+        return groups
+
+    # Groups of streams using the same devices, directly or through another stream
+    def __device_groups(self, streams):
+        parent = list(range(len(streams)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        owners = {}
+        for i, stream in enumerate(streams):
+            for device in stream.devices():
+                if device in owners:
+                    parent[find(i)] = find(owners[device])
+                else:
+                    owners[device] = i
+
+        groups = {}
+        for i, stream in enumerate(streams):
+            groups.setdefault(find(i), []).append(stream)
+        return list(groups.values())
+
+    # Applies config changes to the running streams. The new plans and ffmpeg
+    # commands are compared to the running ones and only streams whose command
+    # changed are restarted, e.g. renaming a stream doesn't restart it.
+    def __configs_changed(self):
+        if not self.__state:
+            return
+
+        # Waiting streams are started with the new configs anyway
+        running = [stream for stream in self.__streams.values()
+                   if self.__supervisor(stream).active() and not self.__waiting(stream)]
+        if not running:
+            return
+
+        current = {}
+        for stream in running:
+            current.setdefault(self.__capturing(stream), []).append(stream)
+
+        # A changed device can make streams share a capture or stop sharing it
+        regroup = []
+        unchanged = []
+        for group in self.__device_groups(running):
+            if current.get(group[0]) == group:
+                unchanged.append(group)
+                continue
+            for stream in group:
+                regroup += [other for other in [stream] + current.get(self.__capturing(stream), []) if other not in regroup]
+        unchanged = [group for group in unchanged if not any(stream in regroup for stream in group)]
+
+        if regroup:
+            print("Capture sharing changed, restarting:", ", ".join(s.config().get("name", "Unknown") for s in regroup))
+            self.__restart_streams(regroup, regroup)
+
+        from core.PipelinePlanner import plan_all
+        for job in self.__replanning:
+            DeviceProber.instance().cancel(job)
+        self.__replanning = {}
+        for group in unchanged:
+            job = DeviceProber.instance().submit(plan_all, [stream.config() for stream in group],
+                                                 callback=lambda plans, g=group: self.__replanned(g, plans))
+            self.__replanning[job] = group
+
+    def __replanned(self, streams, plans):
+        self.__replanning = {job: group for job, group in self.__replanning.items() if group is not streams}
+        if not self.__state or not plans:
+            return
+
+        # Stopped, removed or restarted in the meantime
+        if any(self.__streams.get(stream.config()["id"]) is not stream or not self.__supervisor(stream).active()
+               or self.__waiting(stream) for stream in streams):
+            return
+
+        # The restart plans again and leaves out the streams that can't run now
+        if any(plan.error for plan in plans):
+            self.__restart_streams(streams, streams)
+            return
+
+        host = streams[0]
+        running = host.running_command()
+        for stream, plan in zip(streams, plans):
+            stream.set_plan(plan)
+        host.share_with([follower.planned_config() for follower in streams[1:]])
+
+        if host.command() != running:
+            print("Pipeline changed, restarting:", ", ".join(s.config().get("name", "Unknown") for s in streams))
+            self.__supervisor(host).restart()
+
+    # Stream whose process captures for this one
+    def __capturing(self, stream):
+        return stream.host() if stream.host() is not None else stream
+
+    # Waiting to be planned or restarted
+    def __waiting(self, stream):
+        if self.__restarting and (stream in self.__restarting[0] or stream in self.__restarting[1]):
+            return True
+        return any(stream in group for group in self.__planning.values())
+
+    def __stream_config_added(self, id, config):
         stream = PlaybackStream(config)
-        self.__streams.append(stream)
+        supervisor = StreamSupervisor(stream, stall_timeout=int(config.get("stall_timeout", 10)))
+        self.__streams[id] = stream
+        self.__supervisors[id] = supervisor
         stream.state_change.connect(self.__state_changed)
+        stream.phase_changed.connect(self.__phase_changed)
+        supervisor.gave_up.connect(self.__state_changed)
+
+        quality = QualityController(supervisor)
+        quality.set_enabled(bool(config.get("adaptive_quality")))
+        self.__quality[id] = quality
+        self.__enabled[id] = bool(config["enabled"])
+
+    def __stream_config_changed(self, id, config):
+        stream = self.__streams[id]
+        stream.set_config(config)
+        self.__supervisors[id].stall_timeout = int(config.get("stall_timeout", 10))
+        self.__quality[id].set_enabled(bool(config.get("adaptive_quality")))
+
+        # Switched on or off while playing
+        enabled = bool(config["enabled"])
+        if enabled != self.__enabled[id]:
+            self.__enabled[id] = enabled
+            if self.__state and enabled:
+                self.start_stream(id)
+            elif self.__state:
+                self.stop_stream(id)
+            return
 
-    def __stream_config_changed(self, index, config):
-        pass
+        stream.reschedule()
 
-    def __stream_config_removed(self, index):
-        self.__streams.pop(index)
+    def __stream_config_removed(self, id, config):
+        if self.__running(self.__streams[id]):
+            self.stop_stream(id)
+        self.__enabled.pop(id)
+        self.__quality.pop(id)
+        self.__supervisors.pop(id).stop()
+        stream = self.__streams.pop(id)
+        if stream in self.__wanted:
+            self.__wanted.remove(stream)
         
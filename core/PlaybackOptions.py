@@ -1,41 +1,195 @@
-from PyQt6.QtWidgets import QApplication, QWidget, QComboBox, QVBoxLayout
 from PyQt6.QtGui import QStandardItemModel, QStandardItem
 from PyQt6.QtCore import Qt
 
+from core.DeviceProber import DeviceProber
+from core.DeviceCache import DeviceCache
+from core import V4L2
+from core.Alsa import AlsaProbe, format_value
+from core import SyntheticSources
+
 import subprocess
 import glob
 import re
 
+# Probes run on the DeviceProber worker pool. They must not touch Qt objects,
+# only return plain python data which is turned into model rows on the GUI thread.
+# A probe that fails returns None so the failure isn't written to the DeviceCache.
+
+def probe_video_device(device, timeout=1):
+    # Ask the driver directly, v4l2-ctl is only a fallback
+    try:
+        caps = V4L2.probe_device(device)
+        return caps["card"] if caps["capture"] else ""
+    except OSError as e:
+        print("V4L2 probe failed for", device, "-", e, "(falling back to v4l2-ctl)")
+
+    try:
+        result = subprocess.run(
+            ["v4l2-ctl", "--device="+device, "-D"],
+            capture_output=True,
+            text=True,
+            timeout=timeout
+        )
+    except subprocess.TimeoutExpired:
+        print("The subprocess timed out!")
+        return None
+
+    if result.stdout.count("Video Capture\n") > 1:
+        match = re.search(r"Card type\s*:\s*(.+)", result.stdout)
+        return match.group(1) if match else device
+
+    # Not a capture node
+    return ""
+
+def probe_video_formats(device, timeout=1):
+    try:
+        return V4L2.probe_formats(device)
+    except OSError as e:
+        print("V4L2 probe failed for", device, "-", e, "(falling back to ffmpeg)")
+
+    formats = []
+
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-f", "v4l2", "-list_formats", "all", "-i", device],
+            capture_output=True,
+            text=True,
+            timeout=timeout
+        )
+    except subprocess.TimeoutExpired:
+        print("The subprocess timed out!")
+        return None
+
+    # Regex to parse each line
+    line_re = re.compile(r"\] (\w+)\s*:\s*(\w+)\s*:\s*(.+?)\s*:\s*(.+)")
+
+    for line in result.stderr.splitlines():
+        match = line_re.search(line)
+        if match:
+            compressed, simple_name, full_name, res_str = match.groups()
+
+            if simple_name == "Unsupported":
+                continue
+
+            formats.append({
+                "compressed": compressed == "Compressed",
+                "name": simple_name,
+                "description": full_name,
+                "resolutions": res_str.split(),
+            })
+
+    return formats
+
+def probe_audio_devices(timeout=1):
+    # Read /proc/asound directly, arecord is only a fallback
+    alsa = AlsaProbe()
+    if alsa.available():
+        return alsa.capture_devices()
+
+    devices = []
+
+    try:
+        result = subprocess.run(
+            ["arecord", "-l"],
+            capture_output=True,
+            text=True,
+            timeout=timeout
+        )
+    except subprocess.TimeoutExpired:
+        print("The subprocess timed out!")
+        return None
+
+    card_re = re.compile(
+        r"card\s+(?P<card>\d+):\s+(?P<card_name>[^\s]+)\s+\[(?P<card_hr>[^\]]+)\],\s+device\s+(?P<device>\d+):"
+    )
+
+    for line in result.stdout.splitlines():
+        card_match = card_re.search(line)
+        if card_match:
+            card = card_match.group("card")             # Card ID
+            card_hr = card_match.group("card_hr")       # Human readable name
+            device = card_match.group("device")         # Device ID
+            device_hr = ""                              # Device human readable name, placeholder for now
+
+            devices.append({
+                "hw": f"hw:{card},{device}",
+                "card_index": int(card),
+                "device_index": int(device),
+                "card_name": card_hr,
+                "device_name": device_hr,
+            })
+
+    return devices
+
+def probe_audio_capabilities(device, timeout=1):
+    if SyntheticSources.is_synthetic(device):
+        return {"formats": ["S16_LE"], "rates": [48000], "channels": [1, 2]}
+
+    match = re.fullmatch(r"(?:plug)?hw:(\d+),(\d+)", device or "")
+    alsa = AlsaProbe()
+    if match and alsa.available():
+        return alsa.capabilities(int(match.group(1)), int(match.group(2)))
+
+    channels = probe_audio_channels(device, timeout)
+    if channels is None:
+        return None
+
+    return {
+        "formats": ["S16_LE"],
+        "rates": [48000],
+        "channels": channels,
+    }
+
+def probe_audio_channels(device, timeout=1):
+    try:
+        result = subprocess.run(
+            ["arecord", "-D", device, "--dump-hw-params"],
+            capture_output=True,
+            text=True,
+            timeout=timeout
+        )
+    except subprocess.TimeoutExpired:
+        print("The subprocess timed out!")
+        return None
+
+    m = re.search(
+        r"^CHANNELS:\s*(?:\[\s*([0-9\s]+)\s*\]|([0-9]+))",
+        result.stderr,
+        re.MULTILINE
+    )
+
+    if not m:
+        return []
+    elif m.group(1):
+        return [int(x) for x in m.group(1).split()]
+    else:
+        return [int(m.group(2))]
+
 class PlaybackOptions():
-    def __init__(self):
-        pass
+    def __init__(self, prober=None, cache=None, timeout=1):
+        self.__prober = prober
+        self.__cache = cache if cache else DeviceCache()
+        self.__timeout = timeout
+
+        # Outstanding probe jobs, grouped by the model they fill
+        self.__jobs = {}
+
+    # Cancel every outstanding probe. Models keep whatever rows already arrived.
+    def Cancel(self):
+        for key in list(self.__jobs):
+            self.__cancel(key)
 
     def GetDevices(self):
         model = QStandardItemModel()
 
-        found = []
-        devices = glob.glob("/dev/video*")
-        for device in devices:
-            try:
-                result = subprocess.run(
-                    ["v4l2-ctl", "--device="+device, "-D"],
-                    capture_output=True,
-                    text=True,
-                    timeout=1
-                )
-
-                if result.stdout.count("Video Capture\n") > 1:
-                    match = re.search(r"Card type\s*:\s*(.+)", result.stdout)
-                    name = match.group(1) if match else None
-                    found.append( (name+" ("+device+")", device) )
-
-            except subprocess.TimeoutExpired:
-                print("The subprocess timed out!")
-
-        for text, value in found:
-            item = QStandardItem(text)
-            item.setData(value, Qt.ItemDataRole.UserRole)  # store value
-            model.appendRow(item)
+        self.__cancel("devices")
+        self.__cache.prune()
+        for device in sorted(glob.glob("/dev/video*")):
+            self.__cached_video("devices", device, "name", probe_video_device,
+                                lambda name, d=device: self.__add_device(model, d, name))
+
+        for device, name in SyntheticSources.VIDEO_SOURCES.items():
+            self.__add_device(model, device, name)
 
         return model
 
@@ -44,129 +198,151 @@ class PlaybackOptions():
         model = QStandardItemModel()
         model.setHorizontalHeaderLabels(["Compressed", "Simple Name", "Full Name", "Resolutions"])
 
-        try:
-            result = subprocess.run(
-                ["ffmpeg", "-f", "v4l2", "-list_formats", "all", "-i", device],
-                capture_output=True,
-                text=True,
-                timeout=1
-            )
-
-            # Regex to parse each line
-            line_re = re.compile(r"\] (\w+)\s*:\s*(\w+)\s*:\s*(.+?)\s*:\s*(.+)")
+        self.__cancel("formats")
+        if SyntheticSources.is_synthetic(device):
+            self.__add_formats(model, [{
+                "compressed": False,
+                "name": "yuv420p",
+                "description": "Generated",
+                "resolutions": [],
+            }])
+            return model
 
-            for line in result.stderr.splitlines():
-                match = line_re.search(line)
-                if match:
-                    compressed, simple_name, full_name, res_str = match.groups()
-                    resolutions = res_str.split()
-
-                    if simple_name == "Unsupported":
-                        continue
-
-                    compressed = compressed == "Compressed"
-
-                    # Create items
-                    items = [
-                        QStandardItem(compressed),
-                        QStandardItem(simple_name),
-                        QStandardItem(full_name),
-                        QStandardItem(", ".join(resolutions))  # store as string for display
-                    ]
-                    model.appendRow(items)
-
-        except subprocess.TimeoutExpired:
-            print("The subprocess timed out!")
+        self.__cached_video("formats", device, "formats", probe_video_formats,
+                            lambda formats: self.__add_formats(model, formats))
 
         return model
 
     def GetAudioDevices(self):
         model = QStandardItemModel()
-        devices = []
-
-        try:
-            result = subprocess.run(
-                ["arecord", "-l"],
-                capture_output=True,
-                text=True,
-                timeout=1
-            )
-
-            card_re = re.compile(
-                r"card\s+(?P<card>\d+):\s+(?P<card_name>[^\s]+)\s+\[(?P<card_hr>[^\]]+)\],\s+device\s+(?P<device>\d+):"
-            )
-
-            lines = result.stdout.splitlines()
-            i = 0
-
-            while i < len(lines):
-                line = lines[i]
-                card_match = card_re.search(line)
-                if card_match:
-                    card = card_match.group("card")             # Card ID
-                    card_name = card_match.group("card_name")   # Internal name
-                    card_hr = card_match.group("card_hr")       # Human readable name
-                    device = card_match.group("device")         # Device ID
-                    device_hr = ""                              # Device human readable name, placeholder for now
-
-                    devices.append({
-                        "hw": f"hw:{card},{device}",
-                        "card_index": int(card),
-                        "device_index": int(device),
-                        "card_name": card_hr,
-                        "device_name": device_hr,
-                    })
-
-                i += 1
-        except subprocess.TimeoutExpired:
-            print("The subprocess timed out!")
-
-        for device in devices:
-            item = QStandardItem(str(device["card_name"]) + ", " + str(device["device_name"]) + " ("+str(device["hw"])+")")
-            item.setData(device["hw"], Qt.ItemDataRole.UserRole)  # store value
+
+        self.__cancel("audio_devices")
+        for device, name in SyntheticSources.AUDIO_SOURCES.items():
+            item = QStandardItem(name + " (" + device + ")")
+            item.setData(device, Qt.ItemDataRole.UserRole)
             model.appendRow(item)
 
+        hit, devices = self.__cache.get_audio_devices()
+        if hit:
+            self.__add_audio_devices(model, devices)
+        else:
+            def store(devices):
+                if devices is not None:
+                    self.__cache.put_audio_devices(devices)
+                    # The device list already carries each device's hw params
+                    for device in devices:
+                        if "channels" in device:
+                            self.__cache.put_audio(device["hw"], "capabilities", {
+                                "formats": device["formats"],
+                                "rates": device["rates"],
+                                "channels": device["channels"],
+                            })
+                self.__add_audio_devices(model, devices)
+
+            self.__submit("audio_devices", probe_audio_devices, callback=store)
+
         return model
 
     def GetAudioFormats(self, device):
         model = QStandardItemModel()
 
-        item = QStandardItem("S16LE")
-        item.setData("S16LE", Qt.ItemDataRole.UserRole)
-        model.appendRow(item)
+        self.__cancel("audio_formats")
+        self.__cached_audio("audio_formats", device,
+                            lambda caps: self.__add_audio_formats(model, caps))
 
         return model
 
     def GetAudioChannels(self, device):
         model = QStandardItemModel()
 
-        try:
-            result = subprocess.run(
-                ["arecord", "-D", device, "--dump-hw-params"],
-                capture_output=True,
-                text=True,
-                timeout=1
-            )
-
-            m = re.search(
-                r"^CHANNELS:\s*(?:\[\s*([0-9\s]+)\s*\]|([0-9]+))",
-                result.stderr,
-                re.MULTILINE
-            )
-
-            if not m:
-                channels = []
-            elif m.group(1):
-                channels = [int(x) for x in m.group(1).split()]
-            else:
-                channels = [int(m.group(2))]
-
-            for channel in channels:
-                item = QStandardItem(str(channel))
-                item.setData(channel, Qt.ItemDataRole.UserRole)
-                model.appendRow(item)
-
-        except subprocess.TimeoutExpired:
-            print("The subprocess timed out!")
-
-        return model
\ No newline at end of file
+        self.__cancel("audio_channels")
+        self.__cached_audio("audio_channels", device,
+                            lambda caps: self.__add_audio_channels(model, caps))
+
+        return model
+
+    # Fill from the cache when possible, otherwise probe and remember the result
+    def __cached_video(self, key, device, kind, func, callback):
+        hit, value = self.__cache.get_video(device, kind)
+        if hit:
+            callback(value)
+            return
+
+        def store(value):
+            if value is not None:
+                self.__cache.put_video(device, kind, value)
+            callback(value)
+
+        self.__submit(key, func, device, callback=store)
+
+    def __cached_audio(self, key, device, callback):
+        hit, caps = self.__cache.get_audio(device, "capabilities")
+        if hit:
+            callback(caps)
+            return
+
+        def store(caps):
+            if caps is not None:
+                self.__cache.put_audio(device, "capabilities", caps)
+            callback(caps)
+
+        self.__submit(key, probe_audio_capabilities, device, callback=store)
+
+    def __submit(self, key, func, *args, callback):
+        if self.__prober is None:
+            self.__prober = DeviceProber.instance()
+
+        job_ids = self.__jobs.setdefault(key, set())
+
+        def finished(result, job_ids=job_ids):
+            job_ids.discard(job_id)
+            callback(result)
+
+        job_id = self.__prober.submit(func, *args, callback=finished, timeout=self.__timeout)
+        job_ids.add(job_id)
+
+    def __cancel(self, key):
+        for job_id in self.__jobs.pop(key, ()):
+            self.__prober.cancel(job_id)
+
+    def __add_device(self, model, device, name):
+        if not name:
+            return
+
+        item = QStandardItem(name+" ("+device+")")
+        item.setData(device, Qt.ItemDataRole.UserRole)  # store value
+
+        # Results arrive in any order, keep rows sorted by device node
+        row = 0
+        while row < model.rowCount() and model.item(row).data(Qt.ItemDataRole.UserRole) < device:
+            row += 1
+        model.insertRow(row, item)
+
+    def __add_formats(self, model, formats):
+        for format in formats or []:
+            # Create items
+            items = [
+                QStandardItem(format["compressed"]),
+                QStandardItem(format["name"]),
+                QStandardItem(format["description"]),
+                QStandardItem(", ".join(format["resolutions"]))  # store as string for display
+            ]
+            model.appendRow(items)
+
+    def __add_audio_devices(self, model, devices):
+        for device in devices or []:
+            item = QStandardItem(str(device["card_name"]) + ", " + str(device["device_name"]) + " ("+str(device["hw"])+")")
+            item.setData(device["hw"], Qt.ItemDataRole.UserRole)  # store value
+            model.appendRow(item)
+
+    def __add_audio_formats(self, model, caps):
+        for format in (caps or {}).get("formats", []):
+            item = QStandardItem(format)
+            item.setData(format_value(format), Qt.ItemDataRole.UserRole)
+            model.appendRow(item)
+
+    def __add_audio_channels(self, model, caps):
+        for channel in (caps or {}).get("channels", []):
+            item = QStandardItem(str(channel))
+            item.setData(channel, Qt.ItemDataRole.UserRole)
+            model.appendRow(item)
@@ -0,0 +1,139 @@
+from PyQt6.QtCore import QObject, QTimer, pyqtSignal
+
+from dataclasses import dataclass
+import os
+import time
+
+# Resource usage of a running process, read from /proc.
+#
+# A sample reads /proc/<pid>/stat and io once and status once per thread, no
+# extra processes are started. CPU and rates are computed from the difference
+# to the previous sample, so the first sample after start reports zero.
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+@dataclass
+class ProcessSample:
+    pid: int = 0
+    cpu_percent: float = 0.0        # 100 is one core
+    rss: int = 0                    # bytes
+    threads: int = 0
+    context_switches: int = 0       # voluntary + involuntary, all threads
+    context_switch_rate: float = 0.0
+    involuntary_switches: int = 0   # preempted, a sign of CPU contention
+    read_bytes: int = 0             # rchar, includes sockets and pipes
+    write_bytes: int = 0            # wchar
+    read_rate: float = 0.0          # bytes per second
+    write_rate: float = 0.0
+
+# utime + stime of all threads, in clock ticks
+def read_cpu_ticks(pid):
+    stat = read_stat(pid)
+    return stat[0] if stat else None
+
+# Returns (cpu ticks, threads, rss pages) or None
+def read_stat(pid):
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        # utime, stime, num_threads and rss, fields 14, 15, 20 and 24 of stat(5)
+        return int(fields[11]) + int(fields[12]), int(fields[17]), int(fields[21])
+    except (OSError, IndexError, ValueError):
+        return None
+
+# Returns (voluntary, involuntary) context switches summed over the threads
+def read_context_switches(pid):
+    voluntary = involuntary = 0
+    try:
+        tids = os.listdir(f"/proc/{pid}/task")
+    except OSError:
+        return 0, 0
+
+    for tid in tids:
+        try:
+            with open(f"/proc/{pid}/task/{tid}/status", "r") as f:
+                for line in f:
+                    if line.startswith("voluntary_ctxt_switches:"):
+                        voluntary += int(line.split()[1])
+                    elif line.startswith("nonvoluntary_ctxt_switches:"):
+                        involuntary += int(line.split()[1])
+        except (OSError, ValueError, IndexError):
+            # Thread exited in the meantime
+            continue
+
+    return voluntary, involuntary
+
+def read_io(pid):
+    io = {}
+    try:
+        with open(f"/proc/{pid}/io", "r") as f:
+            for line in f:
+                key, value = line.split(":", 1)
+                io[key] = int(value)
+    except (OSError, ValueError):
+        pass
+    return io
+
+class ProcessMonitor(QObject):
+    # Signals
+    sample = pyqtSignal(object)     # ProcessSample
+
+    def __init__(self, interval=2000):
+        super().__init__()
+
+        self.__pid = 0
+        self.__previous = None      # (time, ticks, switches, read, write)
+        self.__latest = ProcessSample()
+
+        self.__timer = QTimer(self)
+        self.__timer.setInterval(interval)
+        self.__timer.timeout.connect(self.__sample)
+
+    def latest(self):
+        return self.__latest
+
+    def start(self, pid):
+        self.__pid = pid
+        self.__previous = None
+        self.__sample()
+        self.__timer.start()
+
+    def stop(self):
+        self.__timer.stop()
+        self.__pid = 0
+        self.__previous = None
+        self.__latest = ProcessSample()
+        self.sample.emit(self.__latest)
+
+    def __sample(self):
+        stat = read_stat(self.__pid) if self.__pid else None
+        if stat is None:
+            return
+
+        now = time.monotonic()
+        ticks, threads, rss_pages = stat
+        voluntary, involuntary = read_context_switches(self.__pid)
+        io = read_io(self.__pid)
+
+        sample = ProcessSample(
+            pid=self.__pid,
+            rss=rss_pages * PAGE_SIZE,
+            threads=threads,
+            context_switches=voluntary + involuntary,
+            involuntary_switches=involuntary,
+            read_bytes=io.get("rchar", 0),
+            write_bytes=io.get("wchar", 0),
+        )
+
+        if self.__previous:
+            then, last_ticks, last_switches, last_read, last_write = self.__previous
+            elapsed = max(now - then, 1e-6)
+            sample.cpu_percent = 100.0 * (ticks - last_ticks) / CLOCK_TICKS / elapsed
+            sample.context_switch_rate = (sample.context_switches - last_switches) / elapsed
+            sample.read_rate = (sample.read_bytes - last_read) / elapsed
+            sample.write_rate = (sample.write_bytes - last_write) / elapsed
+
+        self.__previous = (now, ticks, sample.context_switches, sample.read_bytes, sample.write_bytes)
+        self.__latest = sample
+        self.sample.emit(sample)
@@ -0,0 +1,193 @@
+import errno
+import functools
+import os
+
+# CPU placement, priority and resource budgets for ffmpeg processes.
+#
+# Affinity, nice and the scheduling policy are per thread on Linux, so they are
+# applied to every thread in /proc/<pid>/task. Threads created afterwards
+# inherit them from the thread that creates them. Everything here is best
+# effort: a setting the system doesn't allow is reported and skipped, the
+# stream still runs.
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+CPU_PERIOD = 100000     # microseconds, cpu.max period
+
+def thread_ids(pid):
+    try:
+        return [int(tid) for tid in os.listdir(f"/proc/{pid}/task")]
+    except OSError:
+        return []
+
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+# "2,3" or "1-3" -> [1, 2, 3]. Returns None for "" (any core) and "auto".
+def parse_cpus(text):
+    text = str(text or "").strip()
+    if not text or text == "auto":
+        return None
+
+    cpus = set()
+    for part in text.split(","):
+        part = part.strip()
+        if "-" in part:
+            low, high = part.split("-", 1)
+            cpus.update(range(int(low), int(high) + 1))
+        elif part:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+# Splits the cores between `count` processes, leaving core 0 to the GUI and
+# interrupts when there is more than one. Returns a list of core lists.
+def assign_cores(count, cpus=None):
+    cpus = list(cpus if cpus is not None else available_cpus())
+    if len(cpus) > 1 and 0 in cpus:
+        cpus.remove(0)
+    if count <= 0 or not cpus:
+        return []
+
+    if count >= len(cpus):
+        return [[cpus[i % len(cpus)]] for i in range(count)]
+
+    assignments = []
+    start = 0
+    for i in range(count):
+        size = len(cpus) // count + (1 if i < len(cpus) % count else 0)
+        assignments.append(cpus[start:start + size])
+        start += size
+    return assignments
+
+def set_affinity(pid, cpus):
+    if not hasattr(os, "sched_setaffinity"):
+        return False
+    return _for_threads(pid, lambda tid: os.sched_setaffinity(tid, cpus), "CPU affinity")
+
+def set_nice(pid, nice):
+    return _for_threads(pid, lambda tid: os.setpriority(os.PRIO_PROCESS, tid, nice), "nice level")
+
+# SCHED_FIFO needs CAP_SYS_NICE or an rtprio limit (see limits.conf)
+def set_realtime(pid, priority=50):
+    if not hasattr(os, "SCHED_FIFO"):
+        return False
+    param = os.sched_param(priority)
+    return _for_threads(pid, lambda tid: os.sched_setscheduler(tid, os.SCHED_FIFO, param), "realtime priority")
+
+def _for_threads(pid, apply, what):
+    tids = thread_ids(pid)
+    for tid in tids:
+        try:
+            apply(tid)
+        except ProcessLookupError:
+            # Thread exited in the meantime
+            continue
+        except OSError as e:
+            print(f"Unable to set {what} for process {pid}:", e.strerror)
+            return False
+    return bool(tids)
+
+def own_cgroup():
+    try:
+        with open("/proc/self/cgroup", "r") as f:
+            for line in f:
+                # cgroup v2 has a single "0::/path" line
+                if line.startswith("0::"):
+                    return line[3:].strip()
+    except OSError:
+        pass
+    return None
+
+# Leaf our own processes are moved into, see Cgroup.__enable_controllers
+LEAF = "main"
+
+# The cgroup delegated to us. Read once, once our processes were moved into
+# its leaf own_cgroup() returns the leaf and budgets would nest below it.
+@functools.lru_cache(maxsize=None)
+def delegated_cgroup():
+    own = own_cgroup()
+    if own is not None and os.path.basename(own.rstrip("/")) == LEAF:
+        own = os.path.dirname(own.rstrip("/"))
+    return own
+
+# cgroup v2 groups for stream processes, created below our own cgroup.
+#
+# Only leaf cgroups may hold processes once controllers are enabled for their
+# children, so our own processes are first moved into a "main" leaf. This only
+# works where the cgroup is delegated to us (e.g. a systemd user service with
+# Delegate=yes or running as root).
+class Cgroup():
+    def __init__(self, root=CGROUP_ROOT):
+        self.__root = root
+        own = delegated_cgroup()
+        self.__base = os.path.join(root, own.lstrip("/")) if own is not None else None
+
+    def available(self):
+        return (self.__base is not None
+                and os.path.exists(os.path.join(self.__root, "cgroup.controllers"))
+                and os.access(self.__base, os.W_OK))
+
+    # Returns the cgroup's path, or None if budgets can't be set here
+    def create(self, name, cpu_percent=0, memory_mb=0):
+        if not self.available() or not self.__enable_controllers():
+            return None
+
+        path = os.path.join(self.__base, name)
+        try:
+            os.makedirs(path, exist_ok=True)
+            quota = str(int(CPU_PERIOD * cpu_percent / 100)) if cpu_percent > 0 else "max"
+            self.__write(os.path.join(path, "cpu.max"), f"{quota} {CPU_PERIOD}")
+            memory = str(int(memory_mb) * 1024 * 1024) if memory_mb > 0 else "max"
+            self.__write(os.path.join(path, "memory.max"), memory)
+        except OSError as e:
+            print("Unable to set up cgroup", path, "-", e.strerror)
+            return None
+
+        return path
+
+    def add(self, path, pid):
+        try:
+            self.__write(os.path.join(path, "cgroup.procs"), str(pid))
+            return True
+        except OSError as e:
+            print("Unable to move process", pid, "into cgroup", path, "-", e.strerror)
+            return False
+
+    # Only works once the processes in it have exited
+    def remove(self, path):
+        try:
+            os.rmdir(path)
+        except OSError as e:
+            if e.errno not in (errno.ENOENT, errno.EBUSY):
+                print("Unable to remove cgroup", path, "-", e.strerror)
+
+    def __enable_controllers(self):
+        control = os.path.join(self.__base, "cgroup.subtree_control")
+        try:
+            with open(control, "r") as f:
+                enabled = f.read().split()
+            if "cpu" in enabled and "memory" in enabled:
+                return True
+
+            # No internal processes, move ours into a leaf first
+            leaf = os.path.join(self.__base, LEAF)
+            os.makedirs(leaf, exist_ok=True)
+            with open(os.path.join(self.__base, "cgroup.procs"), "r") as f:
+                pids = f.read().split()
+            for pid in pids:
+                try:
+                    self.__write(os.path.join(leaf, "cgroup.procs"), pid)
+                except OSError as e:
+                    if e.errno != errno.ESRCH:
+                        raise
+
+            self.__write(control, "+cpu +memory")
+            return True
+        except OSError as e:
+            print("cgroup controllers not available in", self.__base, "-", e.strerror)
+            return False
+
+    def __write(self, path, value):
+        with open(path, "w") as f:
+            f.write(value)
@@ -0,0 +1,157 @@
+from PyQt6.QtCore import QObject, QTimer, pyqtSignal, pyqtSlot
+
+import time
+
+from core.EncoderTuner import PRESETS
+
+# Steps a stream down a quality ladder when the encoder can't keep up.
+#
+# Capture devices deliver frames in realtime, so `speed` from ffmpeg's progress
+# sits at about 1.0x while the encoder keeps up and drops below it when frames
+# start to queue up. Stepping down happens after a short window below `target`
+# or with dropped frames. Speed can't show spare capacity, so stepping back up
+# is a probe after a long stable window. A probe that fails quickly doubles the
+# wait before the next one, so the controller doesn't oscillate between levels.
+#
+# Encoder settings can't be changed in a running ffmpeg, a level change is
+# applied by restarting the stream through its supervisor. Lower frame rates
+# are applied with the fps filter, so the frames it leaves out don't show up
+# as dropped frames here.
+#
+# The evaluation timer only runs while adaptive quality is enabled and the
+# stream's supervisor is active, idle streams don't wake up every second.
+
+CRF_STEP = 5
+
+# Overrides applied to a libx264 video config at each level, level 0 is the config itself
+def quality_ladder(config):
+    preset = config.get("preset", "superfast")
+    faster = PRESETS[max(0, PRESETS.index(preset) - 1)] if preset in PRESETS else "ultrafast"
+    crf = int(config.get("crf", 23)) + CRF_STEP
+    framerate = int(config["framerate"])
+
+    ladder = [{}]
+    for level in (
+        {"preset": faster},
+        {"preset": "ultrafast"},
+        {"preset": "ultrafast", "crf": crf},
+        {"preset": "ultrafast", "crf": crf, "framerate": max(1, framerate * 2 // 3)},
+        {"preset": "ultrafast", "crf": crf, "framerate": max(1, framerate // 2)},
+    ):
+        # Skip steps that don't change anything, e.g. faster presets when already ultrafast
+        effective = {key: value for key, value in level.items() if str(config.get(key)) != str(value)}
+        if effective and effective != ladder[-1]:
+            ladder.append(effective)
+
+    return ladder
+
+# Copy of a video config with a ladder level applied
+def apply_level(config, level):
+    if level <= 0 or config["encoder"] != "libx264":
+        return config
+
+    ladder = quality_ladder(config)
+    adjusted = dict(config)
+    adjusted.update(ladder[min(level, len(ladder) - 1)])
+    return adjusted
+
+class QualityController(QObject):
+    # Signals
+    level_changed = pyqtSignal(int)
+
+    def __init__(self, supervisor, target=0.95, down_window=8, up_window=60,
+                 cooldown=15, drop_threshold=5):
+        super().__init__()
+
+        self.__supervisor = supervisor
+        self.__supervisor.active_changed.connect(self.__update_timer)
+        self.__stream = supervisor.stream()
+
+        self.__enabled = False
+        self.target = target
+        self.down_window = down_window
+        self.up_window = up_window
+        self.cooldown = cooldown
+        self.drop_threshold = drop_threshold
+
+        self.__changed_at = 0.0
+        self.__upgraded_at = None
+        self.__up_hold = up_window
+
+        self.__timer = QTimer(self)
+        self.__timer.setInterval(1000)
+        self.__timer.timeout.connect(self.__evaluate)
+
+    def level(self):
+        return self.__stream.quality_level()
+
+    def enabled(self):
+        return self.__enabled
+
+    def set_enabled(self, enabled):
+        self.__enabled = enabled
+        self.__update_timer()
+
+    # Back to the configured settings, e.g. when playback is started by the user
+    def reset(self):
+        self.__upgraded_at = None
+        self.__up_hold = self.up_window
+        self.__stream.set_quality_level(0)
+        self.__update_timer()
+
+    @pyqtSlot(bool)
+    def __update_timer(self, *args):
+        if self.__enabled and self.__supervisor.active():
+            if not self.__timer.isActive():
+                self.__timer.start()
+        else:
+            self.__timer.stop()
+
+    def __max_level(self):
+        levels = [len(quality_ladder(video)) - 1 for video in self.__stream.encoded_video_configs()
+                  if video["encoder"] == "libx264"]
+        return max(levels, default=0)
+
+    def __evaluate(self):
+        if not self.__enabled or not self.__supervisor.active() or self.__stream.host() is not None:
+            return
+
+        now = time.monotonic()
+        since_change = now - self.__changed_at
+        if since_change < self.cooldown:
+            return
+
+        metrics = self.__stream.metrics()
+        level = self.level()
+
+        # Only judge a full window of samples from the current process
+        speed = metrics.stats("speed", self.down_window)
+        if speed["count"] < self.down_window or len(metrics) < 2 * self.down_window:
+            return
+
+        drops = metrics.delta("drop", self.down_window)
+        if (speed["mean"] < self.target or drops >= self.drop_threshold) and level < self.__max_level():
+            print(f"Encoder behind (speed {speed['mean']:.2f}x, {drops:.0f} dropped), lowering quality:",
+                  self.__stream.config().get("name", "Unknown"))
+
+            # The last step up didn't hold, wait longer before trying again
+            if self.__upgraded_at is not None and now - self.__upgraded_at < 2 * self.__up_hold:
+                self.__up_hold = min(self.__up_hold * 2, 16 * self.up_window)
+            self.__upgraded_at = None
+            self.__change(level + 1)
+            return
+
+        if level == 0 or since_change < self.__up_hold:
+            return
+
+        stable = metrics.stats("speed", self.__up_hold)
+        if stable["min"] >= self.target and metrics.delta("drop", self.__up_hold) == 0:
+            print("Encoder keeping up, raising quality:", self.__stream.config().get("name", "Unknown"))
+            self.__upgraded_at = now
+            self.__change(level - 1)
+
+    def __change(self, level):
+        self.__changed_at = time.monotonic()
+        self.__stream.set_quality_level(level)
+        self.__supervisor.restart()
+        self.level_changed.emit(level)
@@ -0,0 +1,139 @@
+import os
+import re
+import shutil
+import time
+
+# Local recording of a stream's encoded output, as a ring of MPEG-TS segment
+# files next to the network output.
+#
+# ffmpeg writes the segments through a tee output, so nothing is encoded twice
+# (see PlaybackStream.__build_command). They are named after their start time,
+# sorting the names sorts them by age. The oldest ones are deleted once the
+# ring is over its size or age limit, and the last few minutes can be joined
+# into a single file, MPEG-TS segments play back to back when concatenated.
+
+SEGMENT_SECONDS = 10
+SEGMENT_PATTERN = "%Y%m%d-%H%M%S.ts"
+SEGMENT_NAME = re.compile(r"^\d{8}-\d{6}\.ts$")
+
+DEFAULT_DIRECTORY = "~/Videos/PiStreamer"
+DEFAULT_MAX_SIZE = 1024     # MiB
+
+# Saved replays are kept out of the ring
+SAVED_DIRECTORY = "saved"
+
+# Replays are copied in large blocks, many small writes stall on an SD card
+COPY_BLOCK = 4 * 1024 * 1024
+
+# Characters with a meaning in a tee output list
+TEE_SPECIAL = re.compile(r"([\\|'\[\]])")
+
+class ReplayBuffer():
+    def __init__(self, directory, max_bytes=0, max_age=0):
+        self.__directory = directory
+        self.__max_bytes = max_bytes
+        self.__max_age = max_age
+
+    # The ring of a stream config, one directory per stream id
+    @classmethod
+    def for_config(cls, config):
+        base = os.path.expanduser(config.get("record_directory") or DEFAULT_DIRECTORY)
+        return cls(os.path.join(base, f"stream-{config['id']}"),
+                   int(config.get("record_max_size", DEFAULT_MAX_SIZE)) * 1024 * 1024,
+                   int(config.get("record_max_minutes", 0)) * 60)
+
+    def directory(self):
+        return self.__directory
+
+    # The segment muxer can't create directories
+    def prepare(self):
+        try:
+            os.makedirs(self.__directory, exist_ok=True)
+            return True
+        except OSError as e:
+            print("Unable to create recording directory:", e)
+            return False
+
+    # tee output writing the segments, e.g. "[f=segment:...]/path/%Y%m%d-%H%M%S.ts"
+    def tee_output(self):
+        options = [
+            "f=segment",
+            f"segment_time={SEGMENT_SECONDS}",
+            "segment_format=mpegts",
+            "strftime=1",
+            # Fill the write buffer instead of writing every packet on its own,
+            # even when the stream's profile flushes its network output
+            "flush_packets=0",
+            # A slow or full card only loses the recording, not the stream
+            "use_fifo=1",
+            "onfail=ignore",
+        ]
+        path = TEE_SPECIAL.sub(r"\\\1", os.path.join(self.__directory, SEGMENT_PATTERN))
+        return f"[{':'.join(options)}]{path}"
+
+    # (path, size, modification time) of the recorded segments, oldest first
+    def segments(self):
+        try:
+            entries = [entry for entry in os.scandir(self.__directory)
+                       if entry.is_file() and SEGMENT_NAME.match(entry.name)]
+        except OSError:
+            return []
+
+        segments = []
+        for entry in sorted(entries, key=lambda entry: entry.name):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            segments.append((entry.path, stat.st_size, stat.st_mtime))
+        return segments
+
+    # Deletes the oldest segments until the ring is within its limits, the
+    # newest one is still being written and always kept. Returns the number deleted.
+    def evict(self):
+        segments = self.segments()
+        total = sum(size for path, size, mtime in segments)
+        cutoff = time.time() - self.__max_age if self.__max_age else None
+
+        removed = 0
+        for path, size, mtime in segments[:-1]:
+            over_size = self.__max_bytes and total > self.__max_bytes
+            too_old = cutoff is not None and mtime < cutoff
+            if not over_size and not too_old:
+                break
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print("Unable to remove recording segment:", e)
+                break
+            total -= size
+            removed += 1
+        return removed
+
+    # Joins the segments written in the last `minutes` into one file in the
+    # "saved" directory. Returns its path, None if nothing was recorded.
+    def save(self, minutes, name="replay"):
+        cutoff = time.time() - minutes * 60
+        segments = [path for path, size, mtime in self.segments() if mtime >= cutoff]
+        if not segments:
+            return None
+
+        directory = os.path.join(self.__directory, SAVED_DIRECTORY)
+        os.makedirs(directory, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9]+", "-", name).strip("-").lower() or "replay"
+        path = os.path.join(directory, f"{slug}-{time.strftime('%Y%m%d-%H%M%S')}.ts")
+
+        # Written under a temporary name, a half copied file never looks finished
+        with open(path + ".part", "wb", buffering=COPY_BLOCK) as output:
+            for segment in segments:
+                try:
+                    with open(segment, "rb", buffering=0) as source:
+                        shutil.copyfileobj(source, output, COPY_BLOCK)
+                except FileNotFoundError:
+                    # Evicted while saving
+                    continue
+        os.replace(path + ".part", path)
+        return path
@@ -1,180 +1,342 @@
-from PyQt6.QtCore import QObject, pyqtSignal, QSettings
-
+from PyQt6.QtCore import QCoreApplication, QObject, QSettings, QTimer, pyqtSignal
+from contextlib import contextmanager
+
+# Changes are written to disk in batches: each change marks its section dirty
+# and the dirty sections are written `save_delay` ms after the last change, or
+# when the application quits. Bulk edits (e.g. toggling several checkboxes)
+# then cost a single write to the SD card. QSettings writes to a temporary
+# file and renames it over the old one, an interrupted write keeps the old file.
+#
+# Configs are identified by an id that never changes or gets reused, stored in
+# config["id"]. A source's stream is config["stream"], a stream's sources are
+# its "video_configs" and "audio_configs" lists.
 class SettingsManager(QObject):
     # Signals
-    stream_config_added = pyqtSignal(int, dict)     # index, data
-    stream_config_changed = pyqtSignal(int, dict)   # index, data
-    stream_config_removed = pyqtSignal(int, dict)   # index. data
+    stream_config_added = pyqtSignal(int, dict)     # id, data
+    stream_config_changed = pyqtSignal(int, dict)   # id, data
+    stream_config_removed = pyqtSignal(int, dict)   # id, data
+
+    video_config_added = pyqtSignal(int, dict)      # id, data
+    video_config_changed = pyqtSignal(int, dict)    # id, data
+    video_config_removed = pyqtSignal(int, dict)    # id, data
 
-    video_config_added = pyqtSignal(int, dict)      # index, data
-    video_config_changed = pyqtSignal(int, dict)    # index, data
-    video_config_removed = pyqtSignal(int, dict)    # index, data
+    audio_config_added = pyqtSignal(int, dict)      # id, data
+    audio_config_changed = pyqtSignal(int, dict)    # id, data
+    audio_config_removed = pyqtSignal(int, dict)    # id, data
 
-    audio_config_added = pyqtSignal(int, dict)      # index, data
-    audio_config_changed = pyqtSignal(int, dict)    # index, data
-    audio_config_removed = pyqtSignal(int, dict)    # index, data
+    configs_changed = pyqtSignal()                  # once per change or transaction
 
-    def __init__(self):
+    def __init__(self, settings=None, save_delay=500):
         super().__init__()
 
-        self._settings = QSettings("AHL", "PiStreamer")
+        # Tools pass their own QSettings so they don't touch the user's configs
+        self._settings = settings if settings is not None else QSettings("AHL", "PiStreamer")
+        self._settings.setAtomicSyncRequired(True)
+
+        self.__dirty = set()    # sections to write on the next flush
+
+        self.__save_timer = QTimer(self)
+        self.__save_timer.setSingleShot(True)
+        self.__save_timer.setInterval(save_delay)
+        self.__save_timer.timeout.connect(self.flush)
 
-        self.__stream_configs = []
-        self.__video_configs = []
-        self.__audio_configs = []
+        # Don't lose changes still waiting for the timer
+        app = QCoreApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(self.flush)
+
+        # id -> config, in the order they were added
+        self.__stream_configs = {}
+        self.__video_configs = {}
+        self.__audio_configs = {}
+        self.__next_id = 0
+
+        self.__transactions = 0     # nested transaction() depth
+        self.__pending = False      # configs_changed held back by a transaction
 
     def load_settings(self):
         # Load Configs From Disk
+        self.__next_id = int(self._settings.value("next_id", "0"))
         self.__read_stream_configs()
         self.__read_video_configs()
         self.__read_audio_configs()
 
         # Notify UI about configs
-        for i, stream in enumerate(self.__stream_configs):
-            self.stream_config_added.emit(i, stream)
-            for vi, video in enumerate(stream["video_configs"]):
-                self.video_config_added.emit(vi, video)
-            for ai, audio in enumerate(stream["audio_configs"]):
-                self.audio_config_added.emit(ai, audio)
+        with self.transaction():
+            for stream in self.__stream_configs.values():
+                self.stream_config_added.emit(stream["id"], stream)
+                for video in stream["video_configs"]:
+                    self.video_config_added.emit(video["id"], video)
+                for audio in stream["audio_configs"]:
+                    self.audio_config_added.emit(audio["id"], audio)
+            self.__pending = True
+
+    # Groups changes, e.g. setting up many sources from a script. configs_changed
+    # is emitted once at the end instead of after every change.
+    @contextmanager
+    def transaction(self):
+        self.__transactions += 1
+        try:
+            yield self
+        finally:
+            self.__transactions -= 1
+            if not self.__transactions and self.__pending:
+                self.__pending = False
+                self.configs_changed.emit()
+
+    # Write the pending changes now, e.g. before exiting without an event loop
+    def flush(self):
+        self.__save_timer.stop()
+        if not self.__dirty:
+            return
+
+        if "StreamConfigs" in self.__dirty:
+            self.__save_stream_configs()
+        if "VideoConfigs" in self.__dirty:
+            self.__save_video_configs()
+        if "AudioConfigs" in self.__dirty:
+            self.__save_audio_configs()
+        self._settings.setValue("next_id", str(self.__next_id))
+        self.__dirty.clear()
+
+        self._settings.sync()
+        if self._settings.status() != QSettings.Status.NoError:
+            print("Unable to save settings to", self._settings.fileName())
 
     def num_stream_configs(self):
         return len(self.__stream_configs)
 
-    def get_stream_config(self, index):
-        return self.__stream_configs[index]
+    def stream_configs(self):
+        return list(self.__stream_configs.values())
 
+    def get_stream_config(self, id):
+        return self.__stream_configs[id]
+
+    # Returns the new config's id
     def add_stream_config(self, data):
-        data["index"] = len(self.__stream_configs)
+        data["id"] = self.__new_id()
         data["video_configs"] = []
         data["audio_configs"] = []
-        self.__stream_configs.append(data)
+        self.__stream_configs[data["id"]] = data
 
-        self.__save_stream_configs()
+        self.__changed("StreamConfigs")
 
-        self.stream_config_added.emit(len(self.__stream_configs)-1, data)
+        self.stream_config_added.emit(data["id"], data)
+        return data["id"]
 
-    def remove_stream_config(self, index):
-        config = self.get_stream_config(index)
+    def remove_stream_config(self, id):
+        config = self.get_stream_config(id)
 
-        while len(config["video_configs"]):
-            self.remove_video_config(config["video_configs"][0]["index"])
+        with self.transaction():
+            while len(config["video_configs"]):
+                self.remove_video_config(config["video_configs"][0]["id"])
 
-        while len(config["audio_configs"]):
-            self.remove_audio_config(config["audio_configs"][0]["index"])
+            while len(config["audio_configs"]):
+                self.remove_audio_config(config["audio_configs"][0]["id"])
 
-        self.__stream_configs.pop(index)
+            del self.__stream_configs[id]
 
-        self.__save_stream_configs()
+            self.__changed("StreamConfigs")
 
-        self.stream_config_removed.emit(index, config)
+            self.stream_config_removed.emit(id, config)
 
-    def update_stream_config(self, index, data):
-        self.__stream_configs[index] = data
+    def update_stream_config(self, id, data):
+        self.__replace(self.__stream_configs, id, data)
 
-        self.__save_stream_configs()
+        self.__changed("StreamConfigs")
 
-        self.stream_config_changed.emit(index, data)
+        self.stream_config_changed.emit(id, data)
 
     def num_video_configs(self):
         return len(self.__video_configs)
 
-    def get_video_config(self, index):
-        return self.__video_configs[index]
+    def video_configs(self):
+        return list(self.__video_configs.values())
+
+    def get_video_config(self, id):
+        return self.__video_configs[id]
 
+    # data["stream"] is the stream config, returns the new config's id
     def add_video_config(self, data):
-        data["index"] = len(self.__video_configs)
+        data["id"] = self.__new_id()
         data["stream"]["video_configs"].append(data)
-        self.__video_configs.append(data)
+        self.__video_configs[data["id"]] = data
 
-        self.__save_video_configs()
+        self.__changed("VideoConfigs")
 
-        self.video_config_added.emit(len(self.__video_configs)-1, data)
+        self.video_config_added.emit(data["id"], data)
+        return data["id"]
 
-    def remove_video_config(self, index):
-        config = self.get_video_config(index)
+    def remove_video_config(self, id):
+        config = self.__video_configs.pop(id)
         config["stream"]["video_configs"].remove(config)
-        self.__video_configs.pop(index)
 
-        self.__save_video_configs()
+        self.__changed("VideoConfigs")
 
-        self.video_config_removed.emit(index, config)
+        self.video_config_removed.emit(id, config)
 
-    def update_video_config(self, index, data):
-        self.__video_configs[index] = data
+    def update_video_config(self, id, data):
+        self.__replace(self.__video_configs, id, data, "video_configs")
 
-        self.__save_video_configs()
+        self.__changed("VideoConfigs")
 
-        self.video_config_changed.emit(index, data)
+        self.video_config_changed.emit(id, data)
 
     def num_audio_configs(self):
         return len(self.__audio_configs)
 
-    def get_audio_config(self, index):
-        return self.__audio_configs[index]
+    def audio_configs(self):
+        return list(self.__audio_configs.values())
 
+    def get_audio_config(self, id):
+        return self.__audio_configs[id]
+
+    # data["stream"] is the stream config, returns the new config's id
     def add_audio_config(self, data):
-        data["index"] = len(self.__audio_configs)
+        data["id"] = self.__new_id()
         data["stream"]["audio_configs"].append(data)
-        self.__audio_configs.append(data)
+        self.__audio_configs[data["id"]] = data
 
-        self.__save_audio_configs()
+        self.__changed("AudioConfigs")
 
-        self.audio_config_added.emit(len(self.__audio_configs)-1, data)
+        self.audio_config_added.emit(data["id"], data)
+        return data["id"]
 
-    def remove_audio_config(self, index):
-        config = self.get_audio_config(index)
+    def remove_audio_config(self, id):
+        config = self.__audio_configs.pop(id)
         config["stream"]["audio_configs"].remove(config)
-        self.__audio_configs.pop(index)
-
-        self.__save_audio_configs()
-
-        self.audio_config_removed.emit(index, config)
-
-    def update_audio_config(self, index, data):
-        self.__audio_configs[index] = data
 
-        self.__save_audio_configs()
-
-        self.audio_config_changed.emit(index, data)
+        self.__changed("AudioConfigs")
+
+        self.audio_config_removed.emit(id, config)
+
+    def update_audio_config(self, id, data):
+        self.__replace(self.__audio_configs, id, data, "audio_configs")
+
+        self.__changed("AudioConfigs")
+
+        self.audio_config_changed.emit(id, data)
+
+    def __new_id(self):
+        self.__next_id += 1
+        return self.__next_id - 1
+
+    # Usually the dialogs edit the stored dict itself, a new dict takes its place
+    def __replace(self, configs, id, data, children=None):
+        old = configs[id]
+        data["id"] = id
+        configs[id] = data
+        if old is data:
+            return
+
+        if "display_item" in old:
+            data.setdefault("display_item", old["display_item"])
+
+        if children is None:
+            data["video_configs"] = old["video_configs"]
+            data["audio_configs"] = old["audio_configs"]
+            for source in data["video_configs"] + data["audio_configs"]:
+                source["stream"] = data
+        else:
+            siblings = old["stream"][children]
+            siblings[siblings.index(old)] = data
+
+    # Entries saved before configs had ids get new ones, written on the next flush
+    def __index_by_id(self, configs):
+        self.__next_id = max([self.__next_id] + [config["id"] + 1 for config in configs])
+
+        indexed = {}
+        for config in configs:
+            if config["id"] < 0 or config["id"] in indexed:
+                config["id"] = self.__new_id()
+                self.__dirty.update(("StreamConfigs", "VideoConfigs", "AudioConfigs"))
+            indexed[config["id"]] = config
+        return indexed
+
+    # Sources store their stream's id, older settings its position
+    def __find_stream(self, streams):
+        legacy = self._settings.value("id") is None
+        stream = int(self._settings.value("stream", "-1"))
+        if legacy:
+            return streams[stream] if 0 <= stream < len(streams) else None
+        return self.__stream_configs.get(stream)
+
+    def __changed(self, *sections):
+        self.__dirty.update(sections)
+        if self.__transactions:
+            self.__pending = True
+        else:
+            self.configs_changed.emit()
+        self.__save_timer.start()
 
     def __read_stream_configs(self):
         size = self._settings.beginReadArray("StreamConfigs")
 
-        self.__stream_configs = []
+        configs = []
 
         for i in range(size):
             config = {}
             self._settings.setArrayIndex(i)
-            config["index"] = i
+            config["id"] = int(self._settings.value("id", "-1"))
             config["enabled"] = int(self._settings.value("enabled", "1")) > 0
             config["name"] = self._settings.value("name", "Default")
             config["address"] = self._settings.value("address", "udpL//127.0.0.1:5000")
+            config["stall_timeout"] = int(self._settings.value("stall_timeout", "10"))
+            config["adaptive_quality"] = int(self._settings.value("adaptive_quality", "0")) > 0
+            config["output_profile"] = self._settings.value("output_profile", "default")
+            config["cpu_affinity"] = self._settings.value("cpu_affinity", "auto")
+            config["nice"] = int(self._settings.value("nice", "0"))
+            config["realtime"] = int(self._settings.value("realtime", "0")) > 0
+            config["cpu_max"] = int(self._settings.value("cpu_max", "0"))
+            config["memory_max"] = int(self._settings.value("memory_max", "0"))
+            config["record"] = int(self._settings.value("record", "0")) > 0
+            config["record_directory"] = self._settings.value("record_directory", "")
+            config["record_max_size"] = int(self._settings.value("record_max_size", "1024"))
+            config["record_max_minutes"] = int(self._settings.value("record_max_minutes", "0"))
             config["video_configs"] = []
             config["audio_configs"] = []
-            self.__stream_configs.append(config)
+            configs.append(config)
 
         self._settings.endArray()
 
+        self.__stream_configs = self.__index_by_id(configs)
+
     def __save_stream_configs(self):
+        # Removed entries would otherwise stay in the file
+        self._settings.remove("StreamConfigs")
         self._settings.beginWriteArray("StreamConfigs")
 
-        for i, config in enumerate(self.__stream_configs):
+        for i, config in enumerate(self.__stream_configs.values()):
             self._settings.setArrayIndex(i)
+            self._settings.setValue("id", str(config["id"]))
             self._settings.setValue("enabled", "1" if config["enabled"] else "0")
             self._settings.setValue("name", config["name"])
             self._settings.setValue("address", config["address"])
+            self._settings.setValue("stall_timeout", str(config.get("stall_timeout", 10)))
+            self._settings.setValue("adaptive_quality", "1" if config.get("adaptive_quality") else "0")
+            self._settings.setValue("output_profile", config.get("output_profile", "default"))
+            self._settings.setValue("cpu_affinity", config.get("cpu_affinity", "auto"))
+            self._settings.setValue("nice", str(config.get("nice", 0)))
+            self._settings.setValue("realtime", "1" if config.get("realtime") else "0")
+            self._settings.setValue("cpu_max", str(config.get("cpu_max", 0)))
+            self._settings.setValue("memory_max", str(config.get("memory_max", 0)))
+            self._settings.setValue("record", "1" if config.get("record") else "0")
+            self._settings.setValue("record_directory", config.get("record_directory", ""))
+            self._settings.setValue("record_max_size", str(config.get("record_max_size", 1024)))
+            self._settings.setValue("record_max_minutes", str(config.get("record_max_minutes", 0)))
 
         self._settings.endArray()
 
     def __read_video_configs(self):
         size = self._settings.beginReadArray("VideoConfigs")
 
-        self.__video_configs = []
+        streams = list(self.__stream_configs.values())
+        configs = []
 
         for i in range(size):
             config = {}
             self._settings.setArrayIndex(i)
-            config["index"] = i
+            config["id"] = int(self._settings.value("id", "-1"))
             config["enabled"] = int(self._settings.value("enabled", "1"))>0
             config["name"] = self._settings.value("name", "Default")
             config["device"] = self._settings.value("device", "/dev/video0")
@@ -184,20 +346,27 @@ class SettingsManager(QObject):
             config["framerate"] = self._settings.value("framerate", "60")
             config["encoder"] = self._settings.value("encoder", "copy")
             config["crf"] = self._settings.value("crf", "0")
-            stream_index = int(self._settings.value("stream", "-1"))
-            if stream_index >= 0 and stream_index < len(self.__stream_configs):
-                stream = self.__stream_configs[stream_index]
+            config["preset"] = self._settings.value("preset", "superfast")
+            config["threads"] = self._settings.value("threads", "0")
+            config["timestamp_overlay"] = int(self._settings.value("timestamp_overlay", "0")) > 0
+            stream = self.__find_stream(streams)
+            if stream is not None:
                 config["stream"] = stream
                 stream["video_configs"].append(config)
-                self.__video_configs.append(config)
+                configs.append(config)
 
         self._settings.endArray()
 
+        self.__video_configs = self.__index_by_id(configs)
+
     def __save_video_configs(self):
+        # Removed entries would otherwise stay in the file
+        self._settings.remove("VideoConfigs")
         self._settings.beginWriteArray("VideoConfigs")
 
-        for i, config in enumerate(self.__video_configs):
+        for i, config in enumerate(self.__video_configs.values()):
             self._settings.setArrayIndex(i)
+            self._settings.setValue("id", str(config["id"]))
             self._settings.setValue("enabled", "1" if config["enabled"] else "0")
             self._settings.setValue("name", config["name"])
             self._settings.setValue("device", config["device"])
@@ -207,45 +376,53 @@ class SettingsManager(QObject):
             self._settings.setValue("framerate", config["framerate"])
             self._settings.setValue("encoder", config["encoder"])
             self._settings.setValue("crf", config.get("crf", "0"))
-            self._settings.setValue("stream", self.__stream_configs.index(config["stream"]))
+            self._settings.setValue("preset", config.get("preset", "superfast"))
+            self._settings.setValue("threads", config.get("threads", "0"))
+            self._settings.setValue("timestamp_overlay", "1" if config.get("timestamp_overlay") else "0")
+            self._settings.setValue("stream", str(config["stream"]["id"]))
 
         self._settings.endArray()
 
     def __read_audio_configs(self):
         size = self._settings.beginReadArray("AudioConfigs")
 
-        self.__audio_configs = []
+        streams = list(self.__stream_configs.values())
+        configs = []
 
         for i in range(size):
             config = {}
             self._settings.setArrayIndex(i)
-            config["index"] = i
+            config["id"] = int(self._settings.value("id", "-1"))
             config["enabled"] = int(self._settings.value("enabled", "1")) > 0
             config["name"] = self._settings.value("name", "Default")
             config["device"] = self._settings.value("device", "hw:1,0")
             config["format"] = self._settings.value("format", "")
             config["channels"] = self._settings.value("channels", "1")
             config["encoder"] = self._settings.value("encoder", "copy")
-            stream_index = int(self._settings.value("stream", "-1"))
-            if stream_index >= 0 and stream_index < len(self.__stream_configs):
-                stream = self.__stream_configs[stream_index]
+            stream = self.__find_stream(streams)
+            if stream is not None:
                 config["stream"] = stream
                 stream["audio_configs"].append(config)
-                self.__audio_configs.append(config)
+                configs.append(config)
 
         self._settings.endArray()
 
+        self.__audio_configs = self.__index_by_id(configs)
+
     def __save_audio_configs(self):
+        # Removed entries would otherwise stay in the file
+        self._settings.remove("AudioConfigs")
         self._settings.beginWriteArray("AudioConfigs")
 
-        for i, config in enumerate(self.__audio_configs):
+        for i, config in enumerate(self.__audio_configs.values()):
             self._settings.setArrayIndex(i)
+            self._settings.setValue("id", str(config["id"]))
             self._settings.setValue("enabled", "1" if config["enabled"] else "0")
             self._settings.setValue("name", config["name"])
             self._settings.setValue("device", config["device"])
             self._settings.setValue("format", config["format"])
             self._settings.setValue("channels", config["channels"])
             self._settings.setValue("encoder", config["encoder"])
-            self._settings.setValue("stream", self.__stream_configs.index(config["stream"]))
+            self._settings.setValue("stream", str(config["stream"]["id"]))
 
         self._settings.endArray()
\ No newline at end of file
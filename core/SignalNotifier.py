@@ -0,0 +1,41 @@
+from PyQt6.QtCore import QObject, QSocketNotifier, pyqtSignal, pyqtSlot
+
+import signal
+import socket
+
+# Delivers POSIX signals through the Qt event loop.
+#
+# Python only runs its signal handlers once the interpreter gets control back,
+# which never happens while Qt sits in its C++ event loop. Instead of waking up
+# periodically to check, the signal number is written to a socket by
+# signal.set_wakeup_fd() and a QSocketNotifier wakes the loop only when one arrives.
+class SignalNotifier(QObject):
+    # Signals
+    received = pyqtSignal(int)  # signal number
+
+    def __init__(self, signals=(signal.SIGINT,)):
+        super().__init__()
+
+        self.__read, self.__write = socket.socketpair()
+        self.__read.setblocking(False)
+        self.__write.setblocking(False)
+
+        signal.set_wakeup_fd(self.__write.fileno(), warn_on_full_buffer=False)
+
+        # A Python handler is still needed to replace the default action, the
+        # actual work happens when the notifier fires.
+        for signum in signals:
+            signal.signal(signum, lambda signum, frame: None)
+
+        self.__notifier = QSocketNotifier(self.__read.fileno(), QSocketNotifier.Type.Read, self)
+        self.__notifier.activated.connect(self.__wakeup)
+
+    @pyqtSlot()
+    def __wakeup(self):
+        try:
+            data = self.__read.recv(64)
+        except BlockingIOError:
+            return
+
+        for signum in data:
+            self.received.emit(signum)
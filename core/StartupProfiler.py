@@ -0,0 +1,56 @@
+from contextlib import contextmanager
+import sys
+import time
+
+# Records how long start up steps take, e.g. imports, loading settings and
+# the first paint of the main window.
+#
+# Times are measured from when this module was first imported, so entry points
+# import it before anything else. Recording is always on, it only appends a
+# few tuples. report() formats the steps for printing with --startup-profile.
+# For a per module breakdown of imports, run python with -X importtime.
+
+_START = time.perf_counter()
+
+class StartupProfiler():
+    __instance = None
+
+    def __init__(self):
+        self.__steps = []   # (name, start, end) in seconds since _START
+        self.__marks = {}   # name -> seconds since _START
+
+    @classmethod
+    def instance(cls):
+        if cls.__instance is None:
+            cls.__instance = StartupProfiler()
+        return cls.__instance
+
+    @contextmanager
+    def measure(self, name):
+        start = time.perf_counter() - _START
+        try:
+            yield
+        finally:
+            self.__steps.append((name, start, time.perf_counter() - _START))
+
+    # Point in time, only the first mark of a name is kept
+    def mark(self, name):
+        if name not in self.__marks:
+            self.__marks[name] = time.perf_counter() - _START
+
+    def marks(self):
+        return dict(self.__marks)
+
+    def steps(self):
+        return [{"name": name, "start": start, "duration": end - start} for name, start, end in self.__steps]
+
+    def report(self):
+        lines = ["Startup profile (ms since start):"]
+        events = [(start, f"{start * 1000:8.1f}  {name} took {(end - start) * 1000:.1f} ms")
+                  for name, start, end in self.__steps]
+        events += [(at, f"{at * 1000:8.1f}  {name}") for name, at in self.__marks.items()]
+        lines += [line for at, line in sorted(events)]
+        return "\n".join(lines)
+
+    def print_report(self):
+        print(self.report(), file=sys.stderr)
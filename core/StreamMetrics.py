@@ -0,0 +1,108 @@
+from array import array
+
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+# Fixed size history of a stream's progress samples.
+#
+# Samples are written into preallocated arrays, so recording one never grows
+# anything. Statistics walk back from the newest sample over the requested
+# time window and are only computed when the GUI asks for them.
+class StreamMetrics():
+    FIELDS = ("fps", "bitrate", "speed", "drop")
+
+    def __init__(self, capacity=600):
+        self.__capacity = capacity
+        self.__times = array("d", [0.0]) * capacity
+        self.__columns = {field: array("d", [0.0]) * capacity for field in self.FIELDS}
+        self.__head = 0     # next slot to write
+        self.__count = 0
+
+    def clear(self):
+        self.__head = 0
+        self.__count = 0
+
+    def __len__(self):
+        return self.__count
+
+    def append(self, timestamp, fps, bitrate, speed, drop):
+        i = self.__head
+        self.__times[i] = timestamp
+        self.__columns["fps"][i] = fps
+        self.__columns["bitrate"][i] = bitrate
+        self.__columns["speed"][i] = speed
+        self.__columns["drop"][i] = drop
+
+        self.__head = (i + 1) % self.__capacity
+        if self.__count < self.__capacity:
+            self.__count += 1
+
+    def latest(self, field):
+        if not self.__count:
+            return 0.0
+        return self.__columns[field][self.__head - 1]
+
+    # Returns {"min", "mean", "max", "p95", "count"} over the last `window` seconds
+    def stats(self, field, window):
+        values = self.__window(field, window)
+        if not values:
+            return {"min": 0.0, "mean": 0.0, "max": 0.0, "p95": 0.0, "count": 0}
+
+        ordered = sorted(values)
+        return {
+            "min": ordered[0],
+            "mean": sum(ordered) / len(ordered),
+            "max": ordered[-1],
+            "p95": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+            "count": len(ordered),
+        }
+
+    # Raw samples in the window, oldest first
+    def values(self, field, window):
+        return self.__window(field, window)
+
+    # Growth of a cumulative field (e.g. dropped frames) over the window
+    def delta(self, field, window):
+        values = self.__window(field, window)
+        if len(values) < 2:
+            return 0.0
+        return values[-1] - values[0]
+
+    def sparkline(self, field, window, width=12):
+        values = self.__window(field, window)
+        if not values:
+            return ""
+
+        # Average into `width` buckets, oldest first
+        buckets = []
+        for b in range(min(width, len(values))):
+            start = b * len(values) // min(width, len(values))
+            end = (b + 1) * len(values) // min(width, len(values))
+            chunk = values[start:end]
+            buckets.append(sum(chunk) / len(chunk))
+
+        low = min(buckets)
+        span = max(buckets) - low
+        if span <= 0:
+            return SPARK_CHARS[len(SPARK_CHARS) // 2] * len(buckets)
+
+        top = len(SPARK_CHARS) - 1
+        return "".join(SPARK_CHARS[int((value - low) / span * top)] for value in buckets)
+
+    # Values in the window, oldest first
+    def __window(self, field, window):
+        if not self.__count:
+            return []
+
+        column = self.__columns[field]
+        newest = self.__head - 1
+        cutoff = self.__times[newest] - window
+
+        values = []
+        for n in range(self.__count):
+            i = (newest - n) % self.__capacity
+            if self.__times[i] < cutoff:
+                break
+            values.append(column[i])
+
+        values.reverse()
+        return values
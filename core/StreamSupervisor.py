@@ -0,0 +1,226 @@
+from PyQt6.QtCore import QObject, QProcess, QTimer, pyqtSignal, pyqtSlot
+
+from collections import deque
+import random
+import time
+
+# Keeps a PlaybackStream running.
+#
+# An unexpected ffmpeg exit, or no new output for `stall_timeout` seconds while
+# the process is alive (e.g. a hung camera), triggers a restart after an
+# exponential backoff with jitter. More than `max_restarts` restarts within
+# `restart_window` seconds means something is persistently broken, the
+# supervisor then gives up instead of thrashing the device.
+class StreamSupervisor(QObject):
+    # Signals
+    restarted = pyqtSignal(int)     # number of restarts so far
+    gave_up = pyqtSignal(str)       # reason
+    active_changed = pyqtSignal(bool)
+
+    def __init__(self, stream, stall_timeout=10, backoff_base=1.0, backoff_max=60.0,
+                 max_restarts=5, restart_window=300, stable_time=30):
+        super().__init__()
+
+        self.__stream = stream
+        self.__stream.state_change.connect(self.__state_changed)
+        self.__stream.progress.connect(self.__progress)
+
+        self.stall_timeout = stall_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+        self.stable_time = stable_time
+
+        self.__active = False       # playback requested
+        self.__restart_now = False  # next exit is an intentional restart
+        self.__attempt = 0          # consecutive failures, drives the backoff
+        self.__recent = deque()     # restart times within restart_window
+
+        self.__last_position = (0, 0, 0)   # frame, out_time_us, total_size
+        self.__last_progress = 0.0
+        self.__running_since = None
+        self.__down_since = None
+
+        # Counters
+        self.restarts = 0
+        self.exits = 0
+        self.stalls = 0
+        self.downtime = 0.0
+
+        self.__watchdog = QTimer(self)
+        self.__watchdog.setInterval(1000)
+        self.__watchdog.timeout.connect(self.__check_stall)
+
+        self.__restart_timer = QTimer(self)
+        self.__restart_timer.setSingleShot(True)
+        self.__restart_timer.timeout.connect(self.__restart)
+
+        self.__kill_timer = QTimer(self)
+        self.__kill_timer.setSingleShot(True)
+        self.__kill_timer.setInterval(3000)
+        self.__kill_timer.timeout.connect(self.__stream.kill_playback)
+
+    def stream(self):
+        return self.__stream
+
+    def active(self):
+        return self.__active
+
+    def stats(self):
+        downtime = self.downtime
+        if self.__down_since is not None:
+            downtime += time.monotonic() - self.__down_since
+
+        return {
+            "restarts": self.restarts,
+            "exits": self.exits,
+            "stalls": self.stalls,
+            "downtime": downtime,
+        }
+
+    def start(self):
+        # Nothing to keep running, start_playback reports why
+        if not self.__stream.config()["enabled"] or self.__stream.plan_error():
+            self.__stream.start_playback()
+            return
+
+        self.__active = True
+        self.__attempt = 0
+        self.__recent.clear()
+        self.__launch()
+        self.active_changed.emit(True)
+
+    def stop(self):
+        was_active = self.__active
+        self.__active = False
+        self.__restart_now = False
+        self.__watchdog.stop()
+        self.__restart_timer.stop()
+        self.__close_downtime()
+        self.__stream.stop_playback()
+
+        # A timer left running would kill the next process if the stream is started again
+        if self.__stream.state() != QProcess.ProcessState.NotRunning:
+            self.__kill_timer.start()
+
+        if was_active:
+            self.active_changed.emit(False)
+
+    # Intentional restart, e.g. after a settings change. Not counted as a failure.
+    def restart(self):
+        if not self.__active:
+            return
+
+        if self.__stream.state() == QProcess.ProcessState.NotRunning:
+            self.__restart_timer.stop()
+            self.__launch()
+        else:
+            self.__restart_now = True
+            self.__stream.stop_playback()
+            self.__kill_timer.start()
+
+    def __launch(self):
+        # The old process is gone, don't kill the new one
+        self.__kill_timer.stop()
+        self.__last_position = (0, 0, 0)
+        self.__last_progress = time.monotonic()
+        self.__running_since = time.monotonic()
+        self.__stream.start_playback()
+
+        # Streams following another stream's capture are supervised through their host
+        if self.__stream.host() is None:
+            self.__watchdog.start()
+
+    @pyqtSlot(bool)
+    def __state_changed(self, running):
+        if running or self.__stream.host() is not None:
+            return
+
+        # state_change(False) is also emitted for refused starts, check the process
+        if self.__stream.state() != QProcess.ProcessState.NotRunning:
+            return
+
+        self.__kill_timer.stop()
+        self.__watchdog.stop()
+
+        if not self.__active:
+            return
+
+        if self.__restart_now:
+            self.__restart_now = False
+            self.__launch()
+            return
+
+        self.exits += 1
+        print("Stream stopped unexpectedly:", self.__stream.config().get("name", "Unknown"))
+        self.__schedule_restart()
+
+    @pyqtSlot(object)
+    def __progress(self, record):
+        # Audio only outputs have no frame count, their output time and size still grow
+        position = (record.frame, record.out_time_us, record.total_size)
+        if not any(new > old for new, old in zip(position, self.__last_position)):
+            return
+
+        now = time.monotonic()
+        self.__last_position = position
+        self.__last_progress = now
+        self.__close_downtime()
+
+        # Running fine for a while, forget earlier failures
+        if self.__attempt and self.__running_since and now - self.__running_since > self.stable_time:
+            self.__attempt = 0
+
+    def __check_stall(self):
+        if self.__stream.state() != QProcess.ProcessState.Running:
+            return
+
+        if time.monotonic() - self.__last_progress < self.stall_timeout:
+            return
+
+        self.stalls += 1
+        print("Stream stalled, no output for", self.stall_timeout, "seconds:", self.__stream.config().get("name", "Unknown"))
+
+        # The exit is handled like a crash and restarts with backoff
+        self.__watchdog.stop()
+        self.__stream.stop_playback()
+        self.__kill_timer.start()
+
+    def __schedule_restart(self):
+        now = time.monotonic()
+        if self.__down_since is None:
+            self.__down_since = now
+
+        while self.__recent and now - self.__recent[0] > self.restart_window:
+            self.__recent.popleft()
+
+        if len(self.__recent) >= self.max_restarts:
+            reason = f"{len(self.__recent)} restarts within {self.restart_window} seconds"
+            print("Giving up on stream:", self.__stream.config().get("name", "Unknown"), "-", reason)
+            self.__active = False
+            self.__close_downtime()
+            self.gave_up.emit(reason)
+            self.active_changed.emit(False)
+            return
+
+        delay = min(self.backoff_max, self.backoff_base * (2 ** self.__attempt))
+        delay *= random.uniform(0.5, 1.0)
+        self.__attempt += 1
+
+        print(f"Restarting in {delay:.1f} seconds:", self.__stream.config().get("name", "Unknown"))
+        self.__restart_timer.start(int(delay * 1000))
+
+    def __restart(self):
+        if not self.__active:
+            return
+
+        self.__recent.append(time.monotonic())
+        self.restarts += 1
+        self.__launch()
+        self.restarted.emit(self.restarts)
+
+    def __close_downtime(self):
+        if self.__down_since is not None:
+            self.downtime += time.monotonic() - self.__down_since
+            self.__down_since = None
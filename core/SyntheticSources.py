@@ -0,0 +1,38 @@
+# Generated sources backed by ffmpeg's lavfi device. They are stored as regular
+# video/audio configs whose device is "lavfi:<filter>", so they can be used
+# anywhere a camera or microphone can, without any hardware attached.
+
+VIDEO_SOURCES = {
+    "lavfi:testsrc2": "Test Pattern",
+    "lavfi:smptehdbars": "SMPTE Color Bars",
+}
+
+AUDIO_SOURCES = {
+    "lavfi:sine": "Sine Tone",
+    "lavfi:anoisesrc": "White Noise",
+}
+
+def is_synthetic(device):
+    return str(device).startswith("lavfi:")
+
+def video_source_string(config):
+    filter = config["device"][len("lavfi:"):]
+    size = str(config["width"]) + "x" + str(config["height"])
+    return [
+        "-re",
+        "-f", "lavfi",
+        "-i", f"{filter}=size={size}:rate={config['framerate']}",
+    ]
+
+def audio_source_string(config):
+    filter = config["device"][len("lavfi:"):]
+    if filter == "sine":
+        source = "sine=frequency=1000:sample_rate=48000"
+    else:
+        source = f"{filter}=sample_rate=48000"
+
+    return [
+        "-re",
+        "-f", "lavfi",
+        "-i", f"{source},aformat=channel_layouts={config['channels']}c",
+    ]
@@ -0,0 +1,66 @@
+# Machine-readable wallclock timestamps burned into the video.
+#
+# The input is timestamped with the wallclock (-use_wallclock_as_timestamps)
+# and -copyts stops ffmpeg from shifting the timestamps to start at 0, so a
+# frame's time T in the filter graph is the epoch time it was captured.
+# A strip of BITS black/white blocks in the top left corner encodes that time
+# in milliseconds modulo 2^BITS, followed by a white and a black reference
+# block. A receiver crops the strip, decodes the code and compares it with its
+# own clock.
+
+BITS = 32
+BLOCK = 16
+WIDTH = (BITS + 2) * BLOCK
+HEIGHT = BLOCK
+MODULUS = 1 << BITS
+
+def input_options():
+    return ["-use_wallclock_as_timestamps", "1"]
+
+# For the whole command, it applies to every output
+def global_options():
+    return ["-copyts"]
+
+def filter_string():
+    ms = "floor(T*1000)"
+    bit = f"mod(floor({ms}/pow(2,floor(X/{BLOCK}))),2)"
+    # Blocks 0..BITS-1 carry the code, then one white and one black reference
+    lum = f"if(lt(X,{BITS * BLOCK}),255*{bit},if(lt(X,{(BITS + 1) * BLOCK}),255,0))"
+    return (
+        f"split[main][strip];"
+        f"[strip]crop={WIDTH}:{HEIGHT}:0:0,format=gray,geq=lum='{lum}',format=yuv420p[code];"
+        f"[main][code]overlay=0:0"
+    )
+
+# Crop filter a receiver applies before reading gray frames of WIDTH x HEIGHT bytes
+def receiver_filter():
+    return f"crop={WIDTH}:{HEIGHT}:0:0,format=gray"
+
+# Returns the encoded millisecond code, or None if the strip isn't readable
+def decode(frame):
+    if len(frame) < WIDTH * HEIGHT:
+        return None
+
+    row = (HEIGHT // 2) * WIDTH
+    centre = BLOCK // 2
+
+    white = frame[row + BITS * BLOCK + centre]
+    black = frame[row + (BITS + 1) * BLOCK + centre]
+    if white - black < 64:
+        return None
+
+    threshold = (white + black) // 2
+    code = 0
+    for b in range(BITS):
+        if frame[row + b * BLOCK + centre] > threshold:
+            code |= 1 << b
+
+    return code
+
+# Milliseconds between the encoded time and `now` (epoch seconds)
+def latency_ms(code, now):
+    delta = (int(now * 1000) - code) % MODULUS
+    if delta >= MODULUS // 2:
+        # Receiver clock behind the sender, not a usable sample
+        return None
+    return delta
@@ -0,0 +1,308 @@
+import ctypes
+import errno
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Minimal V4L2 bindings (linux/videodev2.h) for capability probing without
+# spawning v4l2-ctl or ffmpeg. The ioctl/open/close callables are injectable so
+# the enumeration logic can be driven by a fake device.
+
+def _IOC(direction, type, nr, size):
+    return (direction << 30) | (size << 16) | (ord(type) << 8) | nr
+
+def _IOR(type, nr, struct):
+    return _IOC(2, type, nr, ctypes.sizeof(struct))
+
+def _IOWR(type, nr, struct):
+    return _IOC(3, type, nr, ctypes.sizeof(struct))
+
+V4L2_CAP_VIDEO_CAPTURE = 0x00000001
+V4L2_CAP_VIDEO_CAPTURE_MPLANE = 0x00001000
+V4L2_CAP_DEVICE_CAPS = 0x80000000
+
+V4L2_BUF_TYPE_VIDEO_CAPTURE = 1
+
+V4L2_FMT_FLAG_COMPRESSED = 0x0001
+
+V4L2_FRMSIZE_TYPE_DISCRETE = 1
+V4L2_FRMSIZE_TYPE_CONTINUOUS = 2
+V4L2_FRMSIZE_TYPE_STEPWISE = 3
+
+V4L2_FRMIVAL_TYPE_DISCRETE = 1
+V4L2_FRMIVAL_TYPE_CONTINUOUS = 2
+V4L2_FRMIVAL_TYPE_STEPWISE = 3
+
+class v4l2_capability(ctypes.Structure):
+    _fields_ = [
+        ("driver", ctypes.c_char * 16),
+        ("card", ctypes.c_char * 32),
+        ("bus_info", ctypes.c_char * 32),
+        ("version", ctypes.c_uint32),
+        ("capabilities", ctypes.c_uint32),
+        ("device_caps", ctypes.c_uint32),
+        ("reserved", ctypes.c_uint32 * 3),
+    ]
+
+class v4l2_fmtdesc(ctypes.Structure):
+    _fields_ = [
+        ("index", ctypes.c_uint32),
+        ("type", ctypes.c_uint32),
+        ("flags", ctypes.c_uint32),
+        ("description", ctypes.c_char * 32),
+        ("pixelformat", ctypes.c_uint32),
+        ("mbus_code", ctypes.c_uint32),
+        ("reserved", ctypes.c_uint32 * 3),
+    ]
+
+class v4l2_frmsize_discrete(ctypes.Structure):
+    _fields_ = [
+        ("width", ctypes.c_uint32),
+        ("height", ctypes.c_uint32),
+    ]
+
+class v4l2_frmsize_stepwise(ctypes.Structure):
+    _fields_ = [
+        ("min_width", ctypes.c_uint32),
+        ("max_width", ctypes.c_uint32),
+        ("step_width", ctypes.c_uint32),
+        ("min_height", ctypes.c_uint32),
+        ("max_height", ctypes.c_uint32),
+        ("step_height", ctypes.c_uint32),
+    ]
+
+class _frmsize_union(ctypes.Union):
+    _fields_ = [
+        ("discrete", v4l2_frmsize_discrete),
+        ("stepwise", v4l2_frmsize_stepwise),
+    ]
+
+class v4l2_frmsizeenum(ctypes.Structure):
+    _anonymous_ = ("u",)
+    _fields_ = [
+        ("index", ctypes.c_uint32),
+        ("pixel_format", ctypes.c_uint32),
+        ("type", ctypes.c_uint32),
+        ("u", _frmsize_union),
+        ("reserved", ctypes.c_uint32 * 2),
+    ]
+
+class v4l2_fract(ctypes.Structure):
+    _fields_ = [
+        ("numerator", ctypes.c_uint32),
+        ("denominator", ctypes.c_uint32),
+    ]
+
+class v4l2_frmival_stepwise(ctypes.Structure):
+    _fields_ = [
+        ("min", v4l2_fract),
+        ("max", v4l2_fract),
+        ("step", v4l2_fract),
+    ]
+
+class _frmival_union(ctypes.Union):
+    _fields_ = [
+        ("discrete", v4l2_fract),
+        ("stepwise", v4l2_frmival_stepwise),
+    ]
+
+class v4l2_frmivalenum(ctypes.Structure):
+    _anonymous_ = ("u",)
+    _fields_ = [
+        ("index", ctypes.c_uint32),
+        ("pixel_format", ctypes.c_uint32),
+        ("width", ctypes.c_uint32),
+        ("height", ctypes.c_uint32),
+        ("type", ctypes.c_uint32),
+        ("u", _frmival_union),
+        ("reserved", ctypes.c_uint32 * 2),
+    ]
+
+VIDIOC_QUERYCAP = _IOR("V", 0, v4l2_capability)
+VIDIOC_ENUM_FMT = _IOWR("V", 2, v4l2_fmtdesc)
+VIDIOC_ENUM_FRAMESIZES = _IOWR("V", 74, v4l2_frmsizeenum)
+VIDIOC_ENUM_FRAMEINTERVALS = _IOWR("V", 75, v4l2_frmivalenum)
+
+# V4L2 fourcc -> ffmpeg pixel format/codec name, as accepted by -input_format
+FFMPEG_FORMATS = {
+    "YUYV": "yuyv422",
+    "UYVY": "uyvy422",
+    "YVYU": "yvyu422",
+    "YU12": "yuv420p",
+    "YV12": "yuv420p",
+    "422P": "yuv422p",
+    "411P": "yuv411p",
+    "NV12": "nv12",
+    "NV21": "nv21",
+    "NV16": "nv16",
+    "GREY": "gray",
+    "Y16 ": "gray16le",
+    "RGB3": "rgb24",
+    "BGR3": "bgr24",
+    "RGBP": "rgb565le",
+    "RGBO": "rgb555le",
+    "BGR4": "bgr0",
+    "RGB4": "0rgb",
+    "XR24": "bgr0",
+    "XB24": "rgb0",
+    "AR24": "bgra",
+    "AB24": "rgba",
+    "MJPG": "mjpeg",
+    "JPEG": "mjpeg",
+    "H264": "h264",
+    "HEVC": "hevc",
+    "MPG4": "mpeg4",
+    "H263": "h263",
+    "VP80": "vp8",
+    "VP90": "vp9",
+}
+
+def fourcc_to_str(value):
+    return "".join(chr((value >> (8 * i)) & 0xFF) for i in range(4))
+
+def str_to_fourcc(text):
+    return sum(ord(c) << (8 * i) for i, c in enumerate(text[:4].ljust(4)))
+
+def _decode(raw):
+    return raw.decode("utf-8", errors="replace")
+
+class V4L2Device():
+    def __init__(self, path, ioctl=None, open=None, close=None):
+        self.__path = path
+        self.__ioctl = ioctl
+        self.__open = open if open else (lambda path: os.open(path, os.O_RDWR | os.O_NONBLOCK))
+        self.__close = close if close else os.close
+        self.__fd = None
+
+    def __enter__(self):
+        if self.__ioctl is None:
+            if fcntl is None:
+                raise OSError(errno.ENOSYS, "ioctl not available")
+            self.__ioctl = lambda fd, request, arg: fcntl.ioctl(fd, request, arg, True)
+
+        self.__fd = self.__open(self.__path)
+        return self
+
+    def __exit__(self, *args):
+        if self.__fd is not None:
+            self.__close(self.__fd)
+            self.__fd = None
+
+    def query_capabilities(self):
+        cap = v4l2_capability()
+        self.__ioctl(self.__fd, VIDIOC_QUERYCAP, cap)
+
+        caps = cap.device_caps if cap.capabilities & V4L2_CAP_DEVICE_CAPS else cap.capabilities
+
+        return {
+            "driver": _decode(cap.driver),
+            "card": _decode(cap.card),
+            "bus_info": _decode(cap.bus_info),
+            "version": cap.version,
+            "capabilities": cap.capabilities,
+            "device_caps": caps,
+            "capture": bool(caps & (V4L2_CAP_VIDEO_CAPTURE | V4L2_CAP_VIDEO_CAPTURE_MPLANE)),
+        }
+
+    def enum_formats(self, buf_type=V4L2_BUF_TYPE_VIDEO_CAPTURE):
+        formats = []
+
+        for desc in self.__enumerate(v4l2_fmtdesc, VIDIOC_ENUM_FMT, type=buf_type):
+            fourcc = fourcc_to_str(desc.pixelformat)
+            sizes = self.enum_frame_sizes(desc.pixelformat)
+
+            formats.append({
+                "fourcc": fourcc,
+                "name": FFMPEG_FORMATS.get(fourcc, "Unsupported"),
+                "description": _decode(desc.description),
+                "compressed": bool(desc.flags & V4L2_FMT_FLAG_COMPRESSED),
+                "sizes": sizes,
+                "resolutions": [size["text"] for size in sizes],
+            })
+
+        return formats
+
+    def enum_frame_sizes(self, pixel_format):
+        sizes = []
+
+        for size in self.__enumerate(v4l2_frmsizeenum, VIDIOC_ENUM_FRAMESIZES, pixel_format=pixel_format):
+            if size.type == V4L2_FRMSIZE_TYPE_DISCRETE:
+                width, height = size.discrete.width, size.discrete.height
+                sizes.append({
+                    "width": width,
+                    "height": height,
+                    "text": f"{width}x{height}",
+                    "intervals": self.enum_frame_intervals(pixel_format, width, height),
+                })
+            else:
+                # Continuous/stepwise sizes are a single range, intervals are
+                # reported for the largest size.
+                s = size.stepwise
+                sizes.append({
+                    "width": s.max_width,
+                    "height": s.max_height,
+                    "min_width": s.min_width,
+                    "min_height": s.min_height,
+                    "step_width": s.step_width,
+                    "step_height": s.step_height,
+                    "text": f"{{{s.min_width}-{s.max_width}, {s.step_width}}}x{{{s.min_height}-{s.max_height}, {s.step_height}}}",
+                    "intervals": self.enum_frame_intervals(pixel_format, s.max_width, s.max_height),
+                })
+                break
+
+        return sizes
+
+    # Returns the frame intervals, [numerator, denominator] in seconds per frame.
+    # Discrete ones as {"type": "discrete", "interval": [n, d]}, a continuous or
+    # stepwise range as {"type": "continuous"/"stepwise", "min": .., "max": .., "step": ..}.
+    def enum_frame_intervals(self, pixel_format, width, height):
+        intervals = []
+
+        for ival in self.__enumerate(v4l2_frmivalenum, VIDIOC_ENUM_FRAMEINTERVALS,
+                                     pixel_format=pixel_format, width=width, height=height):
+            if ival.type == V4L2_FRMIVAL_TYPE_DISCRETE:
+                intervals.append({
+                    "type": "discrete",
+                    "interval": [ival.discrete.numerator, ival.discrete.denominator],
+                })
+            else:
+                s = ival.stepwise
+                intervals.append({
+                    "type": "continuous" if ival.type == V4L2_FRMIVAL_TYPE_CONTINUOUS else "stepwise",
+                    "min": [s.min.numerator, s.min.denominator],
+                    "max": [s.max.numerator, s.max.denominator],
+                    "step": [s.step.numerator, s.step.denominator],
+                })
+                break
+
+        return intervals
+
+    # Call an ENUM_* ioctl with increasing indexes until the driver returns EINVAL
+    def __enumerate(self, struct, request, **fields):
+        index = 0
+        while True:
+            item = struct()
+            item.index = index
+            for name, value in fields.items():
+                setattr(item, name, value)
+
+            try:
+                self.__ioctl(self.__fd, request, item)
+            except OSError as e:
+                if e.errno == errno.EINVAL:
+                    return
+                raise
+
+            yield item
+            index += 1
+
+def probe_device(path, **kwargs):
+    with V4L2Device(path, **kwargs) as device:
+        return device.query_capabilities()
+
+def probe_formats(path, **kwargs):
+    with V4L2Device(path, **kwargs) as device:
+        return [format for format in device.enum_formats() if format["name"] != "Unsupported"]
@@ -0,0 +1,128 @@
+#!/usr/bin/python
+
+# Imported first, start up times are measured from here
+from core.StartupProfiler import StartupProfiler
+profiler = StartupProfiler.instance()
+
+import argparse
+import signal
+import sys
+
+# Only QtCore, the widget stack isn't needed without a display
+from PyQt6.QtCore import QCoreApplication, QSettings, QTimer
+from core.SettingsManager import SettingsManager
+from core.PlaybackController import PlaybackController
+from core.SignalNotifier import SignalNotifier
+from core.ControlServer import ControlServer, parse_listen
+
+# Headless entry point, e.g. for running as a systemd service (see pistreamer.service).
+# Streams the enabled stream configs made with the GUI until SIGTERM or SIGINT.
+
+class Daemon():
+    def __init__(self, settings, stats_interval, show_profile=False, control=None):
+        self.__settings = SettingsManager(settings)
+        self.__playback = PlaybackController(self.__settings)
+        self.__playback.state_change.connect(self.__state_changed)
+        self.__playback.ready.connect(self.__ready)
+        self.__stopping = False
+        self.__show_profile = show_profile
+
+        self.__stats_timer = QTimer()
+        self.__stats_timer.setInterval(int(stats_interval * 1000))
+        self.__stats_timer.timeout.connect(self.__log_stats)
+        self.__stats_interval = stats_interval
+
+        self.__control = ControlServer(self.__playback) if control else None
+        self.__control_address = control
+
+    def start(self):
+        with profiler.measure("load settings"):
+            self.__settings.load_settings()
+        if not self.__settings.num_stream_configs():
+            print("No streams configured, set them up with main.py first")
+
+        self.__playback.start_playback()
+        if self.__control:
+            self.__control.listen(*self.__control_address)
+        if self.__stats_interval > 0:
+            self.__stats_timer.start()
+
+    def stop(self):
+        if self.__stopping:
+            return
+
+        self.__stopping = True
+        self.__stats_timer.stop()
+        if self.__control:
+            self.__control.close()
+        self.__playback.stop_playback()
+
+        # ffmpeg normally exits within a second, the supervisors kill it after 3
+        if self.__playback.state():
+            QTimer.singleShot(5000, QCoreApplication.instance().quit)
+        else:
+            QCoreApplication.instance().quit()
+
+    def __ready(self, ready):
+        if ready and "all streams ready" not in profiler.marks():
+            profiler.mark("all streams ready")
+            if self.__show_profile:
+                profiler.print_report()
+
+    def __state_changed(self, state):
+        if not state and self.__stopping:
+            QCoreApplication.instance().quit()
+
+    def __log_stats(self):
+        for id in self.__playback.stream_ids():
+            stream = self.__playback.get_stream(id)
+            if not stream.config()["enabled"]:
+                continue
+
+            metrics = stream.metrics()
+            usage = stream.resource_usage()
+            supervisor = self.__playback.get_supervisor(id)
+            print(f"{stream.config().get('name', 'Unknown')}:",
+                  f"{metrics.latest('fps'):.1f} fps,",
+                  f"{metrics.latest('bitrate'):.0f} kb/s,",
+                  f"speed {metrics.latest('speed'):.2f}x,",
+                  f"{metrics.latest('drop'):.0f} dropped,",
+                  f"cpu {usage.cpu_percent:.0f}%,",
+                  f"rss {usage.rss / 1048576:.1f} MiB,",
+                  f"{supervisor.restarts} restarts")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the configured streams without a GUI.")
+    parser.add_argument("--settings", help="INI file with the configs instead of the user's settings")
+    parser.add_argument("--control", type=parse_listen, metavar="[ADDRESS:]PORT", help="serve the HTTP control and metrics API, on localhost unless an address is given")
+    parser.add_argument("--startup-profile", action="store_true", help="print start up timing once every stream is streaming")
+    parser.add_argument("--stats-interval", type=float, default=30, help="seconds between stats log lines, 0 to disable")
+    args = parser.parse_args()
+
+    # Logs go to the journal, don't hold them back in a buffer
+    sys.stdout.reconfigure(line_buffering=True)
+
+    app = QCoreApplication(sys.argv)
+    app.setOrganizationDomain("com")
+    app.setOrganizationName("ahl")
+    app.setApplicationName("PiStreamer")
+
+    app.aboutToQuit.connect(lambda: print("Exiting..."))
+
+    settings = QSettings(args.settings, QSettings.Format.IniFormat) if args.settings else None
+    daemon = Daemon(settings, args.stats_interval, args.startup_profile, args.control)
+
+    def on_signal(signum):
+        print()
+        print(signal.Signals(signum).name, "received")
+        daemon.stop()
+
+    # Stop the streams cleanly on systemctl stop and Ctrl+C
+    notifier = SignalNotifier([signal.SIGTERM, signal.SIGINT])
+    notifier.received.connect(on_signal)
+
+    QTimer.singleShot(0, daemon.start)
+    sys.exit(app.exec())
+
+if __name__ == "__main__":
+    main()
@@ -9,11 +9,11 @@ from PyQt6.QtCore import Qt, QSettings
 from core.PlaybackOptions import PlaybackOptions
 
 class AudioSettingsDialog(QDialog):
-    def __init__(self, settings, parent, index):
+    def __init__(self, settings, parent, id):
         super().__init__(parent)
 
         self.__settings = settings
-        self.__index = index
+        self.__id = id
 
         self.setWindowTitle("Audio Settings")
 
@@ -25,8 +25,8 @@ class AudioSettingsDialog(QDialog):
         grid_layout = QGridLayout()
 
         config = {}
-        if isinstance(self.__index, int):
-            config = self.__settings.get_audio_config(self.__index)
+        if isinstance(self.__id, int):
+            config = self.__settings.get_audio_config(self.__id)
 
         grid_layout.addWidget(QLabel("Name:"), 0, 0)
         self.name_edit = QLineEdit(config.get("name", "Default"))
@@ -36,15 +36,19 @@ class AudioSettingsDialog(QDialog):
         grid_layout.addWidget(QLabel("Device:"), 1, 0)
         self.device = QComboBox()
         self.device.setModel(devices)
+        devices.rowsInserted.connect(self.__select_pending_device)
         self.device.currentIndexChanged.connect(self.__device_changed)
+        self.device.activated.connect(self.__device_activated)
         grid_layout.addWidget(self.device, 1, 1)
 
         grid_layout.addWidget(QLabel("Format:"), 2, 0)
         self.format = QComboBox()
+        self.format.activated.connect(self.__format_activated)
         grid_layout.addWidget(self.format, 2, 1)
 
         grid_layout.addWidget(QLabel("Channels:"), 3, 0)
         self.channels = QComboBox()
+        self.channels.activated.connect(self.__channels_activated)
         grid_layout.addWidget(self.channels, 3, 1)
 
         model = QStandardItemModel()
@@ -74,52 +78,93 @@ class AudioSettingsDialog(QDialog):
 
         self.setLayout(layout)
 
-        # Initialize
-        dev_name = config.get("device", "hw:2,0")
+        # Initialize, devices and channels are selected once their probes report them
+        self.__pending_device = config.get("device", "hw:2,0")
+        self.__pending_format = config.get("format", "S16LE")
+        self.__pending_channels = config.get("channels", "1")
+        self.__device_changed(self.device.currentIndex())
+        self.__select_pending_device()
+
+    def done(self, result):
+        # Don't deliver probe results to a closed dialog
+        self.options.Cancel()
+        super().done(result)
+
+    def __select_pending_device(self):
+        if self.__pending_device is None:
+            return
+
+        devices = self.device.model()
         for row in range(devices.rowCount()):
             item = devices.item(row)
-            if item.data(Qt.ItemDataRole.UserRole) == dev_name:
+            if item.data(Qt.ItemDataRole.UserRole) == self.__pending_device:
+                self.__pending_device = None
                 self.device.setCurrentIndex(row)
-                self.__device_changed(row)
                 break
 
-        format = config.get("format", "S16LE")
+    def __select_pending_format(self):
+        if self.__pending_format is None:
+            return
+
         format_model = self.format.model()
         for row in range(format_model.rowCount()):
             item = format_model.item(row)
-            if item.data(Qt.ItemDataRole.UserRole) == format:
+            if item.data(Qt.ItemDataRole.UserRole) == self.__pending_format:
+                self.__pending_format = None
                 self.format.setCurrentIndex(row)
                 break
 
-        channel = config.get("channels", "1")
+    def __select_pending_channels(self):
+        if self.__pending_channels is None:
+            return
+
         channel_model = self.channels.model()
         for row in range(channel_model.rowCount()):
             item = channel_model.item(row)
-            if item.data(Qt.ItemDataRole.UserRole) == channel:
+            if str(item.data(Qt.ItemDataRole.UserRole)) == str(self.__pending_channels):
+                self.__pending_channels = None
                 self.channels.setCurrentIndex(row)
                 break
 
+    def __device_activated(self, row):
+        # User picked a device, stop waiting for the configured one
+        self.__pending_device = None
+
+    def __format_activated(self, row):
+        self.__pending_format = None
+
+    def __channels_activated(self, row):
+        self.__pending_channels = None
+
     def __device_changed(self, row):
+        if row < 0:
+            return
+
         formats = self.options.GetAudioFormats(self.device.currentData())
+        formats.rowsInserted.connect(self.__select_pending_format)
         self.format.setModel(formats)
+        self.__select_pending_format()
 
         channels = self.options.GetAudioChannels(self.device.currentData())
+        channels.rowsInserted.connect(self.__select_pending_channels)
         self.channels.setModel(channels)
+        self.__select_pending_channels()
 
     def __save_clicked(self):
-        if isinstance(self.__index, int):
-            config = self.__settings.get_audio_config(self.__index)
+        if isinstance(self.__id, int):
+            config = self.__settings.get_audio_config(self.__id)
         else:
             config = {"enabled": True}
 
         config["name"] = self.name_edit.text()
-        config["device"] = self.device.currentData()
-        config["format"] = self.format.currentData()
-        config["channels"] = self.channels.currentData()
+        # Keep the configured values if their probes haven't finished yet
+        config["device"] = self.__pending_device if self.__pending_device is not None else self.device.currentData()
+        config["format"] = self.__pending_format if self.__pending_format is not None else self.format.currentData()
+        config["channels"] = self.__pending_channels if self.__pending_channels is not None else self.channels.currentData()
         config["encoder"] = self.encoder.currentData()
 
-        if isinstance(self.__index, int):
-            self.__settings.update_audio_config(self.__index, config)
+        if isinstance(self.__id, int):
+            self.__settings.update_audio_config(self.__id, config)
         else:
-            config["stream"] = self.__index
+            config["stream"] = self.__id
             self.__settings.add_audio_config(config)
\ No newline at end of file
@@ -1,14 +1,25 @@
-from PyQt6.QtWidgets import QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QGridLayout, QPushButton, QGroupBox, QLabel, QSizePolicy, QTableView, QTreeView, QToolButton, QHeaderView, QStyledItemDelegate, QStyleOptionButton, QStyle, QMenu
-from PyQt6.QtCore import Qt, QSettings, QRect, QTimer
+from PyQt6.QtWidgets import QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QGridLayout, QPushButton, QGroupBox, QLabel, QSizePolicy, QTableView, QTreeView, QToolButton, QHeaderView, QStyledItemDelegate, QStyleOptionButton, QStyle, QMenu, QMessageBox
+from PyQt6.QtCore import Qt, QSettings, QRect, QTimer, pyqtSignal
 from PyQt6.QtGui import QIcon, QStandardItemModel, QStandardItem
 
 from core.SettingsManager import SettingsManager
 from core.PlaybackController import PlaybackController
-from gui.StreamSettingsDialog import StreamSettingsDialog
-from gui.VideoSettingsDialog import VideoSettingsDialog
-from gui.AudioSettingsDialog import AudioSettingsDialog
+from gui.StatsPresenter import StatsPresenter
+from core.StartupProfiler import StartupProfiler
+
+# The settings dialogs (and the device probing they bring in) are imported
+# when first opened, they aren't needed to show the window.
+
+# Seconds of history shown in the trend columns
+STATS_WINDOW = 60
+
+# Lengths offered by "Save Replay"
+REPLAY_MINUTES = [1, 5, 15]
 
 class MainWindow(QMainWindow):
+    # Signals
+    first_paint = pyqtSignal()
+
     def __init__(self):
         super().__init__()
 
@@ -25,6 +36,7 @@ class MainWindow(QMainWindow):
 
         self._playback = PlaybackController(self._settings)
         self._playback.state_change.connect(self.__playback_state_change)
+        self._playback.ready.connect(self.__playback_ready_change)
 
         self.setWindowTitle("Pi Streamer")
         
@@ -52,17 +64,35 @@ class MainWindow(QMainWindow):
         central_widget.setLayout(layout)
 
         # Initialize
-        self._settings.load_settings()
+        with StartupProfiler.instance().measure("load settings"):
+            self._settings.load_settings()
+
+        self.__painted = False
+
+    def playback(self):
+        return self._playback
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+
+        if not self.__painted:
+            self.__painted = True
+            StartupProfiler.instance().mark("first paint")
+            self.first_paint.emit()
 
     def _build_stream_table(self):
         # Build Model
         self.stream_model = QStandardItemModel()
-        self.stream_model.setHorizontalHeaderLabels(["Name", "Type", "Frame Rate", "Bit Rate"])
+        self.stream_model.setHorizontalHeaderLabels(["Name", "Type", "Frame Rate", "Bit Rate", "FPS Trend", "Bit Rate Trend", "CPU", "Memory", "Switches", "I/O"])
         self.stream_model.itemChanged.connect(self.__model_item_changed)
 
+        self.__stream_stats = {}
+        self.__stats_presenter = StatsPresenter(self.stream_model, self.__render_stream_stats,
+                                                locate=lambda id: self._settings.get_stream_config(id)["display_item"].row())
+
         tree = QTreeView()
         tree.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-        tree.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        tree.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAsNeeded)
         tree.setEditTriggers(tree.EditTrigger.NoEditTriggers)
         tree.setModel(self.stream_model)
         tree.setMinimumWidth(600)
@@ -81,6 +111,13 @@ class MainWindow(QMainWindow):
         tree.setColumnWidth(2, 120)
         header.setSectionResizeMode(3, QHeaderView.ResizeMode.Fixed)
         tree.setColumnWidth(3, 150)
+        header.setSectionResizeMode(4, QHeaderView.ResizeMode.Fixed)
+        tree.setColumnWidth(4, 250)
+        header.setSectionResizeMode(5, QHeaderView.ResizeMode.Fixed)
+        tree.setColumnWidth(5, 250)
+        for column, width in ((6, 70), (7, 90), (8, 90), (9, 150)):
+            header.setSectionResizeMode(column, QHeaderView.ResizeMode.Fixed)
+            tree.setColumnWidth(column, width)
         header.setStretchLastSection(False)
 
         tree.expandAll()
@@ -93,10 +130,7 @@ class MainWindow(QMainWindow):
     def __open_context_menu(self, position):
         index = self.stream_table.indexAt(position)
 
-        # Don't allow editing if currently running
-        if self._playback.state():
-            return
-
+        # Changes are applied to running streams, see PlaybackController.__configs_changed
         menu = QMenu()
         new_stream = menu.addAction("New Stream...")
         new_stream.triggered.connect(self._add_stream_button_clicked)
@@ -106,7 +140,7 @@ class MainWindow(QMainWindow):
             item = self.stream_model.itemFromIndex(index)
 
             index = index.siblingAtColumn(0)
-            data_index = self.stream_model.itemFromIndex(index).data(Qt.ItemDataRole.UserRole)
+            config_id = self.stream_model.itemFromIndex(index).data(Qt.ItemDataRole.UserRole)
 
             if item.text() == "Stream":
                 edit_stream = menu.addAction("Edit Stream...")
@@ -115,24 +149,31 @@ class MainWindow(QMainWindow):
                 new_video = menu.addAction("New Video Source...")
                 new_audio = menu.addAction("New Audio Source...")
 
-                edit_stream.triggered.connect(lambda clicked: self._edit_stream_button_clicked(data_index, clicked))
-                remove_stream.triggered.connect(lambda clicked: self._remove_stream_button_clicked(data_index, clicked))
-                new_video.triggered.connect(lambda clicked: self._add_video_button_clicked(data_index, clicked))
-                new_audio.triggered.connect(lambda clicked: self._add_audio_button_clicked(data_index, clicked))
+                edit_stream.triggered.connect(lambda clicked: self._edit_stream_button_clicked(config_id, clicked))
+                remove_stream.triggered.connect(lambda clicked: self._remove_stream_button_clicked(config_id, clicked))
+                new_video.triggered.connect(lambda clicked: self._add_video_button_clicked(config_id, clicked))
+                new_audio.triggered.connect(lambda clicked: self._add_audio_button_clicked(config_id, clicked))
+
+                if self._settings.get_stream_config(config_id).get("record"):
+                    menu.addSeparator()
+                    replay_menu = menu.addMenu("Save Replay")
+                    for minutes in REPLAY_MINUTES:
+                        action = replay_menu.addAction(f"Last {minutes} Minute{'s' if minutes > 1 else ''}")
+                        action.triggered.connect(lambda clicked, minutes=minutes: self._save_replay_clicked(config_id, minutes, clicked))
             if item.text() == "Video":
                 menu.addSeparator()
                 edit = menu.addAction("Edit Video Source...")
                 remove = menu.addAction("Remove Video Source")
 
-                edit.triggered.connect(lambda clicked: self._edit_video_button_clicked(data_index, clicked))
-                remove.triggered.connect(lambda clicked: self._remove_video_button_clicked(data_index, clicked))
+                edit.triggered.connect(lambda clicked: self._edit_video_button_clicked(config_id, clicked))
+                remove.triggered.connect(lambda clicked: self._remove_video_button_clicked(config_id, clicked))
             if item.text() == "Audio":
                 menu.addSeparator()
                 edit = menu.addAction("Edit Audio Source...")
                 remove = menu.addAction("Remove Audio Source")
 
-                edit.triggered.connect(lambda clicked: self._edit_audio_button_clicked(data_index, clicked))
-                remove.triggered.connect(lambda clicked: self._remove_audio_button_clicked(data_index, clicked))
+                edit.triggered.connect(lambda clicked: self._edit_audio_button_clicked(config_id, clicked))
+                remove.triggered.connect(lambda clicked: self._remove_audio_button_clicked(config_id, clicked))
             menu.addSeparator()
 
         menu.exec(self.stream_table.viewport().mapToGlobal(position))
@@ -169,22 +210,22 @@ class MainWindow(QMainWindow):
 
     def __model_item_changed(self, item):
         if item.isCheckable():
-            index = item.data(Qt.ItemDataRole.UserRole)
+            id = item.data(Qt.ItemDataRole.UserRole)
             model_index = item.index()
             type = self.stream_model.itemFromIndex(model_index.sibling(model_index.row(), 1)).text()
             new_state = item.checkState() == Qt.CheckState.Checked
             if type == "Stream":
-                stream = self._settings.get_stream_config(index)
+                stream = self._settings.get_stream_config(id)
                 stream["enabled"] = new_state
-                self._settings.update_stream_config(index, stream)
+                self._settings.update_stream_config(id, stream)
             elif type == "Video":
-                video = self._settings.get_video_config(index)
+                video = self._settings.get_video_config(id)
                 video["enabled"] = new_state
-                self._settings.update_video_config(index, video)
+                self._settings.update_video_config(id, video)
             elif type == "Audio":
-                audio = self._settings.get_audio_config(index)
+                audio = self._settings.get_audio_config(id)
                 audio["enabled"] = new_state
-                self._settings.update_audio_config(index, audio)
+                self._settings.update_audio_config(id, audio)
 
     def __create_base_row(self, name, type, enabled = True):
         # Populate Model
@@ -197,37 +238,92 @@ class MainWindow(QMainWindow):
 
         return row
 
-    def _stream_config_added(self, index, config):
+    def _stream_config_added(self, id, config):
         # Build Row
         row = self.__create_base_row(config["name"], "Stream", config["enabled"])
         row.append(QStandardItem("0.0 FPS"))
         row.append(QStandardItem("0.00 kb/s"))
+        row.append(QStandardItem(""))
+        row.append(QStandardItem(""))
+        row += [QStandardItem("") for column in range(4)]
 
         # Populate Model
         self.stream_model.appendRow(row)
 
         # Store for use by video/audio sources
         config["display_item"] = row[0]
-        row[0].setData(config["index"], Qt.ItemDataRole.UserRole)
+        row[0].setData(config["id"], Qt.ItemDataRole.UserRole)
 
         # Handle connecting to playback after current signal has been handled because
         # playback source hasn't been created yet.
-        QTimer.singleShot(0, lambda: self.__stream_config_added_playback(index))
-
-    def __stream_config_added_playback(self, index):
-        stream = self._playback.get_stream(index)
-        stream.fps.connect(lambda fps, i=index: self.__stream_fps_updated(i, fps))
-        stream.bitrate.connect(lambda bitrate, i=index: self.__stream_bitrate_updated(i, bitrate))
+        QTimer.singleShot(0, lambda: self.__stream_config_added_playback(id))
 
-    def __stream_fps_updated(self, index, fps):
-        item = self.stream_model.item(index, 2)
-        item.setText(str(fps) + " FPS")
-
-    def __stream_bitrate_updated(self, index, bitrate):
-        item = self.stream_model.item(index, 3)
-        item.setText(f"{float(bitrate):.1f} kb/s")
+    def __stream_config_added_playback(self, id):
+        # Removed again in the meantime
+        if id not in self._playback.stream_ids():
+            return
 
-    def _stream_config_changed(self, index, config):
+        stream = self._playback.get_stream(id)
+        self.__stream_stats[id] = {"fps": 0.0, "bitrate": 0.0, "stream": stream}
+        stream.fps.connect(lambda fps, id=id: self.__stream_fps_updated(id, fps))
+        stream.bitrate.connect(lambda bitrate, id=id: self.__stream_bitrate_updated(id, bitrate))
+        stream.resources.connect(lambda sample, id=id: self.__stats_presenter.mark_dirty(id))
+
+    # Stats only record the latest value here, the presenter renders them at a capped rate
+    def __stream_fps_updated(self, id, fps):
+        if id in self.__stream_stats:
+            self.__stream_stats[id]["fps"] = fps
+            self.__stats_presenter.mark_dirty(id)
+
+    def __stream_bitrate_updated(self, id, bitrate):
+        if id in self.__stream_stats:
+            self.__stream_stats[id]["bitrate"] = bitrate
+            self.__stats_presenter.mark_dirty(id)
+
+    def __render_stream_stats(self, id):
+        stats = self.__stream_stats.get(id)
+        if stats is None:
+            return {}
+
+        metrics = stats["stream"].metrics()
+        fps = metrics.stats("fps", STATS_WINDOW)
+        bitrate = metrics.stats("bitrate", STATS_WINDOW)
+
+        quality = ""
+        level = stats["stream"].quality_level()
+        if level > 0:
+            quality = f", quality lowered {level} step{'s' if level > 1 else ''}"
+
+        columns = {
+            2: (f"{stats['fps']:.1f} FPS", None),
+            3: (f"{float(stats['bitrate']):.1f} kb/s", None),
+            4: (f"{metrics.sparkline('fps', STATS_WINDOW)} {fps['min']:.1f}/{fps['mean']:.1f}/{fps['max']:.1f}",
+                f"Last {STATS_WINDOW}s min/avg/max, p95 {fps['p95']:.1f} FPS, "
+                f"{metrics.delta('drop', STATS_WINDOW):.0f} dropped, "
+                f"speed {metrics.latest('speed'):.2f}x{quality}"),
+            5: (f"{metrics.sparkline('bitrate', STATS_WINDOW)} {bitrate['min']:.0f}/{bitrate['mean']:.0f}/{bitrate['max']:.0f}",
+                f"Last {STATS_WINDOW}s min/avg/max, p95 {bitrate['p95']:.0f} kb/s"),
+        }
+        columns.update(self.__render_resources(stats["stream"]))
+        return columns
+
+    # Columns 6-9 from the ffmpeg process' latest ProcessSample
+    def __render_resources(self, stream):
+        sample = stream.resource_usage()
+        if not sample.pid:
+            return {6: ("", None), 7: ("", None), 8: ("", None), 9: ("", None)}
+
+        shared = "" if stream.host() is None else f"\nShared with {stream.host().config().get('name', 'Unknown')}"
+        return {
+            6: (f"{sample.cpu_percent:.0f}%", f"PID {sample.pid}, {sample.threads} threads{shared}"),
+            7: (f"{sample.rss / 1048576:.1f} MiB", None),
+            8: (f"{sample.context_switch_rate:.0f}/s",
+                f"{sample.context_switches} total, {sample.involuntary_switches} involuntary"),
+            9: (f"r {sample.read_rate / 1024:.0f} / w {sample.write_rate / 1024:.0f} kB/s",
+                f"{sample.read_bytes / 1048576:.1f} MiB read, {sample.write_bytes / 1048576:.1f} MiB written"),
+        }
+
+    def _stream_config_changed(self, id, config):
         item = config["display_item"]
         item.setText(config.get("name"))
 
@@ -235,21 +331,33 @@ class MainWindow(QMainWindow):
         if checked != config["enabled"]:
             item.setCheckState(Qt.CheckState.Unchecked if checked else Qt.CheckState.Checked)
 
-    def _stream_config_removed(self, index, config):
+    def _stream_config_removed(self, id, config):
+        self.__stream_stats.pop(id, None)
         self.stream_model.removeRow(config["display_item"].row())
 
+    def _save_replay_clicked(self, id, minutes, clicked):
+        self._playback.save_replay(id, minutes, self.__replay_saved)
+
+    def __replay_saved(self, path):
+        if path:
+            QMessageBox.information(self, "Replay Saved", f"Saved to {path}")
+        else:
+            QMessageBox.warning(self, "Replay Not Saved", "Nothing was recorded in that time.")
+
     def _add_stream_button_clicked(self, clicked):
+        from gui.StreamSettingsDialog import StreamSettingsDialog
         dialog = StreamSettingsDialog(self._settings, self, -1)
         dialog.exec()
 
-    def _remove_stream_button_clicked(self, index, clicked):
-        self._settings.remove_stream_config(index)
+    def _remove_stream_button_clicked(self, id, clicked):
+        self._settings.remove_stream_config(id)
 
-    def _edit_stream_button_clicked(self, index, clicked):
-        dialog = StreamSettingsDialog(self._settings, self, index)
+    def _edit_stream_button_clicked(self, id, clicked):
+        from gui.StreamSettingsDialog import StreamSettingsDialog
+        dialog = StreamSettingsDialog(self._settings, self, id)
         dialog.exec()
 
-    def _video_config_added(self, index, config):
+    def _video_config_added(self, id, config):
         # Build Row
         row = self.__create_base_row(config["name"], "Video", config["enabled"])
 
@@ -261,9 +369,9 @@ class MainWindow(QMainWindow):
 
         # Store for use by streams
         config["display_item"] = row[0]
-        row[0].setData(config["index"], Qt.ItemDataRole.UserRole)
+        row[0].setData(config["id"], Qt.ItemDataRole.UserRole)
 
-    def _video_config_changed(self, index, video_config):
+    def _video_config_changed(self, id, video_config):
         item = video_config["display_item"]
         item.setText(video_config.get("name"))
 
@@ -271,21 +379,23 @@ class MainWindow(QMainWindow):
         if checked != video_config["enabled"]:
             item.setCheckState(Qt.CheckState.Unchecked if checked else Qt.CheckState.Checked)
 
-    def _video_config_removed(self, index, config):
+    def _video_config_removed(self, id, config):
         config["stream"]["display_item"].removeRow(config["display_item"].row())
 
-    def _add_video_button_clicked(self, stream_index, clicked):
-        dialog = VideoSettingsDialog(self._settings, self, self._settings.get_stream_config(stream_index))
+    def _add_video_button_clicked(self, stream_id, clicked):
+        from gui.VideoSettingsDialog import VideoSettingsDialog
+        dialog = VideoSettingsDialog(self._settings, self, self._settings.get_stream_config(stream_id))
         dialog.exec()
 
-    def _remove_video_button_clicked(self, index, clicked):
-        self._settings.remove_video_config(index)
+    def _remove_video_button_clicked(self, id, clicked):
+        self._settings.remove_video_config(id)
 
-    def _edit_video_button_clicked(self, index, clicked):
-        dialog = VideoSettingsDialog(self._settings, self, index)
+    def _edit_video_button_clicked(self, id, clicked):
+        from gui.VideoSettingsDialog import VideoSettingsDialog
+        dialog = VideoSettingsDialog(self._settings, self, id)
         dialog.exec()
 
-    def _audio_config_added(self, index, config):
+    def _audio_config_added(self, id, config):
         # Build Row
         row = self.__create_base_row(config["name"], "Audio", config["enabled"])
 
@@ -297,9 +407,9 @@ class MainWindow(QMainWindow):
 
         # Store for use by streams
         config["display_item"] = row[0]
-        row[0].setData(config["index"], Qt.ItemDataRole.UserRole)
+        row[0].setData(config["id"], Qt.ItemDataRole.UserRole)
 
-    def _audio_config_changed(self, index, config):
+    def _audio_config_changed(self, id, config):
         item = config["display_item"]
         item.setText(config.get("name"))
 
@@ -307,21 +417,24 @@ class MainWindow(QMainWindow):
         if checked != config["enabled"]:
             item.setCheckState(Qt.CheckState.Unchecked if checked else Qt.CheckState.Checked)
 
-    def _audio_config_removed(self, index, config):
+    def _audio_config_removed(self, id, config):
         config["stream"]["display_item"].removeRow(config["display_item"].row())
 
-    def _add_audio_button_clicked(self, stream_index, clicked):
-        dialog = AudioSettingsDialog(self._settings, self, self._settings.get_stream_config(stream_index))
+    def _add_audio_button_clicked(self, stream_id, clicked):
+        from gui.AudioSettingsDialog import AudioSettingsDialog
+        dialog = AudioSettingsDialog(self._settings, self, self._settings.get_stream_config(stream_id))
         dialog.exec()
 
-    def _remove_audio_button_clicked(self, index, clicked):
-        self._settings.remove_audio_config(index)
+    def _remove_audio_button_clicked(self, id, clicked):
+        self._settings.remove_audio_config(id)
 
-    def _edit_audio_button_clicked(self, index, clicked):
-        dialog = AudioSettingsDialog(self._settings, self, index)
+    def _edit_audio_button_clicked(self, id, clicked):
+        from gui.AudioSettingsDialog import AudioSettingsDialog
+        dialog = AudioSettingsDialog(self._settings, self, id)
         dialog.exec()
 
     def _settings_button_clicked(self, clicked):
+        from gui.VideoSettingsDialog import VideoSettingsDialog
         dialog = VideoSettingsDialog(self._settings, self)
         dialog.exec()
     
@@ -330,18 +443,27 @@ class MainWindow(QMainWindow):
     
     def __playback_state_change(self, state):
         if state:
+            # Orange until every stream is producing output
             self.__start_button.setText("Stop")
-            self.__start_button.setStyleSheet("background-color: red;")
+            self.__start_button.setStyleSheet("background-color: orange;")
         else:
             self.__start_button.setText("Start")
             self.__start_button.setStyleSheet("background-color: green;")
+            self.__start_button.setToolTip("")
 
-        # Disable Video/Audio state.
-        for row in range(self.stream_model.rowCount()):
-            stream_item = self.stream_model.item(row, 0)  # root item (column 0)
-            stream_item.setEnabled(not state)
-
-            for source in range(stream_item.rowCount()):
-                source_item = stream_item.child(source, 0)
-                source_item.setEnabled(not state)
+    def __playback_ready_change(self, ready):
+        if not self._playback.state():
+            return
 
+        self.__start_button.setStyleSheet("background-color: red;" if ready else "background-color: orange;")
+
+        # Start up time of each stream, shows which device is slow to open
+        lines = []
+        for entry in self._playback.startup_report():
+            if entry["error"]:
+                lines.append(f"{entry['name']}: {entry['error']}")
+            elif "streaming" in entry["phases"]:
+                lines.append(f"{entry['name']}: first output after {entry['phases']['streaming']:.2f}s")
+            else:
+                lines.append(f"{entry['name']}: {entry['phase'] or 'waiting'}")
+        self.__start_button.setToolTip("\n".join(lines))
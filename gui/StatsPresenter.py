@@ -0,0 +1,41 @@
+from PyQt6.QtCore import QObject, QTimer
+
+# Batches stats updates for the stream tree.
+#
+# Streams only mark their row dirty when a progress record arrives. Rows are
+# rendered at most `max_rate` times per second and items are only touched when
+# their text actually changed, so busy streams don't cause a repaint per record.
+class StatsPresenter(QObject):
+    def __init__(self, model, render, max_rate=2, locate=None):
+        super().__init__()
+
+        self.__model = model
+        self.__render = render      # render(key) -> {column: (text, tooltip)}
+        self.__locate = locate if locate is not None else (lambda key: key)    # key -> row
+        self.__dirty = set()
+
+        self.__timer = QTimer(self)
+        self.__timer.setSingleShot(True)
+        self.__timer.setInterval(int(1000 / max_rate))
+        self.__timer.timeout.connect(self.flush)
+
+    def mark_dirty(self, key):
+        self.__dirty.add(key)
+        if not self.__timer.isActive():
+            self.__timer.start()
+
+    def flush(self):
+        dirty = self.__dirty
+        self.__dirty = set()
+
+        for key in dirty:
+            columns = self.__render(key)
+            row = self.__locate(key) if columns else None
+            for column, (text, tooltip) in columns.items():
+                item = self.__model.item(row, column)
+                if item is None:
+                    continue
+                if item.text() != text:
+                    item.setText(text)
+                if tooltip is not None and item.toolTip() != tooltip:
+                    item.setToolTip(tooltip)
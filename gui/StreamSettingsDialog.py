@@ -6,12 +6,17 @@ from PyQt6.QtWidgets import (
 from PyQt6.QtGui import QStandardItemModel, QStandardItem
 from PyQt6.QtCore import Qt, QSettings
 
+from core import OutputProfiles
+from core.ReplayBuffer import DEFAULT_DIRECTORY, DEFAULT_MAX_SIZE
+
+import os
+
 class StreamSettingsDialog(QDialog):
-    def __init__(self, settings, parent, index):
+    def __init__(self, settings, parent, id):
         super().__init__(parent)
 
         self.__settings = settings
-        self.__index = index
+        self.__id = id
 
         self.setWindowTitle("Stream Settings")
         self.setMinimumWidth(500)
@@ -21,8 +26,8 @@ class StreamSettingsDialog(QDialog):
         grid_layout = QGridLayout()
 
         config = {}
-        if self.__index >= 0:
-            config = self.__settings.get_stream_config(self.__index)
+        if self.__id >= 0:
+            config = self.__settings.get_stream_config(self.__id)
 
         grid_layout.addWidget(QLabel("Name:"), 0, 0)
         self.name_edit = QLineEdit(config.get("name", "Default"))
@@ -32,6 +37,85 @@ class StreamSettingsDialog(QDialog):
         self.address_edit = QLineEdit(config.get("address", "udp://127.0.0.1:5000"))
         grid_layout.addWidget(self.address_edit, 1, 1)
 
+        grid_layout.addWidget(QLabel("Output Profile:"), 2, 0)
+        self.profile_combo = QComboBox()
+        for key, profile in OutputProfiles.PROFILES.items():
+            self.profile_combo.addItem(profile["name"], key)
+        index = self.profile_combo.findData(config.get("output_profile", OutputProfiles.DEFAULT))
+        self.profile_combo.setCurrentIndex(max(0, index))
+        grid_layout.addWidget(self.profile_combo, 2, 1)
+
+        # Restart the stream when no new frames arrive for this long
+        grid_layout.addWidget(QLabel("Stall Timeout:"), 3, 0)
+        self.stall_timeout_spin = QSpinBox()
+        self.stall_timeout_spin.setRange(2, 600)
+        self.stall_timeout_spin.setSuffix(" s")
+        self.stall_timeout_spin.setValue(int(config.get("stall_timeout", 10)))
+        grid_layout.addWidget(self.stall_timeout_spin, 3, 1)
+
+        # Lower x264 settings while the encoder can't keep up
+        self.adaptive_quality_check = QCheckBox("Adaptive quality")
+        self.adaptive_quality_check.setChecked(bool(config.get("adaptive_quality", False)))
+        grid_layout.addWidget(self.adaptive_quality_check, 4, 1)
+
+        # Scheduling of the stream's ffmpeg process
+        grid_layout.addWidget(QLabel("CPU Cores:"), 5, 0)
+        self.cpu_affinity_edit = QLineEdit(str(config.get("cpu_affinity", "auto")))
+        self.cpu_affinity_edit.setToolTip("\"auto\" to spread streams over the cores, e.g. \"2,3\" to pin, empty for any core")
+        grid_layout.addWidget(self.cpu_affinity_edit, 5, 1)
+
+        grid_layout.addWidget(QLabel("Nice Level:"), 6, 0)
+        self.nice_spin = QSpinBox()
+        self.nice_spin.setRange(-20, 19)
+        self.nice_spin.setToolTip("Negative values need privileges")
+        self.nice_spin.setValue(int(config.get("nice", 0)))
+        grid_layout.addWidget(self.nice_spin, 6, 1)
+
+        self.realtime_check = QCheckBox("Realtime priority (audio only streams)")
+        self.realtime_check.setChecked(bool(config.get("realtime", False)))
+        grid_layout.addWidget(self.realtime_check, 7, 1)
+
+        grid_layout.addWidget(QLabel("CPU Limit:"), 8, 0)
+        self.cpu_max_spin = QSpinBox()
+        self.cpu_max_spin.setRange(0, 100 * (os.cpu_count() or 1))
+        self.cpu_max_spin.setSuffix(" %")
+        self.cpu_max_spin.setSpecialValueText("None")
+        self.cpu_max_spin.setValue(int(config.get("cpu_max", 0)))
+        grid_layout.addWidget(self.cpu_max_spin, 8, 1)
+
+        grid_layout.addWidget(QLabel("Memory Limit:"), 9, 0)
+        self.memory_max_spin = QSpinBox()
+        self.memory_max_spin.setRange(0, 65536)
+        self.memory_max_spin.setSuffix(" MiB")
+        self.memory_max_spin.setSpecialValueText("None")
+        self.memory_max_spin.setValue(int(config.get("memory_max", 0)))
+        grid_layout.addWidget(self.memory_max_spin, 9, 1)
+
+        # Local recording into a ring of segments, see ReplayBuffer
+        self.record_check = QCheckBox("Record locally")
+        self.record_check.setChecked(bool(config.get("record", False)))
+        grid_layout.addWidget(self.record_check, 10, 1)
+
+        grid_layout.addWidget(QLabel("Recording Folder:"), 11, 0)
+        self.record_directory_edit = QLineEdit(config.get("record_directory", ""))
+        self.record_directory_edit.setPlaceholderText(DEFAULT_DIRECTORY)
+        grid_layout.addWidget(self.record_directory_edit, 11, 1)
+
+        grid_layout.addWidget(QLabel("Keep Up To:"), 12, 0)
+        self.record_max_size_spin = QSpinBox()
+        self.record_max_size_spin.setRange(64, 1048576)
+        self.record_max_size_spin.setSuffix(" MiB")
+        self.record_max_size_spin.setValue(int(config.get("record_max_size", DEFAULT_MAX_SIZE)))
+        grid_layout.addWidget(self.record_max_size_spin, 12, 1)
+
+        grid_layout.addWidget(QLabel("Keep For:"), 13, 0)
+        self.record_max_minutes_spin = QSpinBox()
+        self.record_max_minutes_spin.setRange(0, 10080)
+        self.record_max_minutes_spin.setSuffix(" min")
+        self.record_max_minutes_spin.setSpecialValueText("No limit")
+        self.record_max_minutes_spin.setValue(int(config.get("record_max_minutes", 0)))
+        grid_layout.addWidget(self.record_max_minutes_spin, 13, 1)
+
         layout.addLayout(grid_layout)
 
         # Buttons: Save / Cancel
@@ -50,15 +134,27 @@ class StreamSettingsDialog(QDialog):
         self.setLayout(layout)
 
     def __save_clicked(self):
-        if self.__index >= 0:
-            config = self.__settings.get_stream_config(self.__index)
+        if self.__id >= 0:
+            config = self.__settings.get_stream_config(self.__id)
         else:
             config = {"enabled": True}
 
         config["name"] = self.name_edit.text()
         config["address"] = self.address_edit.text()
+        config["output_profile"] = self.profile_combo.currentData()
+        config["stall_timeout"] = self.stall_timeout_spin.value()
+        config["adaptive_quality"] = self.adaptive_quality_check.isChecked()
+        config["cpu_affinity"] = self.cpu_affinity_edit.text().strip()
+        config["nice"] = self.nice_spin.value()
+        config["realtime"] = self.realtime_check.isChecked()
+        config["cpu_max"] = self.cpu_max_spin.value()
+        config["memory_max"] = self.memory_max_spin.value()
+        config["record"] = self.record_check.isChecked()
+        config["record_directory"] = self.record_directory_edit.text().strip()
+        config["record_max_size"] = self.record_max_size_spin.value()
+        config["record_max_minutes"] = self.record_max_minutes_spin.value()
 
-        if self.__index >= 0:
-            self.__settings.update_stream_config(self.__index, config)
+        if self.__id >= 0:
+            self.__settings.update_stream_config(self.__id, config)
         else:
             self.__settings.add_stream_config(config)
\ No newline at end of file
@@ -5,8 +5,11 @@ from PyQt6.QtWidgets import (
 )
 from PyQt6.QtCore import Qt, QSettings
 from core.PlaybackOptions import PlaybackOptions
+from core.DeviceProber import DeviceProber
+from core import EncoderTuner
 
 import sys
+import threading
 
 class InputTab(QWidget):
     def __init__(self, options):
@@ -14,16 +17,23 @@ class InputTab(QWidget):
 
         self.options = options
 
+        # Values from the config to select once the probes report them
+        self.__pending_device = None
+        self.__pending_format = None
+
         layout = QGridLayout()
 
         layout.addWidget(QLabel("Device: "), 0, 0)
         self.device = QComboBox()
         self.device.setModel(options.GetDevices())
+        self.device.model().rowsInserted.connect(self.__select_pending_device)
         self.device.currentIndexChanged.connect(self.__device_changed)
+        self.device.activated.connect(self.__device_activated)
         layout.addWidget(self.device, 0, 1)
 
         layout.addWidget(QLabel("Format: "), 1, 0)
         self.format = QComboBox()
+        self.format.activated.connect(self.__format_activated)
         layout.addWidget(self.format, 1, 1)
 
         layout.addWidget(QLabel("Resolution: "), 2, 0)
@@ -49,30 +59,56 @@ class InputTab(QWidget):
         layout.setRowStretch(4, 1)
         self.setLayout(layout)
 
+        # Cached devices are already in the model
+        self.__device_changed(self.device.currentIndex())
+
     def __device_changed(self, index):
-        device = self.device.model().item(self.device.currentIndex()).data(Qt.ItemDataRole.UserRole)
+        if index < 0:
+            return
+
+        device = self.device.model().item(index).data(Qt.ItemDataRole.UserRole)
         model = self.options.GetFormats(device)
+        model.rowsInserted.connect(self.__select_pending_format)
         self.format.setModel(model)
         self.format.setModelColumn(2)
+        self.__select_pending_format()
+
+    def __device_activated(self, index):
+        # User picked a device, stop waiting for the configured one
+        self.__pending_device = None
+
+    def __format_activated(self, index):
+        self.__pending_format = None
+
+    def __select_pending_device(self):
+        if self.__pending_device is None:
+            return
 
-    def LoadSettings(self, config):
-        device = config.get("device", "/dev/video0")
         model = self.device.model()
         for row in range(model.rowCount()):
             item = model.item(row)
-            if item.data(Qt.ItemDataRole.UserRole) == device:
+            if item.data(Qt.ItemDataRole.UserRole) == self.__pending_device:
+                self.__pending_device = None
                 self.device.setCurrentIndex(row)
-                self.__device_changed(row)
                 break
 
-        format = config.get("format", "rgb24")
+    def __select_pending_format(self):
+        if self.__pending_format is None:
+            return
+
         model = self.format.model()
         for row in range(model.rowCount()):
             item = model.item(row, 1)
-            if item.text() == format:
+            if item.text() == self.__pending_format:
+                self.__pending_format = None
                 self.format.setCurrentIndex(row)
                 break
 
+    def LoadSettings(self, config):
+        self.__pending_device = config.get("device", "/dev/video0")
+        self.__pending_format = config.get("format", "rgb24")
+        self.__select_pending_device()
+
         width = config.get("width", 1920)
         self.resolution_width.setValue(int(width))
 
@@ -83,18 +119,31 @@ class InputTab(QWidget):
         self.framerate.setValue(int(framerate))
 
     def GetSettings(self):
+        # Keep the configured values if their probes haven't finished yet
+        device = self.__pending_device
+        if device is None:
+            device = self.device.currentData()
+
+        format = self.__pending_format
+        if format is None:
+            format = self.format.model().item(self.format.currentIndex(), 1).text()
+
         return {
-            "device": self.device.currentData(),
-            "format": self.format.model().item(self.format.currentIndex(), 1).text(),
+            "device": device,
+            "format": format,
             "width": self.resolution_width.value(),
             "height": self.resolution_height.value(),
             "framerate": self.framerate.value()
         }
 
 class EncoderTab(QWidget):
-    def __init__(self, options):
+    def __init__(self, options, input_tab):
         super().__init__()
 
+        self.__input_tab = input_tab
+        self.__tune_job = None
+        self.__tune_cancel = None
+
         layout = QGridLayout()
         layout.setColumnStretch(0, 0)
         layout.setColumnStretch(1, 1)
@@ -113,7 +162,34 @@ class EncoderTab(QWidget):
         self.crf_edit.setMaximum(28)
         layout.addWidget(self.crf_edit, 1, 1)
 
-        layout.setRowStretch(2, 1)
+        self.preset_label = QLabel("Preset: ")
+        layout.addWidget(self.preset_label, 2, 0)
+
+        self.preset = QComboBox()
+        self.preset.addItems(EncoderTuner.PRESETS)
+        layout.addWidget(self.preset, 2, 1)
+
+        self.threads_label = QLabel("Threads: ")
+        layout.addWidget(self.threads_label, 3, 0)
+
+        self.threads = QSpinBox()
+        self.threads.setMinimum(0)
+        self.threads.setMaximum(16)
+        self.threads.setSpecialValueText("Auto")
+        layout.addWidget(self.threads, 3, 1)
+
+        self.timestamp_overlay = QCheckBox("Latency timestamp overlay")
+        layout.addWidget(self.timestamp_overlay, 4, 1)
+
+        self.tune_button = QPushButton("Auto Tune")
+        self.tune_button.clicked.connect(self.__tune_clicked)
+        layout.addWidget(self.tune_button, 5, 0)
+
+        self.tune_status = QLabel("")
+        self.tune_status.setWordWrap(True)
+        layout.addWidget(self.tune_status, 5, 1)
+
+        layout.setRowStretch(6, 1)
         self.setLayout(layout)
 
     def __encoder_changed(self, index):
@@ -122,6 +198,49 @@ class EncoderTab(QWidget):
         enable = encoder == "libx264"
         self.crf_label.setEnabled(enable)
         self.crf_edit.setEnabled(enable)
+        self.preset_label.setEnabled(enable)
+        self.preset.setEnabled(enable)
+        self.threads_label.setEnabled(enable)
+        self.threads.setEnabled(enable)
+        self.timestamp_overlay.setEnabled(enable)
+
+    def __tune_clicked(self):
+        settings = self.__input_tab.GetSettings()
+
+        self.tune_button.setEnabled(False)
+        self.tune_status.setText("Benchmarking presets, this takes a few minutes...")
+        # Cancelling the job doesn't stop a tuner that is already running, it
+        # checks this between benchmark runs
+        cancel = threading.Event()
+        self.__tune_cancel = cancel
+        self.__tune_job = DeviceProber.instance().submit(
+            lambda timeout: EncoderTuner.tune(settings["width"], settings["height"], settings["framerate"],
+                                              timeout=timeout, cancel=cancel),
+            callback=self.__tune_finished, timeout=30)
+
+    def __tune_finished(self, result):
+        self.__tune_job = None
+        self.__tune_cancel = None
+        self.tune_button.setEnabled(True)
+
+        best = result["best"] if result else None
+        if best is None:
+            self.tune_status.setText("No settings keep up in realtime on this device.")
+            return
+
+        self.encoder.setCurrentText("libx264")
+        self.crf_edit.setValue(best["crf"])
+        self.preset.setCurrentText(best["preset"])
+        self.threads.setValue(best["threads"])
+        self.tune_status.setText(f"{best['preset']}, CRF {best['crf']} runs at {best['speed']:.2f}x")
+
+    def Cancel(self):
+        if self.__tune_cancel is not None:
+            self.__tune_cancel.set()
+            self.__tune_cancel = None
+        if self.__tune_job is not None:
+            DeviceProber.instance().cancel(self.__tune_job)
+            self.__tune_job = None
 
     def LoadSettings(self, config):
         encoder = config.get("encoder", "libx264")
@@ -129,6 +248,9 @@ class EncoderTab(QWidget):
 
         if encoder == "libx264":
             self.crf_edit.setValue(int(config.get("crf", "0")))
+            self.preset.setCurrentText(config.get("preset", "superfast"))
+            self.threads.setValue(int(config.get("threads", "0")))
+            self.timestamp_overlay.setChecked(bool(config.get("timestamp_overlay", False)))
 
     def GetSettings(self):
         config = {}
@@ -138,15 +260,18 @@ class EncoderTab(QWidget):
 
         if encoder == "libx264":
             config["crf"] = self.crf_edit.value()
+            config["preset"] = self.preset.currentText()
+            config["threads"] = self.threads.value()
+            config["timestamp_overlay"] = self.timestamp_overlay.isChecked()
 
         return config
 
 class VideoSettingsDialog(QDialog):
-    def __init__(self, settings, parent, index):
+    def __init__(self, settings, parent, id):
         super().__init__(parent)
 
         self.__settings = settings
-        self.__index = index
+        self.__id = id
 
         self.setWindowTitle("Video Settings")
 
@@ -163,17 +288,18 @@ class VideoSettingsDialog(QDialog):
 
         # Setup Tabs
         tabs = QTabWidget()
+        input_tab = InputTab(options)
         self.__tabs = [
-            InputTab(options),
-            EncoderTab(options)
+            input_tab,
+            EncoderTab(options, input_tab)
         ]
         display_names = ["Input", "Encoder", "Output"]
         for tab, label in zip(self.__tabs, display_names):
             tabs.addTab(tab, label)
 
         config = {}
-        if isinstance(self.__index, int):
-            config = self.__settings.get_video_config(self.__index)
+        if isinstance(self.__id, int):
+            config = self.__settings.get_video_config(self.__id)
 
         self.name_edit.setText(config.get("name", "Default"))
         for tab in self.__tabs:
@@ -196,9 +322,17 @@ class VideoSettingsDialog(QDialog):
 
         self.setLayout(layout)
 
+        self.__options = options
+
+    def done(self, result):
+        # Don't deliver probe results to a closed dialog
+        self.__options.Cancel()
+        self.__tabs[1].Cancel()
+        super().done(result)
+
     def __save_clicked(self):
-        if isinstance(self.__index, int):
-            config = self.__settings.get_video_config(self.__index)
+        if isinstance(self.__id, int):
+            config = self.__settings.get_video_config(self.__id)
         else:
             config = {"enabled": True}
 
@@ -206,8 +340,8 @@ class VideoSettingsDialog(QDialog):
         for tab in self.__tabs:
             config.update(tab.GetSettings())
 
-        if isinstance(self.__index, int):
-            self.__settings.update_video_config(self.__index, config)
+        if isinstance(self.__id, int):
+            self.__settings.update_video_config(self.__id, config)
         else:
-            config["stream"] = self.__index
+            config["stream"] = self.__id
             self.__settings.add_video_config(config)
\ No newline at end of file
@@ -1,14 +1,34 @@
 #!/usr/bin/python
 
+# Imported first, start up times are measured from here
+from core.StartupProfiler import StartupProfiler
+profiler = StartupProfiler.instance()
+
 import sys
 import signal
-from PyQt6.QtWidgets import QApplication
-from PyQt6.QtCore import QTimer
-from gui.MainWindow import MainWindow
+
+with profiler.measure("import PyQt6.QtWidgets"):
+    from PyQt6.QtWidgets import QApplication
+with profiler.measure("import MainWindow"):
+    from gui.MainWindow import MainWindow
+from core.SignalNotifier import SignalNotifier
 
 def main():
+    # Print start up timing once the window is on screen
+    show_profile = "--startup-profile" in sys.argv
+    if show_profile:
+        sys.argv.remove("--startup-profile")
+
+    # HTTP API and metrics, "--control 8080" or "--control 0.0.0.0:8080"
+    control = None
+    if "--control" in sys.argv:
+        i = sys.argv.index("--control")
+        control = sys.argv[i + 1] if i + 1 < len(sys.argv) else "8080"
+        del sys.argv[i:i + 2]
+
     # Create the Qt Application
-    app = QApplication(sys.argv)
+    with profiler.measure("create QApplication"):
+        app = QApplication(sys.argv)
     app.setOrganizationDomain("com")
     app.setOrganizationName("ahl")
     app.setApplicationName("PiStreamer")
@@ -29,21 +49,29 @@ def main():
 
     app.aboutToQuit.connect(lambda: print("Exiting..."))
 
-    def on_sigint(signum, frame):
+    def on_sigint(signum):
         print()
         print("SIGINT received")
         app.quit()
 
     # Handle Keyboard Interrupts
-    signal.signal(signal.SIGINT, on_sigint)
-
-    timer = QTimer()
-    timer.start(100)
-    timer.timeout.connect(lambda: None)
+    notifier = SignalNotifier([signal.SIGINT])
+    notifier.received.connect(on_sigint)
 
     # Create and show the main window
-    window = MainWindow()
+    with profiler.measure("create MainWindow"):
+        window = MainWindow()
     window.show()
+    profiler.mark("window shown")
+
+    if show_profile:
+        window.first_paint.connect(profiler.print_report)
+
+    # QtNetwork is only loaded when asked for
+    if control:
+        from core.ControlServer import ControlServer, parse_listen
+        server = ControlServer(window.playback())
+        server.listen(*parse_listen(control))
 
     # Run the main Qt loop
     sys.exit(app.exec())
@@ -0,0 +1,92 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from PyQt6.QtCore import QCoreApplication, QObject, QProcess, pyqtSignal
+from PyQt6.QtTest import QTest
+
+from core.StreamSupervisor import StreamSupervisor
+
+# Stands in for a PlaybackStream, a `sleep` takes the place of ffmpeg
+class SleepStream(QObject):
+    state_change = pyqtSignal(bool)
+    progress = pyqtSignal(object)
+
+    def __init__(self):
+        super().__init__()
+        self.__process = QProcess(self)
+        self.__process.stateChanged.connect(self.__state_changed)
+        self.starts = 0
+
+    def config(self):
+        return {"name": "Test", "enabled": True}
+
+    def plan_error(self):
+        return None
+
+    def host(self):
+        return None
+
+    def state(self):
+        return self.__process.state()
+
+    def pid(self):
+        return self.__process.processId()
+
+    def start_playback(self):
+        self.starts += 1
+        self.__process.start("sleep", ["30"])
+        self.__process.waitForStarted()
+
+    def stop_playback(self):
+        self.__process.terminate()
+
+    def kill_playback(self):
+        self.__process.kill()
+
+    def __state_changed(self, new_state):
+        self.state_change.emit(new_state == QProcess.ProcessState.Running)
+
+class StreamSupervisorTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.app = QCoreApplication.instance() or QCoreApplication([])
+
+    def setUp(self):
+        self.stream = SleepStream()
+        self.supervisor = StreamSupervisor(self.stream)
+
+    def tearDown(self):
+        self.supervisor.stop()
+        self.stream.kill_playback()
+        QTest.qWait(100)
+
+    # start_stream stops the supervisor of a stream that isn't running before starting it
+    def test_start_after_stop_while_stopped(self):
+        self.supervisor.stop()
+        self.supervisor.start()
+        pid = self.stream.pid()
+
+        QTest.qWait(3500)
+        self.assertEqual(self.stream.state(), QProcess.ProcessState.Running)
+        self.assertEqual(self.stream.pid(), pid)
+        self.assertEqual(self.supervisor.exits, 0)
+
+    def test_start_after_stop_while_running(self):
+        self.supervisor.start()
+        self.supervisor.stop()
+        QTest.qWait(500)
+        self.assertEqual(self.stream.state(), QProcess.ProcessState.NotRunning)
+
+        self.supervisor.start()
+        pid = self.stream.pid()
+
+        QTest.qWait(3500)
+        self.assertEqual(self.stream.state(), QProcess.ProcessState.Running)
+        self.assertEqual(self.stream.pid(), pid)
+        self.assertEqual(self.stream.starts, 2)
+
+if __name__ == "__main__":
+    unittest.main()